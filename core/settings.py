@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 import datetime
+import decimal
 import os
 from pathlib import Path
 
@@ -52,6 +53,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "utils.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -96,6 +98,66 @@ DATABASES = {
     },
 }
 
+# PostgreSQL connection pool (psycopg 3), shared by the threads of a worker process. Each
+# worker opens up to DB_POOL_MAX_SIZE connections, size it against max_connections.
+if os.getenv("DB_POOL") == "True":
+    DATABASES["default"].setdefault("OPTIONS", {})["pool"] = {
+        "min_size": int(os.getenv("DB_POOL_MIN_SIZE", "2")),
+        "max_size": int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+        "timeout": float(os.getenv("DB_POOL_TIMEOUT", "10")),
+    }
+
+# Server-side parameter binding, which lets psycopg prepare a statement once it has been
+# executed DB_PREPARE_THRESHOLD times on a connection (0 prepares every statement). Prepared
+# statements do not survive PgBouncer in transaction mode before 1.21.
+if os.getenv("DB_PREPARED_STATEMENTS") == "True":
+    DATABASES["default"].setdefault("OPTIONS", {}).update(
+        {
+            "server_side_binding": True,
+            "prepare_threshold": int(os.getenv("DB_PREPARE_THRESHOLD", "5")),
+        },
+    )
+
+# Longest time a statement waits for a row lock before failing with lock_not_available
+# (0 waits forever). Transfers and charge processing retry such failures, see below.
+DB_LOCK_TIMEOUT_MS = int(os.getenv("DB_LOCK_TIMEOUT_MS", "0"))
+if DB_LOCK_TIMEOUT_MS and "postgresql" in (DATABASES["default"]["ENGINE"] or ""):
+    DATABASES["default"].setdefault("OPTIONS", {})["options"] = f"-c lock_timeout={DB_LOCK_TIMEOUT_MS}"
+
+# Transactions that fail with a deadlock, serialization failure or lock timeout are run
+# again up to DB_RETRY_ATTEMPTS times in total, after a random delay of up to
+# DB_RETRY_BASE_DELAY_MS doubled on every attempt and capped at DB_RETRY_MAX_DELAY_MS.
+DB_RETRY_ATTEMPTS = int(os.getenv("DB_RETRY_ATTEMPTS", "3"))
+DB_RETRY_BASE_DELAY_MS = int(os.getenv("DB_RETRY_BASE_DELAY_MS", "20"))
+DB_RETRY_MAX_DELAY_MS = int(os.getenv("DB_RETRY_MAX_DELAY_MS", "500"))
+
+# Read replicas, one alias per DB_REPLICA_HOSTS entry ("host" or "host:port"), sharing the
+# primary's name and credentials. List and retrieve reads of the API go to the replicas when
+# DB_READ_FROM_REPLICAS is on; a user who wrote in the last DB_REPLICA_PIN_SECONDS reads from
+# the primary, and a replica that fails or lags more than DB_REPLICA_MAX_LAG_SECONDS is left
+# out for DB_REPLICA_RETRY_SECONDS. In tests the replicas mirror the test database; keep
+# DB_READ_FROM_REPLICAS off there, TestCase data is not visible to other connections.
+DB_REPLICA_HOSTS = [host for host in os.getenv("DB_REPLICA_HOSTS", "").split(",") if host]
+for index, replica_host in enumerate(DB_REPLICA_HOSTS):
+    replica_host, _, replica_port = replica_host.partition(":")
+    DATABASES[f"replica_{index}"] = {
+        **DATABASES["default"],
+        "HOST": replica_host,
+        "PORT": replica_port or DATABASES["default"]["PORT"],
+        "OPTIONS": {**DATABASES["default"].get("OPTIONS", {})},
+        "TEST": {"MIRROR": "default"},
+    }
+DB_READ_REPLICAS = (
+    [f"replica_{index}" for index in range(len(DB_REPLICA_HOSTS))]
+    if os.getenv("DB_READ_FROM_REPLICAS", "True") == "True"
+    else []
+)
+DB_REPLICA_PIN_SECONDS = int(os.getenv("DB_REPLICA_PIN_SECONDS", "5"))
+DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "2"))
+DB_REPLICA_CHECK_SECONDS = float(os.getenv("DB_REPLICA_CHECK_SECONDS", "5"))
+DB_REPLICA_RETRY_SECONDS = float(os.getenv("DB_REPLICA_RETRY_SECONDS", "30"))
+DATABASE_ROUTERS = ["utils.replicas.ReplicaRouter"]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -167,6 +229,13 @@ LOGGING_DICT = {
 LOGGING = LOGGING_DICT
 
 AUTH_USER_MODEL = "credit_charge.User"
+# Phone numbers are also logged in with, before usernames.
+AUTHENTICATION_BACKENDS = [
+    "credit_charge.backends.PhoneNumberBackend",
+    "django.contrib.auth.backends.ModelBackend",
+]
+# Country of phone numbers written in national form ("0912..."), see credit_charge.phone_numbers.
+PHONE_NUMBER_COUNTRY_CODE = os.getenv("PHONE_NUMBER_COUNTRY_CODE", "98")
 
 # Simple JWT Settings
 SIMPLE_JWT = {
@@ -180,24 +249,115 @@ SIMPLE_JWT = {
     "AUTH_TOKEN_CLASSES": ("rest_framework_simplejwt.tokens.AccessToken",),
     "TOKEN_TYPE_CLAIM": "token_type",
     "TOKEN_USER_CLASS": "rest_framework_simplejwt.models.TokenUser",
+    "TOKEN_OBTAIN_SERIALIZER": "credit_charge.serializers.TokenObtainPairSerializer",
 }
+# How long a user's token version is cached; revoked tokens keep working for at most this long
+# in processes that did not revoke them.
+TOKEN_VERSION_CACHE_SECONDS = int(os.getenv("TOKEN_VERSION_CACHE_SECONDS", "30"))
 
 # DRF settings
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "credit_charge.authentication.ClaimsJWTAuthentication",
     ],
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
     ],
     "DEFAULT_RENDERER_CLASSES": [
-        "rest_framework.renderers.JSONRenderer",
-        "rest_framework.renderers.BrowsableAPIRenderer",
+        "utils.renderers.ORJSONRenderer",
+        *(["rest_framework.renderers.BrowsableAPIRenderer"] if DEBUG else []),
     ],
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
-    "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
+    "DEFAULT_PAGINATION_CLASS": "utils.pagination.KeysetPagination",
     "PAGE_SIZE": 10,
 }
+# Lists are cursor paginated; `?page_size=` is capped and `?count=true` adds an estimated
+# (PostgreSQL, unfiltered) or cached total.
+PAGINATION_MAX_PAGE_SIZE = int(os.getenv("PAGINATION_MAX_PAGE_SIZE", "100"))
+PAGINATION_COUNT_CACHE_SECONDS = int(os.getenv("PAGINATION_COUNT_CACHE_SECONDS", "60"))
+# Rows fetched per server-side cursor round trip by the streaming exports (credit_charge.exports).
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "2000"))
+# Transactions and charges are partitioned by month on PostgreSQL (credit_charge.partitions):
+# manage_partitions keeps PARTITION_MONTHS_AHEAD future months created and writes archived
+# partitions to PARTITION_ARCHIVE_DIR.
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+PARTITION_ARCHIVE_DIR = os.getenv("PARTITION_ARCHIVE_DIR", str(BASE_DIR / "archive"))
+# Rules the charge worker (run_charge_worker) approves WAITING charges with, see
+# credit_charge.charge_rules. Rule names or dotted paths of ChargeRule subclasses.
+CHARGE_WORKER_RULES = [rule for rule in os.getenv("CHARGE_WORKER_RULES", "amount,trusted").split(",") if rule]
+CHARGE_AUTO_APPROVE_MAX_AMOUNT = decimal.Decimal(os.getenv("CHARGE_AUTO_APPROVE_MAX_AMOUNT", "0"))
+CHARGE_TRUSTED_PHONE_NUMBERS = [
+    phone_number for phone_number in os.getenv("CHARGE_TRUSTED_PHONE_NUMBERS", "").split(",") if phone_number
+]
+# Longest range, in days, that GET /api/v1/users/{phone_number}/summary/ answers from the rollups.
+USER_SUMMARY_MAX_DAYS = int(os.getenv("USER_SUMMARY_MAX_DAYS", "366"))
+# The transaction and charge admin changelists count filtered results up to ADMIN_COUNT_LIMIT
+# rows; unfiltered lists show the PostgreSQL row estimate.
+ADMIN_COUNT_LIMIT = int(os.getenv("ADMIN_COUNT_LIMIT", "10000"))
+
+# List and retrieve endpoints render `values()` rows directly instead of going through the
+# serializers. The output is identical; set to False to fall back to the serializers.
+API_FAST_READS = False if os.getenv("API_FAST_READS") == "False" else True
+
+# Serve the fast list and retrieve endpoints through the async ORM (credit_charge.async_views).
+# Only worth it under an ASGI server; docker-entrypoint.sh turns it on with SERVER=asgi.
+API_ASYNC_READS = os.getenv("API_ASYNC_READS") == "True"
+
+# Shared cache used for pagination counts, token versions and user cache versions. The
+# default LocMemCache is per process; use a shared backend when running several workers.
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv("CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.getenv("CACHE_LOCATION", ""),
+    },
+}
+
+# Cache of rendered users for nested user fields and user retrieval: "lru" keeps entries in
+# process, "django" in USER_CACHE_ALIAS, empty disables it. Entries are versioned in
+# USER_CACHE_ALIAS and invalidated by every balance write.
+USER_CACHE_BACKEND = os.getenv("USER_CACHE_BACKEND", "")
+USER_CACHE_ALIAS = os.getenv("USER_CACHE_ALIAS", "default")
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+USER_CACHE_TIMEOUT = int(os.getenv("USER_CACHE_TIMEOUT", "300"))
+
+# Transfer engine: "auto" runs transfers as a single SQL statement on PostgreSQL and
+# falls back to the ORM implementation on other backends.
+TRANSFER_ENGINE = os.getenv("TRANSFER_ENGINE", "auto")
+TRANSACTION_BATCH_MAX_SIZE = int(os.getenv("TRANSACTION_BATCH_MAX_SIZE", "1000"))
+
+# Group commit: transfers are queued, coalesced by seller and committed together every
+# TRANSFER_GROUP_COMMIT_INTERVAL_MS or TRANSFER_GROUP_COMMIT_MAX_BATCH items. Coalescing
+# happens inside a worker process, so it only pays off when a worker serves several requests
+# at once: a sync gunicorn worker has one transfer in flight at a time. docker-entrypoint.sh
+# starts gunicorn with GUNICORN_THREADS threads when it is enabled. A transfer still queued after TRANSFER_GROUP_COMMIT_TIMEOUT is cancelled;
+# one already committing is waited for once more before the request gives up.
+TRANSFER_GROUP_COMMIT = True if os.getenv("TRANSFER_GROUP_COMMIT") == "True" else False
+TRANSFER_GROUP_COMMIT_INTERVAL_MS = int(os.getenv("TRANSFER_GROUP_COMMIT_INTERVAL_MS", "5"))
+TRANSFER_GROUP_COMMIT_MAX_BATCH = int(os.getenv("TRANSFER_GROUP_COMMIT_MAX_BATCH", "100"))
+TRANSFER_GROUP_COMMIT_TIMEOUT = float(os.getenv("TRANSFER_GROUP_COMMIT_TIMEOUT", "5"))
+
+# Prometheus metrics are served at /metrics; when METRICS_TOKEN is set scrapers have to send
+# it as a bearer token.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Responses to requests sent with an Idempotency-Key header are replayed for this long.
+IDEMPOTENCY_KEY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_KEY_TTL_SECONDS", str(24 * 60 * 60)))
+# A request holds its key for at most IDEMPOTENCY_KEY_LEASE_SECONDS while it runs; duplicates
+# sent meanwhile wait up to IDEMPOTENCY_KEY_WAIT_SECONDS for its response, then get a 409.
+IDEMPOTENCY_KEY_LEASE_SECONDS = int(os.getenv("IDEMPOTENCY_KEY_LEASE_SECONDS", "60"))
+IDEMPOTENCY_KEY_WAIT_SECONDS = int(os.getenv("IDEMPOTENCY_KEY_WAIT_SECONDS", "5"))
+
+# When set, every API request is appended to this file as a JSON line (method, path, user,
+# body, status) for `manage.py replay_requests`. The lines hold phone numbers and amounts.
+REQUEST_LOG_FILE = os.getenv("REQUEST_LOG_FILE", "")
+if REQUEST_LOG_FILE:
+    MIDDLEWARE.append("utils.request_log.RequestLogMiddleware")
+    LOGGING["handlers"]["request_log"] = {
+        "level": "INFO",
+        "class": "logging.FileHandler",
+        "filename": REQUEST_LOG_FILE,
+    }
+    LOGGING["loggers"]["utils.request_log"] = {"handlers": ["request_log"], "level": "INFO", "propagate": False}
 
 # Silk Settings
 if DEBUG is True:
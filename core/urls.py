@@ -5,12 +5,17 @@ from django.urls import include, path
 from drf_spectacular import views as drf_spectacular_views
 from rest_framework_simplejwt import views as simplejwtviews
 
+import utils.db_pool
+import utils.metrics
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/v1/schema/", drf_spectacular_views.SpectacularAPIView.as_view(), name="schema"),
     path("api/v1/docs/", drf_spectacular_views.SpectacularSwaggerView.as_view(url_name="schema"), name="redoc"),
     path("api/v1/token/", simplejwtviews.TokenObtainPairView.as_view(), name="api_token_auth"),
     path("api/v1/token/refresh/", simplejwtviews.TokenRefreshView.as_view(), name="token_refresh"),
+    path("metrics", utils.metrics.metrics_view, name="metrics"),
+    path("api/v1/db-pool/", utils.db_pool.PoolStatsView.as_view(), name="db_pool_stats"),
     path("api/v1/", include("credit_charge.urls")),
 ]
 
@@ -1,55 +1,88 @@
+import datetime
 import logging
+import uuid
 
+from django.conf import settings
 from django.contrib import admin, messages
+from django.contrib.admin import options as admin_options
+from django.contrib.admin.views import main as admin_views
 from django.contrib.auth import admin as auth_admin
-from django.db import models, transaction
+from django.db import models
 
+import credit_charge.authentication
+import credit_charge.metrics
 import credit_charge.models
+import credit_charge.phone_numbers
+import credit_charge.services
+import credit_charge.user_cache
+import utils.pagination
 
 logger = logging.getLogger(__name__)
 
+CURSOR_VAR = "cursor"
+
 
 @admin.action(description="تأیید درخواست شارژ‌های انتخاب شده")
-@transaction.atomic
 def confirm_charges_action(
     modeladmin,
     request,
     queryset: models.QuerySet[credit_charge.models.Charge],
 ):
     try:
-        for charge in queryset.select_related("user").select_for_update(of=["user"]):
-            charge.user.update_balance(amount=charge.amount)
-            charge.confirm_charge()
-
-        modeladmin.message_user(request, "تراکنش‌ها با موفقیت تأیید شدند.", level=messages.SUCCESS)
+        with credit_charge.metrics.CHARGE_ACTION_SECONDS.time(action="confirm"):
+            result = credit_charge.services.confirm_charges(queryset)
+        credit_charge.metrics.CHARGE_ACTIONS.inc(result.processed, action="confirm", result="processed")
+        credit_charge.metrics.CHARGE_ACTIONS.inc(result.skipped, action="confirm", result="skipped")
+        modeladmin.message_user(
+            request,
+            f"{result.processed} تراکنش برای {result.users} کاربر تأیید شد و {result.skipped} تراکنش نهایی‌شده نادیده گرفته شد.",
+            level=messages.SUCCESS,
+        )
 
     except Exception as e:
+        credit_charge.metrics.CHARGE_ACTIONS.inc(action="confirm", result="failed")
         logger.error(f"Error raised during confirming charges: {e}")
         modeladmin.message_user(request, f"خطا هنگام تأیید تراکنش‌ها: {e}", level=messages.ERROR)
 
 
 @admin.action(description="رد درخواست شارژهای انتخاب شده")
-@transaction.atomic
 def reject_charges_action(
     modeladmin,
     request,
     queryset: models.QuerySet[credit_charge.models.Charge],
 ):
     try:
-        for charge in queryset:
-            charge.reject_charge()
-
-        modeladmin.message_user(request, "تراکنش‌ها با موفقیت رد شدند.", level=messages.SUCCESS)
+        with credit_charge.metrics.CHARGE_ACTION_SECONDS.time(action="reject"):
+            result = credit_charge.services.reject_charges(queryset)
+        credit_charge.metrics.CHARGE_ACTIONS.inc(result.processed, action="reject", result="processed")
+        credit_charge.metrics.CHARGE_ACTIONS.inc(result.skipped, action="reject", result="skipped")
+        modeladmin.message_user(
+            request,
+            f"{result.processed} تراکنش رد شد و {result.skipped} تراکنش نهایی‌شده نادیده گرفته شد.",
+            level=messages.SUCCESS,
+        )
 
     except Exception as e:
+        credit_charge.metrics.CHARGE_ACTIONS.inc(action="reject", result="failed")
         logger.error(f"Error raised during rejecting charges: {e}")
         modeladmin.message_user(request, f"خطا هنگام رد تراکنش‌ها: {e}", level=messages.ERROR)
 
 
+class BalanceShardInline(admin.TabularInline):
+    model = credit_charge.models.BalanceShard
+    fields = ("index", "balance")
+    readonly_fields = ("index", "balance")
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(credit_charge.models.User)
 class UserAdmin(auth_admin.UserAdmin):
     fieldsets = (
-        (None, {"fields": ("phone_number", "balance", "username", "password")}),
+        (None, {"fields": ("phone_number", "balance", "balance_shard_count", "username", "password")}),
         ("Permissions", {"fields": ("is_superuser", "is_staff", "is_active", "is_seller")}),
     )
     add_fieldsets = (
@@ -63,22 +96,141 @@ class UserAdmin(auth_admin.UserAdmin):
     )
     list_display = ("phone_number", "balance", "is_seller", "is_staff", "is_superuser")
     search_fields = ("phone_number",)
-    readonly_fields = ("balance",)
+    readonly_fields = ("balance", "balance_shard_count")
     list_filter = ("is_seller", "is_staff", "is_superuser")
+    inlines = [BalanceShardInline]
+    token_claim_fields = ("phone_number", "is_seller", "is_staff", "is_active")
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        credit_charge.user_cache.invalidate([obj.pk])
+        if change and any(field in form.changed_data for field in self.token_claim_fields):
+            credit_charge.authentication.revoke_tokens(obj)
+
+
+class KeysetChangeList(admin_views.ChangeList):
+    # Pages by (created_at, id) instead of OFFSET, which reads and discards every row before
+    # the page. Only the next and the first page are linked. The result count is the row
+    # estimate for unfiltered lists and a count capped at ADMIN_COUNT_LIMIT otherwise.
+    position_field = "created_at"
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # Filter, search and date links start over from the first page.
+        new_params = new_params or {}
+        if CURSOR_VAR not in new_params:
+            remove = [*(remove or []), CURSOR_VAR]
+        return super().get_query_string(new_params, remove)
+
+    def get_ordering(self, request, queryset):
+        return [f"-{self.position_field}", "-id"]
+
+    def get_results(self, request):
+        queryset = self.queryset
+        self.cursor = request.GET.get(CURSOR_VAR)
+        if self.cursor:
+            position, pk = self.decode_cursor(self.cursor)
+            queryset = queryset.filter(**{f"{self.position_field}__lte": position}).filter(
+                models.Q(**{f"{self.position_field}__lt": position})
+                | models.Q(**{self.position_field: position, "id__lt": pk}),
+            )
+        results = list(queryset[: self.list_per_page + 1])
+        self.result_list = results[: self.list_per_page]
+        self.next_page_url = None
+        if len(results) > self.list_per_page:
+            self.next_page_url = self.get_query_string({CURSOR_VAR: self.encode_cursor(self.result_list[-1])})
+        self.first_page_url = self.get_query_string() if self.cursor else None
+
+        self.result_count_estimated = False
+        self.result_count_limited = False
+        self.result_count = utils.pagination.estimated_count(self.queryset)
+        if self.result_count is not None:
+            self.result_count_estimated = True
+        else:
+            self.result_count = self.queryset[: settings.ADMIN_COUNT_LIMIT + 1].count()
+            if self.result_count > settings.ADMIN_COUNT_LIMIT:
+                self.result_count = settings.ADMIN_COUNT_LIMIT
+                self.result_count_limited = True
+
+        self.show_full_result_count = False
+        self.full_result_count = None
+        self.show_admin_actions = True
+        self.can_show_all = False
+        self.multi_page = self.cursor is not None or self.next_page_url is not None
+        self.paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+
+    def encode_cursor(self, obj: models.Model) -> str:
+        return f"{getattr(obj, self.position_field).isoformat()}_{obj.pk}"
+
+    def decode_cursor(self, cursor: str) -> tuple[datetime.datetime, int]:
+        position, _, pk = cursor.rpartition("_")
+        try:
+            return datetime.datetime.fromisoformat(position), int(pk)
+        except ValueError:
+            raise admin_options.IncorrectLookupParameters from None
+
+
+class LargeTableAdminMixin:
+    # Changelists that stay usable at 100M rows: no exact counts or facets, related users
+    # joined, keyset pages in created_at order, a date hierarchy that never scans the table
+    # for distinct dates, and a search that only runs indexed lookups.
+    change_list_template = "admin/credit_charge/large_table_change_list.html"
+    date_hierarchy = "created_at"
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+    sortable_by = ()
+    search_help_text = "شماره موبایل یا شناسه تراکنش"
+    # Foreign keys to the users a phone number search matches; each leads an index.
+    search_user_fields: tuple[str, ...] = ()
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_search_results(self, request, queryset, search_term):
+        # A UUID matches transaction_id exactly, anything else is taken as a phone number and
+        # matches the rows of that user.
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        try:
+            return queryset.filter(transaction_id=uuid.UUID(search_term)), False
+        except ValueError:
+            pass
+
+        phone_key = credit_charge.phone_numbers.to_phone_key(search_term)
+        user_id = (
+            None
+            if phone_key is None
+            else credit_charge.models.User.objects.filter(phone_key=phone_key).values_list("pk", flat=True).first()
+        )
+        if user_id is None:
+            return queryset.none(), False
+        condition = models.Q()
+        for field in self.search_user_fields:
+            condition |= models.Q(**{field: user_id})
+        return queryset.filter(condition), False
 
 
 @admin.register(credit_charge.models.Charge)
-class ChargeAdmin(admin.ModelAdmin):
+class ChargeAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     actions = [confirm_charges_action, reject_charges_action]
     readonly_fields = ("user", "amount", "transaction_id", "status")
-    list_display = ("user", "amount", "transaction_id", "status")
-    search_fields = ("user", "transaction_id")
+    list_display = ("user", "amount", "transaction_id", "status", "created_at")
+    list_select_related = ("user",)
+    search_fields = ("=transaction_id", "=user__phone_number")
+    search_user_fields = ("user",)
     list_filter = ("status",)
 
 
 @admin.register(credit_charge.models.UserTransaction)
-class UserTransactionAdmin(admin.ModelAdmin):
+class UserTransactionAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     readonly_fields = ("seller", "receiver_user", "amount", "status", "transaction_id")
-    list_display = ("seller", "receiver_user", "amount", "status")
-    search_fields = ("seller", "receiver_user", "transaction_id")
+    list_display = ("seller", "receiver_user", "amount", "status", "created_at")
+    list_select_related = ("seller", "receiver_user")
+    search_fields = ("=transaction_id", "=seller__phone_number", "=receiver_user__phone_number")
+    search_user_fields = ("seller", "receiver_user")
     list_filter = ("status",)
@@ -0,0 +1,79 @@
+import types
+
+from asgiref.sync import sync_to_async
+from django import urls
+from django.conf import settings
+from django.urls import URLPattern, URLResolver
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import renderers
+
+import credit_charge.views
+
+ASYNC_ACTIONS = ("list", "retrieve")
+
+
+def as_async_read_view(view):
+    # Wraps a router view so that GET list and retrieve run on the event loop through the
+    # viewset's `alist`/`aretrieve`. Authentication, permissions and throttling still run
+    # through `initial` in a worker thread; every other method is handed to the sync view.
+    sync_view = sync_to_async(view)
+
+    async def async_view(request, *args, **kwargs):
+        action = view.actions.get(request.method.lower())
+        if request.method != "GET" or action not in ASYNC_ACTIONS or not settings.API_FAST_READS:
+            return await sync_view(request, *args, **kwargs)
+
+        self = view.cls(**view.initkwargs)
+        self.action_map = view.actions
+        # The browsable API renders forms and templates synchronously.
+        self.renderer_classes = [
+            renderer for renderer in self.renderer_classes if issubclass(renderer, renderers.JSONRenderer)
+        ]
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            response = await getattr(self, f"a{action}")(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response.render()
+
+    # Schema generation introspects these.
+    async_view.cls = view.cls
+    async_view.initkwargs = view.initkwargs
+    async_view.actions = view.actions
+    return csrf_exempt(async_view)
+
+
+def async_read_urls(urlpatterns: list) -> list:
+    patterns = []
+    for pattern in urlpatterns:
+        if isinstance(pattern, URLResolver):
+            pattern = URLResolver(
+                pattern.pattern,
+                async_read_urls(pattern.url_patterns),
+                pattern.default_kwargs,
+                pattern.app_name,
+                pattern.namespace,
+            )
+        elif issubclass(getattr(pattern.callback, "cls", object), credit_charge.views.FastReadMixin):
+            pattern = URLPattern(
+                pattern.pattern,
+                as_async_read_view(pattern.callback),
+                pattern.default_args,
+                pattern.name,
+            )
+        patterns.append(pattern)
+    return patterns
+
+
+def async_urlconf(urlconf: str | None = None) -> types.ModuleType:
+    # A copy of the URLconf with the read endpoints served asynchronously, to run both paths
+    # side by side in tests and the bench_servers command.
+    module = types.ModuleType(f"{urlconf or settings.ROOT_URLCONF}.async_reads")
+    module.urlpatterns = async_read_urls(urls.get_resolver(urlconf).url_patterns)
+    return module
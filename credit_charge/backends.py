@@ -0,0 +1,25 @@
+from django.contrib.auth import backends
+
+import credit_charge.models
+import credit_charge.phone_numbers
+
+
+class PhoneNumberBackend(backends.ModelBackend):
+    # Logs users in by phone number, in any of the forms credit_charge.phone_numbers accepts,
+    # through the indexed phone key. Usernames that are no phone number of a user fall
+    # through to ModelBackend.
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None or password is None:
+            return None
+        phone_key = credit_charge.phone_numbers.to_phone_key(username)
+        if phone_key is None:
+            return None
+        user = credit_charge.models.User.objects.filter(phone_key=phone_key).first()
+        if user is None:
+            # Hash anyway, like ModelBackend, so response times do not reveal registered numbers.
+            credit_charge.models.User().set_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
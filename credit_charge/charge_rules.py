@@ -0,0 +1,70 @@
+import decimal
+
+from django.conf import settings
+from django.db import models
+from django.utils import module_loading
+
+import credit_charge.consts
+import credit_charge.models
+import credit_charge.phone_numbers
+
+# Rules the charge worker (`run_charge_worker`) applies to WAITING charges. `candidates()` is
+# the filter of the charges a rule may decide, the worker only claims charges matched by some
+# rule. `decide()` returns the new status of a claimed charge, or None to leave it to the
+# next rule. Charges no rule decides stay WAITING for the admin.
+
+
+class ChargeRule:
+    name = ""
+
+    def candidates(self) -> models.Q:
+        raise NotImplementedError
+
+    def decide(self, charge: credit_charge.models.Charge) -> credit_charge.consts.TransactionStatus | None:
+        raise NotImplementedError
+
+
+class AmountThresholdRule(ChargeRule):
+    # Approves charges of at most CHARGE_AUTO_APPROVE_MAX_AMOUNT, 0 disables the rule.
+    name = "amount"
+
+    def __init__(self, max_amount: decimal.Decimal | None = None):
+        self.max_amount = settings.CHARGE_AUTO_APPROVE_MAX_AMOUNT if max_amount is None else max_amount
+
+    def candidates(self) -> models.Q:
+        if not self.max_amount:
+            return models.Q(pk__in=[])
+        return models.Q(amount__lte=self.max_amount)
+
+    def decide(self, charge: credit_charge.models.Charge) -> credit_charge.consts.TransactionStatus | None:
+        if self.max_amount and charge.amount <= self.max_amount:
+            return credit_charge.consts.TransactionStatus.CONFIRMED
+        return None
+
+
+class TrustedUsersRule(ChargeRule):
+    # Approves every charge of the users in CHARGE_TRUSTED_PHONE_NUMBERS.
+    name = "trusted"
+
+    def __init__(self, phone_numbers: list[str] | None = None):
+        phone_numbers = settings.CHARGE_TRUSTED_PHONE_NUMBERS if phone_numbers is None else phone_numbers
+        phone_keys = {credit_charge.phone_numbers.to_phone_key(phone_number) for phone_number in phone_numbers}
+        self.user_ids = set(
+            credit_charge.models.User.objects.filter(phone_key__in=phone_keys - {None}).values_list("pk", flat=True),
+        )
+
+    def candidates(self) -> models.Q:
+        return models.Q(user_id__in=self.user_ids)
+
+    def decide(self, charge: credit_charge.models.Charge) -> credit_charge.consts.TransactionStatus | None:
+        if charge.user_id in self.user_ids:
+            return credit_charge.consts.TransactionStatus.CONFIRMED
+        return None
+
+
+RULES = {rule.name: rule for rule in (AmountThresholdRule, TrustedUsersRule)}
+
+
+def get_rules(names: list[str]) -> list[ChargeRule]:
+    # Names of the rules above, or dotted paths of ChargeRule subclasses.
+    return [(RULES[name] if name in RULES else module_loading.import_string(name))() for name in names]
@@ -11,3 +11,9 @@ class TransactionStatus(models.TextChoices):
 class UserTransactionDescription(models.TextChoices):
     INSUFFICIENT_BALANCE = "INSUFFICIENT_BALANCE", _("Insufficient Balance")
     OTHER_REASONS = "OTHER_REASONS", _("Other Reasons")
+
+
+class LedgerEntryKind(models.TextChoices):
+    OPENING = "OPENING", _("Opening Balance")
+    CHARGE = "CHARGE", _("Charge")
+    TRANSFER = "TRANSFER", _("Transfer")
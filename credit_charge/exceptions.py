@@ -14,3 +14,23 @@ class NegetavieBalanceError(Exception):
         self.user = user
         self.user_balance = user_balance
         super().__init__(f"User {self.user} has insufficient balance: {self.user_balance}")
+
+
+class TransferTimeoutError(Exception):
+    def __init__(self, timeout: float, cancelled: bool = True):
+        self.timeout = timeout
+        self.cancelled = cancelled
+        outcome = "was cancelled" if self.cancelled else "may still be committed"
+        super().__init__(f"Transfer was not committed within {self.timeout} seconds and {outcome}")
+
+
+class ImmutableLedgerEntryError(Exception):
+    def __init__(self, entry: "credit_charge.models.LedgerEntry"):
+        self.entry = entry
+        super().__init__(f"Ledger entry {self.entry.pk} cannot be changed or deleted")
+
+
+class PartitionInUseError(Exception):
+    def __init__(self, partition: str):
+        self.partition = partition
+        super().__init__(f"Partition {self.partition} still has waiting rows and cannot be archived")
@@ -0,0 +1,122 @@
+import csv
+import dataclasses
+import datetime
+import decimal
+import io
+import json
+import uuid
+from collections.abc import AsyncIterator, Generator, Iterable, Iterator
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import models
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+import credit_charge.models
+
+# Flat rows for reconciliation, streamed straight from a server-side cursor: `iterator()`
+# fetches `EXPORT_CHUNK_SIZE` rows at a time, and every chunk is encoded and handed to the
+# response before the next one is fetched, so memory use does not depend on the row count.
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+@dataclasses.dataclass(frozen=True)
+class Export:
+    name: str
+    model: type[models.Model]
+    # Output columns and the `values_list()` lookups they are read from.
+    columns: tuple[str, ...]
+    fields: tuple[str, ...]
+
+    def rows(self, queryset: models.QuerySet) -> Iterator[tuple]:
+        return (
+            queryset.order_by("created_at", "id")
+            .values_list(*self.fields)
+            .iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+        )
+
+    def stream(self, queryset: models.QuerySet, output: str) -> Iterator[bytes]:
+        encode = _encode_csv if output == "csv" else _encode_ndjson
+        return encode(self.columns, self.rows(queryset))
+
+
+TRANSACTIONS = Export(
+    name="transactions",
+    model=credit_charge.models.UserTransaction,
+    columns=("transaction_id", "created_at", "seller", "receiver_user", "amount", "status", "description"),
+    fields=(
+        "transaction_id",
+        "created_at",
+        "seller__phone_number",
+        "receiver_user__phone_number",
+        "amount",
+        "status",
+        "description",
+    ),
+)
+CHARGES = Export(
+    name="charges",
+    model=credit_charge.models.Charge,
+    columns=("transaction_id", "created_at", "updated_at", "user", "amount", "status"),
+    fields=("transaction_id", "created_at", "updated_at", "user__phone_number", "amount", "status"),
+)
+EXPORTS = {export.name: export for export in (TRANSACTIONS, CHARGES)}
+
+
+async def aiterate(chunks: Generator[bytes, None, None]) -> AsyncIterator[bytes]:
+    # Hands the chunks to an ASGI response one at a time. Each one is encoded, and its rows
+    # fetched, in the sync thread, so the cursor keeps to the thread it was opened in.
+    next_chunk = sync_to_async(next)
+    try:
+        while (chunk := await next_chunk(chunks, None)) is not None:
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close)()
+
+
+def encode_value(value):
+    if isinstance(value, decimal.Decimal):
+        return format(value, "f")
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+def _chunks(rows: Iterable[tuple]) -> Iterator[list[tuple]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= settings.EXPORT_CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _encode_ndjson(columns: tuple[str, ...], rows: Iterable[tuple]) -> Iterator[bytes]:
+    dumps = orjson.dumps if orjson is not None else lambda data: json.dumps(data, ensure_ascii=False).encode()
+    for chunk in _chunks(rows):
+        yield b"".join(dumps(dict(zip(columns, map(encode_value, row), strict=True))) + b"\n" for row in chunk)
+
+
+def _encode_csv(columns: tuple[str, ...], rows: Iterable[tuple]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for chunk in _chunks(rows):
+        writer.writerows([map(encode_value, row) for row in chunk])
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
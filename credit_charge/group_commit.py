@@ -0,0 +1,148 @@
+import collections
+import concurrent.futures
+import dataclasses
+import decimal
+import logging
+import os
+import threading
+
+import rest_framework.exceptions
+from django.conf import settings
+from django.db import close_old_connections, models, transaction
+
+import credit_charge.phone_numbers
+import credit_charge.services
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class PendingTransfer:
+    seller_phone_number: str
+    receiver_phone_number: str
+    amount: decimal.Decimal
+    future: concurrent.futures.Future
+
+
+class GroupCommitter:
+    def __init__(self, interval: float, max_batch_size: int, autostart: bool = True):
+        self.interval = interval
+        self.max_batch_size = max_batch_size
+        self.autostart = autostart
+        self._pending: list[PendingTransfer] = []
+        self._condition = threading.Condition()
+        self._thread: threading.Thread | None = None
+
+    def submit(
+        self,
+        seller_phone_number: str,
+        receiver_phone_number: str,
+        amount: decimal.Decimal,
+    ) -> concurrent.futures.Future:
+        future = concurrent.futures.Future()
+        with self._condition:
+            self._pending.append(
+                PendingTransfer(
+                    seller_phone_number=seller_phone_number,
+                    receiver_phone_number=receiver_phone_number,
+                    amount=amount,
+                    future=future,
+                ),
+            )
+            if len(self._pending) == 1 or len(self._pending) >= self.max_batch_size:
+                self._condition.notify()
+            if self.autostart and self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="transfer-group-committer", daemon=True)
+                self._thread.start()
+        return future
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending)
+                self._condition.wait_for(lambda: len(self._pending) >= self.max_batch_size, timeout=self.interval)
+                batch = self._take_batch()
+            if not batch:
+                continue
+            try:
+                close_old_connections()
+                self.commit(batch)
+            except Exception as e:
+                logger.error(f"Error raised during group commit of {len(batch)} transfers: {e}")
+                for pending in batch:
+                    if not pending.future.done():
+                        pending.future.set_exception(e)
+
+    def _take_batch(self) -> list[PendingTransfer]:
+        batch, self._pending = self._pending[: self.max_batch_size], self._pending[self.max_batch_size :]
+        # Transfers whose caller gave up waiting were cancelled and are dropped; the others
+        # can no longer be cancelled from here on.
+        return [pending for pending in batch if pending.future.set_running_or_notify_cancel()]
+
+    def flush(self):
+        with self._condition:
+            batch = self._take_batch()
+        if batch:
+            self.commit(batch)
+
+    def commit(self, batch: list[PendingTransfer]):
+        transfers_by_seller = collections.defaultdict(list)
+        for pending in batch:
+            transfers_by_seller[pending.seller_phone_number].append(pending)
+
+        outcomes = []
+        with transaction.atomic():
+            # Every user of the group is locked up front in id order; the per-seller batches
+            # below only take row locks this transaction already holds.
+            credit_charge.services.lock_users(
+                models.Q(
+                    phone_key__in={
+                        credit_charge.phone_numbers.to_phone_key(phone_number)
+                        for pending in batch
+                        for phone_number in (pending.seller_phone_number, pending.receiver_phone_number)
+                    },
+                ),
+            )
+            for seller_phone_number, transfers in transfers_by_seller.items():
+                try:
+                    # A savepoint per seller keeps one seller's error from failing the whole group.
+                    with transaction.atomic():
+                        seller, results = credit_charge.services.create_batch_transaction(
+                            seller_phone_number=seller_phone_number,
+                            items=[(pending.receiver_phone_number, pending.amount) for pending in transfers],
+                        )
+                except Exception as e:
+                    outcomes.append((transfers, e))
+                    continue
+                for pending, result in zip(transfers, results, strict=True):
+                    if result.error is not None:
+                        outcomes.append(([pending], rest_framework.exceptions.ValidationError(result.error)))
+                    else:
+                        result.user_transaction.seller = seller
+                        outcomes.append(([pending], result.user_transaction))
+
+        # Callers are only answered once their transfers are durable.
+        for transfers, outcome in outcomes:
+            for pending in transfers:
+                if isinstance(outcome, Exception):
+                    pending.future.set_exception(outcome)
+                else:
+                    pending.future.set_result(outcome)
+
+
+_committer: GroupCommitter | None = None
+_committer_pid: int | None = None
+_committer_lock = threading.Lock()
+
+
+def get_committer() -> GroupCommitter:
+    global _committer, _committer_pid
+    with _committer_lock:
+        # Worker processes forked after the committer was created need their own thread.
+        if _committer is None or _committer_pid != os.getpid():
+            _committer = GroupCommitter(
+                interval=settings.TRANSFER_GROUP_COMMIT_INTERVAL_MS / 1000,
+                max_batch_size=settings.TRANSFER_GROUP_COMMIT_MAX_BATCH,
+            )
+            _committer_pid = os.getpid()
+        return _committer
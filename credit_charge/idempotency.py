@@ -0,0 +1,134 @@
+import datetime
+import functools
+import hashlib
+import json
+import logging
+import time
+import uuid
+
+import rest_framework.response
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+
+import credit_charge.models
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+WAIT_INTERVAL_SECONDS = 0.05
+
+
+def _digest(value: str) -> uuid.UUID:
+    return uuid.UUID(bytes=hashlib.sha256(value.encode()).digest()[:16])
+
+
+def idempotent(view_method):
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        idempotency_key = request.headers.get(IDEMPOTENCY_KEY_HEADER)
+        if idempotency_key is None:
+            return view_method(self, request, *args, **kwargs)
+        if not idempotency_key or len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return rest_framework.response.Response(
+                {"message": f"{IDEMPOTENCY_KEY_HEADER} must be 1 to {IDEMPOTENCY_KEY_MAX_LENGTH} characters."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        key = _digest(f"{request.user.pk}:{request.method}:{request.path}:{idempotency_key}")
+        request_fingerprint = _digest(json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder))
+
+        # The key is reserved in its own short transaction before the request runs, so the
+        # request itself runs outside of any transaction (group commit and transient error
+        # retries only apply there) and its response is stored afterwards. A concurrent
+        # duplicate waits for the reservation to be completed and replays the response.
+        deadline = time.monotonic() + settings.IDEMPOTENCY_KEY_WAIT_SECONDS
+        while (reserved := _reserve(key, request_fingerprint)) is None:
+            if time.monotonic() >= deadline:
+                return rest_framework.response.Response(
+                    {"message": f"A request with this {IDEMPOTENCY_KEY_HEADER} is still in progress."},
+                    status=status.HTTP_409_CONFLICT,
+                    headers={"Retry-After": str(settings.IDEMPOTENCY_KEY_WAIT_SECONDS)},
+                )
+            time.sleep(WAIT_INTERVAL_SECONDS)
+        if isinstance(reserved, rest_framework.response.Response):
+            return reserved
+
+        # Both writes below only touch the row while it still holds this request's lease.
+        reservation = credit_charge.models.IdempotencyKey.objects.filter(
+            key=reserved.key,
+            status_code=None,
+            expires_at=reserved.expires_at,
+        )
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except BaseException:
+            reservation.delete()
+            raise
+        if response.status_code >= status.HTTP_500_INTERNAL_SERVER_ERROR:
+            # Server errors are not stored so that the client can retry them.
+            reservation.delete()
+            return response
+
+        reservation.update(
+            status_code=response.status_code,
+            response_body=response.data,
+            expires_at=timezone.now() + datetime.timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL_SECONDS),
+        )
+        return response
+
+    return wrapper
+
+
+@transaction.atomic
+def _reserve(
+    key: uuid.UUID,
+    request_fingerprint: uuid.UUID,
+) -> credit_charge.models.IdempotencyKey | rest_framework.response.Response | None:
+    # Returns the reserved key row, the response to replay, or None while another request
+    # holds the reservation. A reservation is leased for IDEMPOTENCY_KEY_LEASE_SECONDS; the
+    # key of a request that died without completing it is taken over once the lease expires.
+    now = timezone.now()
+    lease_expires_at = now + datetime.timedelta(seconds=settings.IDEMPOTENCY_KEY_LEASE_SECONDS)
+    try:
+        with transaction.atomic():
+            return credit_charge.models.IdempotencyKey.objects.create(
+                key=key,
+                request_fingerprint=request_fingerprint,
+                expires_at=lease_expires_at,
+            )
+    except IntegrityError:
+        pass
+
+    stored = credit_charge.models.IdempotencyKey.objects.select_for_update().filter(key=key).first()
+    if stored is None:
+        # Deleted after a failed request in the meantime, try again.
+        return None
+    if stored.expires_at > now:
+        if stored.status_code is None:
+            return None
+        if stored.request_fingerprint != request_fingerprint:
+            return rest_framework.response.Response(
+                {"message": f"{IDEMPOTENCY_KEY_HEADER} was already used with a different request."},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            )
+        return rest_framework.response.Response(
+            stored.response_body,
+            status=stored.status_code,
+            headers={"Idempotent-Replayed": "true"},
+        )
+    stored.request_fingerprint = request_fingerprint
+    stored.status_code = None
+    stored.response_body = None
+    stored.expires_at = lease_expires_at
+    stored.save()
+    return stored
+
+
+def purge_expired_keys() -> int:
+    deleted, _ = credit_charge.models.IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+    logger.info(f"Purged {deleted} expired idempotency keys")
+    return deleted
@@ -0,0 +1,141 @@
+import datetime
+import decimal
+import logging
+
+from django.db import models, transaction
+from django.utils import timezone
+
+import credit_charge.consts
+import credit_charge.models
+
+logger = logging.getLogger(__name__)
+
+
+def record_transfers(user_transactions: list[credit_charge.models.UserTransaction]):
+    entries = []
+    for user_transaction in user_transactions:
+        if user_transaction.status != credit_charge.consts.TransactionStatus.CONFIRMED:
+            continue
+        for user_id, amount in (
+            (user_transaction.seller_id, -user_transaction.amount),
+            (user_transaction.receiver_user_id, user_transaction.amount),
+        ):
+            entries.append(
+                credit_charge.models.LedgerEntry(
+                    user_id=user_id,
+                    amount=amount,
+                    kind=credit_charge.consts.LedgerEntryKind.TRANSFER,
+                    user_transaction=user_transaction,
+                    created_at=user_transaction.created_at,
+                ),
+            )
+    credit_charge.models.LedgerEntry.objects.bulk_create(entries)
+
+
+def record_charges(charges: list[credit_charge.models.Charge]):
+    now = timezone.now()
+    entries = []
+    for charge in charges:
+        for user_id, amount in ((charge.user_id, charge.amount), (None, -charge.amount)):
+            entries.append(
+                credit_charge.models.LedgerEntry(
+                    user_id=user_id,
+                    amount=amount,
+                    kind=credit_charge.consts.LedgerEntryKind.CHARGE,
+                    charge=charge,
+                    created_at=now,
+                ),
+            )
+    credit_charge.models.LedgerEntry.objects.bulk_create(entries)
+
+
+def record_opening_balances() -> int:
+    users = credit_charge.models.User.objects.with_shard_balance().filter(ledger_entries__isnull=True)
+    entries = []
+    for user in users.iterator(chunk_size=2000):
+        if user.total_balance:
+            entries.append(
+                credit_charge.models.LedgerEntry(
+                    user=user,
+                    amount=user.total_balance,
+                    kind=credit_charge.consts.LedgerEntryKind.OPENING,
+                ),
+            )
+            entries.append(
+                credit_charge.models.LedgerEntry(
+                    user=None,
+                    amount=-user.total_balance,
+                    kind=credit_charge.consts.LedgerEntryKind.OPENING,
+                ),
+            )
+    credit_charge.models.LedgerEntry.objects.bulk_create(entries, batch_size=2000)
+    return len(entries) // 2
+
+
+def balance_of(user: credit_charge.models.User, at: datetime.datetime | None = None) -> decimal.Decimal:
+    snapshots = credit_charge.models.BalanceSnapshot.objects.filter(user=user)
+    entries = credit_charge.models.LedgerEntry.objects.filter(user=user)
+    if at is not None:
+        snapshots = snapshots.filter(created_at__lte=at)
+        entries = entries.filter(created_at__lte=at)
+
+    snapshot = snapshots.order_by("-created_at").first()
+    balance = decimal.Decimal("0")
+    if snapshot is not None:
+        balance = snapshot.balance
+        entries = entries.filter(id__gt=snapshot.last_entry_id)
+    return balance + (entries.aggregate(total=models.Sum("amount"))["total"] or 0)
+
+
+def _latest_snapshot(user: models.OuterRef) -> models.QuerySet[credit_charge.models.BalanceSnapshot]:
+    return credit_charge.models.BalanceSnapshot.objects.filter(user=user).order_by("-created_at")[:1]
+
+
+@transaction.atomic
+def take_snapshots(lag: datetime.timedelta = datetime.timedelta(minutes=1)) -> int:
+    # Entries younger than `lag` are left for the next snapshot: their ids may still be
+    # interleaved with entries of transactions that have not committed yet.
+    last_entry_id = credit_charge.models.LedgerEntry.objects.filter(created_at__lte=timezone.now() - lag).aggregate(
+        last=models.Max("id"),
+    )["last"]
+    # Every run snapshots each user with entries up to the same last entry, so only the entries
+    # after the previous run's last entry are new; the scan does not grow with the history.
+    # Snapshots are only ever added, the newest row carries the previous run's last entry.
+    previous_entry_id = (
+        credit_charge.models.BalanceSnapshot.objects.order_by("-id").values_list("last_entry_id", flat=True).first()
+        or 0
+    )
+    if last_entry_id is None or last_entry_id <= previous_entry_id:
+        return 0
+
+    deltas = (
+        credit_charge.models.LedgerEntry.objects.filter(
+            user__isnull=False,
+            id__gt=previous_entry_id,
+            id__lte=last_entry_id,
+        )
+        .values("user")
+        .annotate(delta=models.Sum("amount"))
+        .order_by()
+    )
+    deltas = {row["user"]: row["delta"] for row in deltas}
+    users = credit_charge.models.User.objects.filter(pk__in=deltas).annotate(
+        previous_balance=models.Subquery(_latest_snapshot(models.OuterRef("pk")).values("balance")),
+    )
+    previous = dict(users.values_list("pk", "previous_balance"))
+
+    now = timezone.now()
+    credit_charge.models.BalanceSnapshot.objects.bulk_create(
+        (
+            credit_charge.models.BalanceSnapshot(
+                user_id=user_id,
+                balance=(previous.get(user_id) or 0) + delta,
+                last_entry_id=last_entry_id,
+                created_at=now,
+            )
+            for user_id, delta in deltas.items()
+        ),
+        batch_size=2000,
+    )
+    logger.info(f"Took {len(deltas)} balance snapshots up to ledger entry {last_entry_id}")
+    return len(deltas)
@@ -0,0 +1,69 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework import renderers
+
+import credit_charge.models
+import credit_charge.representations
+import credit_charge.serializers
+import utils.renderers
+
+
+class Command(BaseCommand):
+    help = "Compare the CPU time of serializer-based and fast list rendering on the current database."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=100, help="Rows per rendered page.")
+        parser.add_argument("--iterations", type=int, default=200)
+
+    def handle(self, *args, **options):
+        if options["rows"] <= 0 or options["iterations"] <= 0:
+            raise CommandError("--rows and --iterations must be positive.")
+
+        cases = (
+            (
+                "users",
+                credit_charge.models.User.objects.with_shard_balance(),
+                credit_charge.serializers.UserSerializer,
+                credit_charge.representations.USER,
+            ),
+            (
+                "charges",
+                credit_charge.models.Charge.objects.select_related("user"),
+                credit_charge.serializers.ChargeSerializer,
+                credit_charge.representations.CHARGE,
+            ),
+            (
+                "transactions",
+                credit_charge.models.UserTransaction.objects.select_related("seller", "receiver_user"),
+                credit_charge.serializers.UserTransactionSerializer,
+                credit_charge.representations.USER_TRANSACTION,
+            ),
+        )
+        for name, queryset, serializer_class, representation in cases:
+            queryset = queryset.order_by("-created_at", "-id")
+            rows = options["rows"]
+
+            def serialized(queryset=queryset, serializer_class=serializer_class, rows=rows):
+                data = serializer_class(list(queryset[:rows]), many=True).data
+                return renderers.JSONRenderer().render(data)
+
+            def fast(queryset=queryset, representation=representation, rows=rows):
+                data = representation.render_many(representation.values(queryset)[:rows])
+                return utils.renderers.ORJSONRenderer().render(data)
+
+            if serialized() != fast():
+                raise CommandError(f"{name}: fast output differs from the serializer output.")
+
+            old = self.cpu_time(serialized, options["iterations"])
+            new = self.cpu_time(fast, options["iterations"])
+            self.stdout.write(
+                f"{name}: serializer {old * 1000:.3f} ms, fast {new * 1000:.3f} ms per page "
+                f"({old / new if new else 0:.1f}x)",
+            )
+
+    def cpu_time(self, render, iterations: int) -> float:
+        started = time.process_time()
+        for _ in range(iterations):
+            render()
+        return (time.process_time() - started) / iterations
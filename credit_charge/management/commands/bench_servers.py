@@ -0,0 +1,85 @@
+import asyncio
+import concurrent.futures
+import time
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client, override_settings
+
+import credit_charge.async_views
+import credit_charge.models
+import credit_charge.phone_numbers
+import credit_charge.serializers
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare requests per second, and per CPU second, of the WSGI and ASGI read paths. Both run in "
+        "this process against the current database, through the full middleware stack."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=500, help="Requests per endpoint and server.")
+        parser.add_argument("--concurrency", type=int, default=10)
+        parser.add_argument("--phone-number", help="User to authenticate as, defaults to the first seller.")
+
+    def handle(self, *args, **options):
+        if options["requests"] <= 0 or options["concurrency"] <= 0:
+            raise CommandError("--requests and --concurrency must be positive.")
+
+        users = credit_charge.models.User.objects.with_shard_balance()
+        if options["phone_number"]:
+            user = users.filter(phone_key=credit_charge.phone_numbers.to_phone_key(options["phone_number"])).first()
+        else:
+            user = users.filter(is_seller=True).order_by("pk").first()
+        if user is None:
+            raise CommandError("No user to authenticate as.")
+
+        token = credit_charge.serializers.TokenObtainPairSerializer.get_token(user).access_token
+        headers = {"authorization": f"Bearer {token}"}
+        paths = (
+            "/api/v1/users/",
+            f"/api/v1/users/{user.phone_number}/",
+            "/api/v1/charges/",
+            "/api/v1/transactions/",
+        )
+        async_urlconf = credit_charge.async_views.async_urlconf()
+        # The test clients send requests to "testserver".
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+            for path in paths:
+                self.bench(path, headers, async_urlconf, options["requests"], options["concurrency"])
+
+    def bench(self, path: str, headers: dict, async_urlconf, requests: int, concurrency: int):
+        wsgi = self.run_wsgi(headers, path, requests, concurrency)
+        with override_settings(ROOT_URLCONF=async_urlconf, API_ASYNC_READS=True):
+            asgi = async_to_sync(self.run_asgi)(headers, path, requests, concurrency)
+        for name, (elapsed, cpu) in (("wsgi", wsgi), ("asgi", asgi)):
+            self.stdout.write(
+                f"{path} {name}: {requests / elapsed:.0f} req/s, {requests / cpu if cpu else 0:.0f} req/cpu-s",
+            )
+
+    def check_status(self, path: str, status_code: int):
+        if status_code != 200:
+            raise CommandError(f"{path} returned {status_code}.")
+
+    def run_wsgi(self, headers: dict, path: str, requests: int, concurrency: int) -> tuple[float, float]:
+        def get(_):
+            # Test clients keep per-request state, so each thread request gets its own.
+            self.check_status(path, Client().get(path, headers=headers).status_code)
+
+        with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+            started, cpu_started = time.perf_counter(), time.process_time()
+            list(executor.map(get, range(requests)))
+            return time.perf_counter() - started, time.process_time() - cpu_started
+
+    async def run_asgi(self, headers: dict, path: str, requests: int, concurrency: int) -> tuple[float, float]:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def get():
+            async with semaphore:
+                self.check_status(path, (await AsyncClient().get(path, headers=headers)).status_code)
+
+        started, cpu_started = time.perf_counter(), time.process_time()
+        await asyncio.gather(*(get() for _ in range(requests)))
+        return time.perf_counter() - started, time.process_time() - cpu_started
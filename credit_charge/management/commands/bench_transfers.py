@@ -0,0 +1,268 @@
+import collections
+import concurrent.futures
+import datetime
+import decimal
+import json
+import math
+import multiprocessing
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import override_settings
+
+import credit_charge.metrics
+import credit_charge.models
+import credit_charge.phone_numbers
+import credit_charge.services
+import utils.db_retry
+
+SELLER_PREFIX = "+98001"
+RECEIVER_PREFIX = "+98002"
+
+
+def _phone_number(prefix: str, index: int) -> str:
+    return f"{prefix}{index:09d}"
+
+
+def _phase_totals() -> dict[str, tuple[float, int]]:
+    metric = credit_charge.metrics.TRANSFER_PHASE_SECONDS
+    with metric.lock:
+        return {key[0]: (counts[-2], counts[-1]) for key, counts in metric.values.items()}
+
+
+def _retries() -> int:
+    with utils.db_retry.RETRIES.lock:
+        return sum(count for key, count in utils.db_retry.RETRIES.values.items() if key[0] == "transfer")
+
+
+def _run_transfers(transfers: list[tuple[str, str, decimal.Decimal]]) -> list[tuple[float, str]]:
+    results = []
+    for seller_phone_number, receiver_phone_number, amount in transfers:
+        started = time.perf_counter()
+        try:
+            user_transaction = credit_charge.services.create_transaction(
+                seller_phone_number=seller_phone_number,
+                receiver_phone_number=receiver_phone_number,
+                amount=amount,
+            )
+            outcome = user_transaction.status
+            if user_transaction.description:
+                outcome = f"{outcome}:{user_transaction.description}"
+        except Exception as e:
+            outcome = f"ERROR:{type(e).__name__}"
+        results.append((time.perf_counter() - started, outcome))
+    connection.close()
+    return results
+
+
+def _run_transfers_in_process(transfers: list[tuple[str, str, decimal.Decimal]]) -> tuple[list, dict, int]:
+    # Metrics are per process, a worker process reports what it added to the ones it inherited.
+    phases, retries = _phase_totals(), _retries()
+    results = _run_transfers(transfers)
+    return results, _phase_delta(phases, _phase_totals()), _retries() - retries
+
+
+def _phase_delta(before: dict, after: dict) -> dict[str, tuple[float, int]]:
+    delta = {}
+    for phase, (total, count) in after.items():
+        total_before, count_before = before.get(phase, (0, 0))
+        if count > count_before:
+            delta[phase] = (total - total_before, count - count_before)
+    return delta
+
+
+def _percentile(latencies: list[float], percentile: float) -> float:
+    return latencies[max(0, math.ceil(percentile / 100 * len(latencies)) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark services.create_transaction from concurrent threads or processes, without HTTP. "
+        "Creates bench users and resets their balances, so run it against a disposable database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--transfers", type=int, default=5000)
+        parser.add_argument("--concurrency", type=int, default=16, help="Threads or processes sending transfers.")
+        parser.add_argument("--workers", choices=("threads", "processes"), default="threads")
+        parser.add_argument("--engine", choices=("auto", "orm", "sql"), default=None, help="TRANSFER_ENGINE to use.")
+        parser.add_argument("--sellers", type=int, default=10)
+        parser.add_argument("--receivers", type=int, default=1000)
+        parser.add_argument(
+            "--skew",
+            choices=("uniform", "hot"),
+            default="uniform",
+            help="With hot, --hot-share of the transfers come from the first seller.",
+        )
+        parser.add_argument("--hot-share", type=float, default=0.9)
+        parser.add_argument("--seller-balance", type=int, default=10_000_000)
+        parser.add_argument("--amount-min", type=int, default=1)
+        parser.add_argument("--amount-max", type=int, default=10_000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--label", default="", help="Free text stored with the results, e.g. a release.")
+        parser.add_argument("--output", help="Write the results as JSON to this file.")
+        parser.add_argument("--baseline", help="Results of an earlier run to compare against.")
+        parser.add_argument(
+            "--max-regression",
+            type=float,
+            default=10,
+            help="Fail when TPS drops or p99 grows by more than this percent against --baseline.",
+        )
+
+    def handle(self, *args, **options):
+        if min(options["transfers"], options["concurrency"], options["sellers"], options["receivers"]) <= 0:
+            raise CommandError("--transfers, --concurrency, --sellers and --receivers must be positive.")
+        if not 0 < options["amount_min"] <= options["amount_max"]:
+            raise CommandError("--amount-min must be positive and not above --amount-max.")
+        if not 0 <= options["hot_share"] <= 1:
+            raise CommandError("--hot-share must be between 0 and 1.")
+        if connection.vendor != "postgresql":
+            self.stderr.write(f"Running on {connection.vendor}, the numbers say little about PostgreSQL.")
+
+        sellers, receivers = self.prepare_users(options)
+        transfers = self.make_transfers(sellers, receivers, options)
+        engine = options["engine"] or settings.TRANSFER_ENGINE
+        with override_settings(TRANSFER_ENGINE=engine):
+            engine = "sql" if credit_charge.services.use_sql_transfer_engine() else "orm"
+            results, phases, retries, elapsed = self.run(transfers, options["workers"], options["concurrency"])
+
+        report = self.report(results, phases, retries, elapsed, engine, options)
+        self.print_report(report)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                json.dump(report, file, indent=2)
+        if options["baseline"]:
+            self.compare(report, options["baseline"], options["max_regression"])
+
+    def prepare_users(self, options) -> tuple[list[str], list[str]]:
+        sellers = [_phone_number(SELLER_PREFIX, index) for index in range(options["sellers"])]
+        receivers = [_phone_number(RECEIVER_PREFIX, index) for index in range(options["receivers"])]
+        existing = set(
+            credit_charge.models.User.objects.filter(phone_number__in=[*sellers, *receivers]).values_list(
+                "phone_number",
+                flat=True,
+            ),
+        )
+        credit_charge.models.User.objects.bulk_create(
+            credit_charge.models.User(
+                username=phone_number,
+                phone_number=phone_number,
+                phone_key=credit_charge.phone_numbers.to_phone_key(phone_number),
+                is_seller=is_seller,
+            )
+            for phone_numbers, is_seller in ((sellers, True), (receivers, False))
+            for phone_number in phone_numbers
+            if phone_number not in existing
+        )
+        credit_charge.models.User.objects.filter(phone_number__in=sellers).update(
+            balance=options["seller_balance"],
+            is_seller=True,
+            balance_shard_count=0,
+        )
+        credit_charge.models.User.objects.filter(phone_number__in=receivers).update(balance=0)
+        return sellers, receivers
+
+    def make_transfers(self, sellers: list[str], receivers: list[str], options) -> list:
+        generator = random.Random(options["seed"])  # noqa: S311
+        transfers = []
+        for _ in range(options["transfers"]):
+            if options["skew"] == "hot" and generator.random() < options["hot_share"]:
+                seller = sellers[0]
+            else:
+                seller = generator.choice(sellers)
+            amount = decimal.Decimal(generator.randint(options["amount_min"], options["amount_max"]))
+            transfers.append((seller, generator.choice(receivers), amount))
+        return transfers
+
+    def run(self, transfers: list, workers: str, concurrency: int) -> tuple[list, dict, int, float]:
+        chunks = [transfers[index::concurrency] for index in range(concurrency)]
+        if workers == "threads":
+            phases, retries = _phase_totals(), _retries()
+            with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+                started = time.perf_counter()
+                results = [result for chunk in executor.map(_run_transfers, chunks) for result in chunk]
+                elapsed = time.perf_counter() - started
+            return results, _phase_delta(phases, _phase_totals()), _retries() - retries, elapsed
+
+        # Forked workers must not share the parent's database connections.
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        with concurrent.futures.ProcessPoolExecutor(concurrency, mp_context=context) as executor:
+            started = time.perf_counter()
+            outputs = list(executor.map(_run_transfers_in_process, chunks))
+            elapsed = time.perf_counter() - started
+        results, phases, retries = [], collections.defaultdict(lambda: (0, 0)), 0
+        for worker_results, worker_phases, worker_retries in outputs:
+            results.extend(worker_results)
+            for phase, (total, count) in worker_phases.items():
+                phases[phase] = (phases[phase][0] + total, phases[phase][1] + count)
+            retries += worker_retries
+        return results, dict(phases), retries, elapsed
+
+    def report(self, results: list, phases: dict, retries: int, elapsed: float, engine: str, options) -> dict:
+        latencies = sorted(latency for latency, _ in results)
+        outcomes = collections.Counter(outcome for _, outcome in results)
+        return {
+            "label": options["label"],
+            "finished_at": datetime.datetime.now(tz=datetime.timezone.utc).isoformat(),
+            "database": connection.vendor,
+            "engine": engine,
+            "group_commit": settings.TRANSFER_GROUP_COMMIT,
+            "workload": {
+                name: options[name]
+                for name in (
+                    "transfers",
+                    "concurrency",
+                    "workers",
+                    "sellers",
+                    "receivers",
+                    "skew",
+                    "hot_share",
+                    "seller_balance",
+                    "amount_min",
+                    "amount_max",
+                    "seed",
+                )
+            },
+            "seconds": elapsed,
+            "tps": len(results) / elapsed,
+            "latency_ms": {
+                "mean": sum(latencies) / len(latencies) * 1000,
+                "p50": _percentile(latencies, 50) * 1000,
+                "p95": _percentile(latencies, 95) * 1000,
+                "p99": _percentile(latencies, 99) * 1000,
+                "max": latencies[-1] * 1000,
+            },
+            "outcomes": dict(outcomes.most_common()),
+            # "lock" is the wait for user rows in the ORM engine; the SQL engine locks inside "statement".
+            "phase_mean_ms": {phase: total / count * 1000 for phase, (total, count) in sorted(phases.items())},
+            "retries": retries,
+        }
+
+    def print_report(self, report: dict):
+        latency = report["latency_ms"]
+        self.stdout.write(
+            f"{report['workload']['transfers']} transfers, {report['engine']} engine, "
+            f"{report['workload']['concurrency']} {report['workload']['workers']}: {report['tps']:.0f} TPS",
+        )
+        self.stdout.write(
+            f"latency ms: p50 {latency['p50']:.2f}, p95 {latency['p95']:.2f}, p99 {latency['p99']:.2f}, "
+            f"max {latency['max']:.2f}",
+        )
+        for outcome, count in report["outcomes"].items():
+            self.stdout.write(f"{outcome}: {count}")
+        for phase, mean in report["phase_mean_ms"].items():
+            self.stdout.write(f"{phase}: {mean:.3f} ms mean")
+        self.stdout.write(f"retries: {report['retries']}")
+
+    def compare(self, report: dict, path: str, max_regression: float):
+        with open(path) as file:
+            baseline = json.load(file)
+        tps_change = (report["tps"] / baseline["tps"] - 1) * 100
+        p99_change = (report["latency_ms"]["p99"] / baseline["latency_ms"]["p99"] - 1) * 100
+        self.stdout.write(f"against {path}: TPS {tps_change:+.1f}%, p99 {p99_change:+.1f}%")
+        if tps_change < -max_regression or p99_change > max_regression:
+            raise CommandError(f"Regressed by more than {max_regression}% against {path}.")
@@ -0,0 +1,48 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import dateparse
+
+import credit_charge.consts
+import credit_charge.exports
+
+
+def _parse_datetime(value: str, option: str) -> datetime.datetime:
+    parsed = dateparse.parse_datetime(value)
+    if parsed is None:
+        raise CommandError(f"{option} must be an ISO datetime.")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.UTC)
+    return parsed
+
+
+class Command(BaseCommand):
+    help = "Stream every transaction or charge in a time range as NDJSON or CSV, through a server-side cursor."
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=tuple(credit_charge.exports.EXPORTS))
+        parser.add_argument("--output", choices=tuple(credit_charge.exports.FORMATS), default="ndjson")
+        parser.add_argument("--file", help="Write to this file instead of stdout.")
+        parser.add_argument("--status", choices=credit_charge.consts.TransactionStatus.values)
+        parser.add_argument("--created-after", help="Only export rows created at or after this ISO datetime.")
+        parser.add_argument("--created-before", help="Only export rows created before this ISO datetime.")
+
+    def handle(self, *args, **options):
+        export = credit_charge.exports.EXPORTS[options["kind"]]
+        queryset = export.model.objects.all()
+        if options["status"]:
+            queryset = queryset.filter(status=options["status"])
+        if options["created_after"]:
+            queryset = queryset.filter(created_at__gte=_parse_datetime(options["created_after"], "--created-after"))
+        if options["created_before"]:
+            queryset = queryset.filter(created_at__lt=_parse_datetime(options["created_before"], "--created-before"))
+
+        chunks = export.stream(queryset, options["output"])
+        if not options["file"]:
+            for chunk in chunks:
+                self.stdout.write(chunk.decode(), ending="")
+            return
+        with open(options["file"], "wb") as file:
+            for chunk in chunks:
+                file.write(chunk)
+        self.stderr.write(self.style.SUCCESS(f"Exported {options['kind']} to {options['file']}."))
@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+import credit_charge.exceptions
+import credit_charge.partitions
+
+
+class Command(BaseCommand):
+    help = "Create the coming monthly partitions of transactions and charges, and archive old ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--ahead",
+            type=int,
+            default=settings.PARTITION_MONTHS_AHEAD,
+            help="Months after the current one that must have a partition.",
+        )
+        parser.add_argument(
+            "--retain-months",
+            type=int,
+            help="Archive partitions of months more than this many months before the current one.",
+        )
+        parser.add_argument("--archive-dir", default=settings.PARTITION_ARCHIVE_DIR)
+
+    def handle(self, *args, **options):
+        if options["ahead"] < 0 or (options["retain_months"] is not None and options["retain_months"] < 0):
+            raise CommandError("--ahead and --retain-months must not be negative.")
+
+        for partitioned in credit_charge.partitions.TABLES:
+            if not credit_charge.partitions.is_partitioned(partitioned.table):
+                raise CommandError(f"{partitioned.table} is not partitioned, partitioning requires PostgreSQL.")
+
+            for name in credit_charge.partitions.create_future_partitions(partitioned.table, options["ahead"]):
+                self.stdout.write(f"Created {name}.")
+
+            if options["retain_months"] is None:
+                continue
+            oldest_kept = credit_charge.partitions.add_months(
+                credit_charge.partitions.current_month(),
+                -options["retain_months"],
+            )
+            partitions = credit_charge.partitions.monthly_partitions(partitioned.table)
+            for month in sorted(month for month in partitions if month < oldest_kept):
+                try:
+                    count = credit_charge.partitions.archive_partition(partitioned, month, options["archive_dir"])
+                except credit_charge.exceptions.PartitionInUseError as e:
+                    self.stderr.write(self.style.WARNING(str(e)))
+                    continue
+                self.stdout.write(f"Archived {count} rows of {partitions[month]}.")
+
+        self.stdout.write(self.style.SUCCESS("Partitions are up to date."))
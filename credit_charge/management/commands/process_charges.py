@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import dateparse, timezone
+
+import credit_charge.consts
+import credit_charge.models
+import credit_charge.phone_numbers
+import credit_charge.services
+
+
+class Command(BaseCommand):
+    help = "Confirm or reject waiting charges in batches, crediting each user once per batch."
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=("confirm", "reject"))
+        parser.add_argument(
+            "--transaction-id",
+            action="append",
+            dest="transaction_ids",
+            help="Only process this charge, can be repeated.",
+        )
+        parser.add_argument("--phone-number", help="Only process charges of this user.")
+        parser.add_argument(
+            "--created-before",
+            help="Only process charges created before this ISO datetime, in TIME_ZONE unless it has an offset.",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000, help="Charges processed per transaction.")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] <= 0:
+            raise CommandError("--batch-size must be positive.")
+
+        charges = credit_charge.models.Charge.objects.filter(status=credit_charge.consts.TransactionStatus.WAITING)
+        if options["transaction_ids"]:
+            charges = charges.filter(transaction_id__in=options["transaction_ids"])
+        if options["phone_number"]:
+            charges = charges.filter(
+                user__phone_key=credit_charge.phone_numbers.to_phone_key(options["phone_number"]),
+            )
+        if options["created_before"]:
+            created_before = dateparse.parse_datetime(options["created_before"])
+            if created_before is None:
+                raise CommandError("--created-before must be an ISO datetime.")
+            if timezone.is_naive(created_before):
+                created_before = timezone.make_aware(created_before)
+            charges = charges.filter(created_at__lt=created_before)
+
+        process = (
+            credit_charge.services.confirm_charges
+            if options["action"] == "confirm"
+            else credit_charge.services.reject_charges
+        )
+        total = credit_charge.services.ChargeProcessingResult()
+        while True:
+            ids = list(charges.order_by("pk").values_list("pk", flat=True)[: options["batch_size"]])
+            if not ids:
+                break
+            result = process(credit_charge.models.Charge.objects.filter(pk__in=ids))
+            total.processed += result.processed
+            total.skipped += result.skipped
+            total.amount += result.amount
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{options['action'].capitalize()}ed {total.processed} charges totalling {total.amount}, "
+                f"skipped {total.skipped} already processed.",
+            ),
+        )
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+import credit_charge.idempotency
+
+
+class Command(BaseCommand):
+    help = "Delete idempotency keys whose TTL has passed."
+
+    def handle(self, *args, **options):
+        deleted = credit_charge.idempotency.purge_expired_keys()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired idempotency keys."))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import dateparse
+
+import credit_charge.rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily per user totals from charges and transfers, for a backfill or a repair."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", help="Only rebuild this ISO date and later days, all days by default.")
+
+    def handle(self, *args, **options):
+        since = None
+        if options["since"]:
+            since = dateparse.parse_date(options["since"])
+            if since is None:
+                raise CommandError("--since must be an ISO date.")
+        count = credit_charge.rollups.rebuild(since=since)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} daily user totals."))
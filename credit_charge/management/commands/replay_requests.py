@@ -0,0 +1,255 @@
+import argparse
+import collections
+import concurrent.futures
+import dataclasses
+import datetime
+import http.client
+import json
+import math
+import threading
+import time
+import urllib.parse
+
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import Resolver404, resolve
+
+import credit_charge.models
+import credit_charge.serializers
+
+
+@dataclasses.dataclass
+class RecordedRequest:
+    offset: float
+    method: str
+    path: str
+    user: str | None
+    body: bytes | None
+
+
+@dataclasses.dataclass
+class Slo:
+    endpoint: str | None
+    percentile: float
+    milliseconds: float
+
+
+def _endpoint(method: str, path: str) -> str:
+    try:
+        route = resolve(urllib.parse.urlsplit(path).path).route
+    except Resolver404:
+        route = "unmatched"
+    return f"{method} {route}"
+
+
+def _percentile(values: list[float], percentile: float) -> float:
+    return values[max(0, math.ceil(percentile / 100 * len(values)) - 1)]
+
+
+def _parse_slo(value: str) -> Slo:
+    # "p99=250" for every endpoint, or "POST api/v1/transactions/$ p99=250" for one of them.
+    endpoint, _, threshold = value.rpartition(" ")
+    percentile, _, milliseconds = threshold.partition("=")
+    try:
+        if not percentile.startswith("p"):
+            raise ValueError
+        return Slo(endpoint=endpoint or None, percentile=float(percentile[1:]), milliseconds=float(milliseconds))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid SLO {value!r}, expected [ENDPOINT ]pNN=MILLISECONDS") from None
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a request log recorded with REQUEST_LOG_FILE against a running server. Requests are sent "
+        "at their recorded arrival times (open loop), whether or not earlier ones have been answered, and "
+        "latency is measured from the time a request was due, so queueing in the server is not hidden."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("log", help="JSON lines with ts, method, path and optionally user and body.")
+        parser.add_argument("--host", default="http://localhost:8000")
+        parser.add_argument("--speed", type=float, default=1, help="Arrival rate multiplier, 2 replays twice as fast.")
+        parser.add_argument("--limit", type=int, help="Replay only the first requests of the log.")
+        parser.add_argument("--max-in-flight", type=int, default=256, help="Connections sending requests.")
+        parser.add_argument("--timeout", type=float, default=30)
+        parser.add_argument(
+            "--slo",
+            action="append",
+            default=[],
+            type=_parse_slo,
+            help='Latency objective like "p99=250" or "POST api/v1/transactions/$ p99=250", repeatable.',
+        )
+        parser.add_argument(
+            "--max-error-rate",
+            type=float,
+            default=0.01,
+            help="Highest share of 5xx responses and connection errors per endpoint.",
+        )
+        parser.add_argument("--output", help="Write the results as JSON to this file.")
+
+    def handle(self, *args, **options):
+        if options["speed"] <= 0 or options["max_in_flight"] <= 0:
+            raise CommandError("--speed and --max-in-flight must be positive.")
+        host = urllib.parse.urlsplit(options["host"])
+        if host.scheme not in ("http", "https") or not host.netloc:
+            raise CommandError("--host must be an http or https URL.")
+
+        requests = self.read_log(options["log"], options["limit"])
+        if not requests:
+            raise CommandError(f"{options['log']} has no requests.")
+        duration = requests[-1].offset / options["speed"]
+        tokens = self.issue_tokens({request.user for request in requests if request.user}, duration)
+        skipped = sum(1 for request in requests if request.user and request.user not in tokens)
+        if skipped:
+            self.stderr.write(f"Skipping {skipped} requests of users missing from the database.")
+        requests = [request for request in requests if not request.user or request.user in tokens]
+
+        results, elapsed = self.replay(requests, tokens, host, options["speed"], options)
+        report = self.report(results, elapsed, options)
+        self.print_report(report)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                json.dump(report, file, indent=2)
+        if report["violations"]:
+            raise CommandError("; ".join(report["violations"]))
+
+    def read_log(self, path: str, limit: int | None) -> list[RecordedRequest]:
+        entries = []
+        with open(path) as file:
+            for number, line in enumerate(file, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                    ts, method, request_path = float(entry["ts"]), entry["method"].upper(), entry["path"]
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    raise CommandError(f"{path}:{number} is not a request log entry.") from None
+                body = entry.get("body")
+                entries.append((ts, method, request_path, entry.get("user"), body))
+        entries.sort(key=lambda entry: entry[0])
+        if limit is not None:
+            entries = entries[:limit]
+        if not entries:
+            return []
+        first = entries[0][0]
+        return [
+            RecordedRequest(
+                offset=ts - first,
+                method=method,
+                path=request_path,
+                user=user,
+                body=None if body is None else json.dumps(body).encode(),
+            )
+            for ts, method, request_path, user, body in entries
+        ]
+
+    def issue_tokens(self, phone_numbers: set[str], duration: float) -> dict[str, str]:
+        # Tokens are signed here rather than obtained from the server, password hashing would
+        # dominate provisioning thousands of users. They outlive the replay.
+        lifetime = datetime.timedelta(seconds=duration + 300)
+        tokens = {}
+        users = credit_charge.models.User.objects.filter(phone_number__in=phone_numbers, is_active=True)
+        for user in users.iterator(chunk_size=2000):
+            access_token = credit_charge.serializers.TokenObtainPairSerializer.get_token(user).access_token
+            access_token.set_exp(lifetime=lifetime)
+            tokens[user.phone_number] = str(access_token)
+        return tokens
+
+    def replay(self, requests: list[RecordedRequest], tokens: dict, host, speed: float, options) -> tuple[list, float]:
+        connection_class = http.client.HTTPSConnection if host.scheme == "https" else http.client.HTTPConnection
+        local = threading.local()
+
+        def send(request: RecordedRequest, due: float) -> tuple[str, int, float, float]:
+            headers = {"Host": host.netloc}
+            if request.body is not None:
+                headers["Content-Type"] = "application/json"
+            if request.user:
+                headers["Authorization"] = f"Bearer {tokens[request.user]}"
+            connection = getattr(local, "connection", None)
+            if connection is None:
+                connection = local.connection = connection_class(host.netloc, timeout=options["timeout"])
+            sent = time.perf_counter()
+            try:
+                connection.request(request.method, request.path, body=request.body, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                local.connection = None
+                status = 0
+            finished = time.perf_counter()
+            return _endpoint(request.method, request.path), status, finished - due, finished - sent
+
+        with concurrent.futures.ThreadPoolExecutor(options["max_in_flight"]) as executor:
+            started = time.perf_counter()
+            futures = []
+            for request in requests:
+                due = started + request.offset / speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                futures.append(executor.submit(send, request, due))
+            results = [future.result() for future in futures]
+        return results, time.perf_counter() - started
+
+    def report(self, results: list, elapsed: float, options) -> dict:
+        by_endpoint = collections.defaultdict(list)
+        for endpoint, status, latency, service_time in results:
+            by_endpoint[endpoint].append((status, latency, service_time))
+
+        endpoints = {}
+        for endpoint, endpoint_results in sorted(by_endpoint.items()):
+            latencies = sorted(latency for _, latency, _ in endpoint_results)
+            service_times = sorted(service_time for _, _, service_time in endpoint_results)
+            statuses = collections.Counter(str(status) for status, _, _ in endpoint_results)
+            errors = sum(1 for status, _, _ in endpoint_results if status == 0 or status >= 500)
+            endpoints[endpoint] = {
+                "requests": len(endpoint_results),
+                "rps": len(endpoint_results) / elapsed,
+                "error_rate": errors / len(endpoint_results),
+                "statuses": dict(sorted(statuses.items())),
+                # Measured from the time the request was due, including time spent queued.
+                "latency_ms": {
+                    f"p{percentile}": _percentile(latencies, percentile) * 1000 for percentile in (50, 95, 99, 99.9)
+                },
+                # Measured from the time the request was actually sent, as a closed-loop client would.
+                "service_time_ms": {
+                    f"p{percentile}": _percentile(service_times, percentile) * 1000 for percentile in (50, 95, 99, 99.9)
+                },
+                "max_ms": latencies[-1] * 1000,
+            }
+
+        violations = []
+        for endpoint, stats in endpoints.items():
+            if stats["error_rate"] > options["max_error_rate"]:
+                violations.append(f"{endpoint}: error rate {stats['error_rate']:.2%}")
+            latencies = sorted(latency for _, latency, _ in by_endpoint[endpoint])
+            for slo in options["slo"]:
+                if slo.endpoint not in (None, endpoint):
+                    continue
+                observed = _percentile(latencies, slo.percentile) * 1000
+                if observed > slo.milliseconds:
+                    violations.append(
+                        f"{endpoint}: p{slo.percentile:g} {observed:.1f} ms above {slo.milliseconds:g} ms",
+                    )
+        return {
+            "host": options["host"],
+            "speed": options["speed"],
+            "requests": len(results),
+            "seconds": elapsed,
+            "rps": len(results) / elapsed,
+            "endpoints": endpoints,
+            "violations": violations,
+        }
+
+    def print_report(self, report: dict):
+        self.stdout.write(f"{report['requests']} requests in {report['seconds']:.1f} s ({report['rps']:.0f} req/s)")
+        for endpoint, stats in report["endpoints"].items():
+            latency, service_time = stats["latency_ms"], stats["service_time_ms"]
+            self.stdout.write(
+                f"{endpoint}: {stats['requests']} requests, errors {stats['error_rate']:.2%}, "
+                f"p50 {latency['p50']:.1f} p95 {latency['p95']:.1f} p99 {latency['p99']:.1f} ms "
+                f"(service p99 {service_time['p99']:.1f} ms)",
+            )
+        for violation in report["violations"]:
+            self.stdout.write(self.style.ERROR(violation))
@@ -0,0 +1,114 @@
+import logging
+import signal
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+import credit_charge.charge_rules
+import credit_charge.consts
+import credit_charge.metrics
+import credit_charge.models
+import credit_charge.services
+import utils.metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Claim WAITING charges in batches with SKIP LOCKED and approve them with the configured rules, "
+        "until stopped. Several workers can run at once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Charges claimed per transaction.")
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument(
+            "--report-interval",
+            type=float,
+            default=10.0,
+            help="Seconds between queue depth counts and throughput reports.",
+        )
+        parser.add_argument("--rules", help="Comma separated rules, CHARGE_WORKER_RULES by default.")
+        parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics of the worker on this port.")
+        parser.add_argument(
+            "--metrics-address",
+            default="127.0.0.1",
+            help="Address the metrics server binds to, 0.0.0.0 to listen on every interface.",
+        )
+        parser.add_argument("--once", action="store_true", help="Exit once no claimable charge is left.")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] <= 0:
+            raise CommandError("--batch-size must be positive.")
+        names = options["rules"].split(",") if options["rules"] else settings.CHARGE_WORKER_RULES
+        rules = credit_charge.charge_rules.get_rules([name for name in names if name])
+        if not rules:
+            raise CommandError("No charge rules configured.")
+        if options["metrics_port"] is not None:
+            utils.metrics.start_http_server(options["metrics_port"], address=options["metrics_address"])
+
+        stop = threading.Event()
+        handlers = {signum: signal.signal(signum, lambda *_: stop.set()) for signum in (signal.SIGINT, signal.SIGTERM)}
+        try:
+            self.run(rules, stop, options)
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+
+    def run(self, rules: list[credit_charge.charge_rules.ChargeRule], stop: threading.Event, options: dict):
+        undecided = set()
+        total = credit_charge.services.ChargeWorkerResult()
+        reported_at, reported_claimed = time.monotonic(), 0
+        self.report(total, reported_at, reported_claimed)
+        while not stop.is_set():
+            close_old_connections()
+            try:
+                with credit_charge.metrics.CHARGE_WORKER_BATCH_SECONDS.time():
+                    result = credit_charge.services.process_waiting_charges(
+                        rules=rules,
+                        batch_size=options["batch_size"],
+                        exclude=undecided,
+                    )
+            except Exception as e:
+                if options["once"]:
+                    raise
+                logger.error(f"Error raised during processing charges: {e}")
+                stop.wait(options["poll_interval"])
+                continue
+
+            undecided.update(result.undecided)
+            total.claimed += result.claimed
+            total.confirmed += result.confirmed
+            total.rejected += result.rejected
+            if time.monotonic() - reported_at >= options["report_interval"]:
+                reported_at, reported_claimed = self.report(total, reported_at, reported_claimed)
+            if result.claimed < options["batch_size"]:
+                if options["once"]:
+                    break
+                stop.wait(options["poll_interval"])
+
+        self.report(total, reported_at, reported_claimed)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Confirmed {total.confirmed} and rejected {total.rejected} charges, "
+                f"left {len(undecided)} for the admin.",
+            ),
+        )
+
+    def report(
+        self,
+        total: credit_charge.services.ChargeWorkerResult,
+        reported_at: float,
+        reported_claimed: int,
+    ) -> tuple[float, int]:
+        now = time.monotonic()
+        waiting = credit_charge.models.Charge.objects.filter(status=credit_charge.consts.TransactionStatus.WAITING)
+        depth = waiting.count()
+        credit_charge.metrics.WAITING_CHARGES.set(depth)
+        rate = (total.claimed - reported_claimed) / max(now - reported_at, 1e-9)
+        self.stdout.write(f"{total.claimed} charges claimed, {rate:.1f}/s since the last report, {depth} waiting.")
+        return now, total.claimed
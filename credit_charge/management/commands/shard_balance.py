@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+import credit_charge.models
+import credit_charge.phone_numbers
+import credit_charge.services
+
+
+class Command(BaseCommand):
+    help = "Split a seller balance into N sub-balances, or rebalance its existing shards."
+
+    def add_arguments(self, parser):
+        parser.add_argument("phone_number")
+        parser.add_argument("--shards", type=int, help="Number of balance shards, 0 disables sharding.")
+        parser.add_argument("--rebalance", action="store_true", help="Spread the balance evenly over the shards.")
+
+    def handle(self, *args, **options):
+        try:
+            seller = credit_charge.models.User.objects.get(
+                phone_key=credit_charge.phone_numbers.to_phone_key(options["phone_number"]),
+            )
+        except credit_charge.models.User.DoesNotExist as e:
+            raise CommandError(f"User {options['phone_number']} does not exist.") from e
+
+        if options["shards"] is not None:
+            if options["shards"] < 0:
+                raise CommandError("--shards must not be negative.")
+            seller = credit_charge.services.set_balance_shard_count(seller=seller, shard_count=options["shards"])
+        elif options["rebalance"]:
+            credit_charge.services.rebalance_balance_shards(seller=seller)
+        else:
+            raise CommandError("Pass --shards or --rebalance.")
+
+        seller = credit_charge.models.User.objects.get(pk=seller.pk)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{seller}: {seller.balance_shard_count} shards, total balance {seller.total_balance}",
+            ),
+        )
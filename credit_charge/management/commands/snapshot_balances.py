@@ -0,0 +1,21 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+import credit_charge.ledger
+
+
+class Command(BaseCommand):
+    help = "Snapshot every balance that changed since its last snapshot, so ledger reads only sum a small delta."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--lag-seconds",
+            type=int,
+            default=60,
+            help="Leave ledger entries younger than this for the next run.",
+        )
+
+    def handle(self, *args, **options):
+        count = credit_charge.ledger.take_snapshots(lag=datetime.timedelta(seconds=options["lag_seconds"]))
+        self.stdout.write(self.style.SUCCESS(f"Took {count} balance snapshots."))
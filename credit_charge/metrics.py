@@ -0,0 +1,97 @@
+import collections
+import contextlib
+import threading
+import time
+
+import credit_charge.models
+import credit_charge.phone_numbers
+import utils.metrics
+
+TRANSFER_SECONDS = utils.metrics.Histogram(
+    "credit_charge_transfer_seconds",
+    "Time spent in services.create_transaction, including waiting for locks.",
+)
+TRANSFER_PHASE_SECONDS = utils.metrics.Histogram(
+    "credit_charge_transfer_phase_seconds",
+    "Time spent in each phase of a transfer. The SQL engine runs lock, insert and balance updates as one statement.",
+    labels=("phase",),
+)
+TRANSFERS = utils.metrics.Counter(
+    "credit_charge_transfers_total",
+    "Transfers by resulting status and description; errors are labelled with the exception class.",
+    labels=("status", "description"),
+)
+SELLER_LOCK_WAITERS = utils.metrics.Gauge(
+    "credit_charge_seller_lock_waiters",
+    "Transfers of a seller waiting behind another transfer of the same seller in this process.",
+    labels=("seller",),
+)
+BALANCE_UPDATE_SECONDS = utils.metrics.Histogram(
+    "credit_charge_balance_update_seconds",
+    "Time spent in User.update_balance.",
+)
+BALANCE_UPDATES = utils.metrics.Counter(
+    "credit_charge_balance_updates_total",
+    "User.update_balance calls by outcome.",
+    labels=("outcome",),
+)
+CHARGE_ACTION_SECONDS = utils.metrics.Histogram(
+    "credit_charge_charge_action_seconds",
+    "Time spent in the admin charge actions.",
+    labels=("action",),
+)
+CHARGE_ACTIONS = utils.metrics.Counter(
+    "credit_charge_charge_actions_total",
+    "Charges handled by the admin charge actions, by result.",
+    labels=("action", "result"),
+)
+
+CHARGE_WORKER_CHARGES = utils.metrics.Counter(
+    "credit_charge_charge_worker_charges_total",
+    "Charges decided by the charge worker, by resulting status and rule.",
+    labels=("status", "rule"),
+)
+CHARGE_WORKER_BATCH_SECONDS = utils.metrics.Histogram(
+    "credit_charge_charge_worker_batch_seconds",
+    "Time spent claiming and processing one batch of charges in the charge worker.",
+)
+WAITING_CHARGES = utils.metrics.Gauge(
+    "credit_charge_waiting_charges",
+    "WAITING charges, as last counted by the charge worker.",
+)
+
+_transfers_in_flight = collections.Counter()
+_transfers_in_flight_lock = threading.Lock()
+
+
+def _seller_id(seller_phone_number: str) -> int | None:
+    phone_key = credit_charge.phone_numbers.to_phone_key(seller_phone_number)
+    if phone_key is None:
+        return None
+    return credit_charge.models.User.objects.filter(phone_key=phone_key).values_list("pk", flat=True).first()
+
+
+@contextlib.contextmanager
+def track_transfer(seller_phone_number: str):
+    # Transfers of a seller serialize on the seller row (or its shards), every transfer that
+    # starts while another one of the same seller is in flight is counted as waiting. Waiters
+    # are labelled with the seller's id, which is only looked up once a transfer has to wait.
+    started = time.perf_counter()
+    with _transfers_in_flight_lock:
+        _transfers_in_flight[seller_phone_number] += 1
+        waiting = _transfers_in_flight[seller_phone_number] > 1
+    seller_id = None
+    try:
+        if waiting:
+            seller_id = _seller_id(seller_phone_number)
+        if seller_id is not None:
+            SELLER_LOCK_WAITERS.inc(seller=str(seller_id))
+        yield
+    finally:
+        if seller_id is not None:
+            SELLER_LOCK_WAITERS.dec(seller=str(seller_id))
+        with _transfers_in_flight_lock:
+            _transfers_in_flight[seller_phone_number] -= 1
+            if not _transfers_in_flight[seller_phone_number]:
+                del _transfers_in_flight[seller_phone_number]
+        TRANSFER_SECONDS.observe(time.perf_counter() - started)
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+import credit_charge.models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("credit_charge", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name="user",
+            managers=[
+                ("objects", credit_charge.models.UserManager()),
+            ],
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="balance_shard_count",
+            field=models.PositiveSmallIntegerField(
+                default=0,
+                help_text="با مقدار صفر، بالانس کاربر بخش\u200cبندی نمی\u200cشود.",
+                verbose_name="تعداد بخش\u200cهای بالانس",
+            ),
+        ),
+        migrations.CreateModel(
+            name="BalanceShard",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("index", models.PositiveSmallIntegerField(verbose_name="شماره بخش")),
+                (
+                    "balance",
+                    models.DecimalField(
+                        decimal_places=0,
+                        default=0,
+                        help_text="تومان",
+                        max_digits=12,
+                        verbose_name="بالانس بخش",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name="balance_shards",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="کاربر",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "بخش بالانس",
+                "verbose_name_plural": "بخش\u200cهای بالانس",
+                "ordering": ("user", "index"),
+                "constraints": [models.UniqueConstraint(fields=("user", "index"), name="unique_balance_shard_index")],
+            },
+        ),
+    ]
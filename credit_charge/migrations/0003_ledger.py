@@ -0,0 +1,116 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:07
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def record_opening_balances(apps, schema_editor):
+    User = apps.get_model("credit_charge", "User")  # noqa: N806
+    LedgerEntry = apps.get_model("credit_charge", "LedgerEntry")  # noqa: N806
+
+    users = User.objects.annotate(shard_balance=models.Sum("balance_shards__balance")).iterator(chunk_size=2000)
+    entries = []
+    for user in users:
+        balance = user.balance + (user.shard_balance or 0)
+        if balance:
+            entries.append(LedgerEntry(user_id=user.pk, amount=balance, kind="OPENING"))
+            entries.append(LedgerEntry(user_id=None, amount=-balance, kind="OPENING"))
+    LedgerEntry.objects.bulk_create(entries, batch_size=2000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("credit_charge", "0002_balance_shards"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BalanceSnapshot",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                (
+                    "balance",
+                    models.DecimalField(decimal_places=0, help_text="تومان", max_digits=12, verbose_name="بالانس"),
+                ),
+                ("last_entry_id", models.BigIntegerField(verbose_name="آخرین سند")),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name="balance_snapshots",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="کاربر",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "تصویر بالانس",
+                "verbose_name_plural": "تصاویر بالانس",
+                "indexes": [models.Index(fields=["user", "created_at"], name="credit_char_user_id_dc1f98_idx")],
+            },
+        ),
+        migrations.CreateModel(
+            name="LedgerEntry",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                (
+                    "amount",
+                    models.DecimalField(decimal_places=0, help_text="تومان", max_digits=12, verbose_name="مبلغ"),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[("OPENING", "Opening Balance"), ("CHARGE", "Charge"), ("TRANSFER", "Transfer")],
+                        max_length=16,
+                        verbose_name="نوع",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "charge",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name="ledger_entries",
+                        to="credit_charge.charge",
+                        verbose_name="شارژ حساب",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name="ledger_entries",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="کاربر",
+                    ),
+                ),
+                (
+                    "user_transaction",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name="ledger_entries",
+                        to="credit_charge.usertransaction",
+                        verbose_name="تراکنش بین کاربران",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "سند دفتر کل",
+                "verbose_name_plural": "اسناد دفتر کل",
+                "indexes": [
+                    models.Index(fields=["user", "created_at"], name="credit_char_user_id_75467a_idx"),
+                    models.Index(fields=["user", "id"], name="credit_char_user_id_04fd74_idx"),
+                ],
+            },
+        ),
+        migrations.RunPython(record_opening_balances, migrations.RunPython.noop),
+    ]
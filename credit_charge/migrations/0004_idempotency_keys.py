@@ -0,0 +1,35 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:08
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("credit_charge", "0003_ledger"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IdempotencyKey",
+            fields=[
+                ("key", models.UUIDField(primary_key=True, serialize=False, verbose_name="کلید")),
+                ("request_fingerprint", models.UUIDField(verbose_name="اثر درخواست")),
+                ("status_code", models.PositiveSmallIntegerField(blank=True, null=True, verbose_name="کد وضعیت پاسخ")),
+                (
+                    "response_body",
+                    models.JSONField(
+                        blank=True,
+                        encoder=django.core.serializers.json.DjangoJSONEncoder,
+                        null=True,
+                        verbose_name="بدنه پاسخ",
+                    ),
+                ),
+                ("expires_at", models.DateTimeField(db_index=True, verbose_name="زمان انقضا")),
+            ],
+            options={
+                "verbose_name": "کلید یکتایی درخواست",
+                "verbose_name_plural": "کلیدهای یکتایی درخواست",
+            },
+        ),
+    ]
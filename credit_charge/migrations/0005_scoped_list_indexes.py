@@ -0,0 +1,71 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("credit_charge", "0004_idempotency_keys"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="charge",
+            index=models.Index(fields=["user", "created_at"], name="credit_char_user_id_9b67f3_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="charge",
+            index=models.Index(fields=["user", "status", "created_at"], name="credit_char_user_id_145e60_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="usertransaction",
+            index=models.Index(fields=["seller", "created_at"], name="credit_char_seller__49b5b3_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="usertransaction",
+            index=models.Index(fields=["receiver_user", "created_at"], name="credit_char_receive_82b7cf_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="usertransaction",
+            index=models.Index(fields=["seller", "status", "created_at"], name="credit_char_seller__4578ee_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="usertransaction",
+            index=models.Index(fields=["receiver_user", "status", "created_at"], name="credit_char_receive_e764a2_idx"),
+        ),
+        migrations.AlterField(
+            model_name="charge",
+            name="user",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="charges",
+                to=settings.AUTH_USER_MODEL,
+                verbose_name="کاربر",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="usertransaction",
+            name="receiver_user",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="receiver_payments",
+                to=settings.AUTH_USER_MODEL,
+                verbose_name="کاربر دریافت کننده",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="usertransaction",
+            name="seller",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="sender_payments",
+                to=settings.AUTH_USER_MODEL,
+                verbose_name="فروشنده",
+            ),
+        ),
+    ]
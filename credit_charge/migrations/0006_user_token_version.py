@@ -0,0 +1,21 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("credit_charge", "0005_scoped_list_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="token_version",
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text="با افزایش این مقدار، توکن\u200cهای صادرشده برای کاربر باطل می\u200cشوند.",
+                verbose_name="نسخه توکن",
+            ),
+        ),
+    ]
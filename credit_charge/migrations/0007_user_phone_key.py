@@ -0,0 +1,46 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:02
+
+from django.db import migrations, models
+
+import credit_charge.phone_numbers
+
+
+def fill_phone_keys(apps, schema_editor):
+    User = apps.get_model("credit_charge", "User")  # noqa: N806
+
+    users = []
+    for user in User.objects.only("pk", "phone_number").iterator(chunk_size=2000):
+        user.phone_key = credit_charge.phone_numbers.to_phone_key(user.phone_number)
+        if user.phone_key is None:
+            raise ValueError(f"User {user.pk} has an invalid phone number {user.phone_number!r}.")
+        users.append(user)
+        if len(users) == 2000:
+            User.objects.bulk_update(users, fields=["phone_key"])
+            users = []
+    User.objects.bulk_update(users, fields=["phone_key"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("credit_charge", "0006_user_token_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="phone_key",
+            field=models.BigIntegerField(editable=False, null=True, verbose_name="کلید شماره موبایل"),
+        ),
+        migrations.RunPython(fill_phone_keys, migrations.RunPython.noop),
+        # Fails when two users have the same number written differently; merge them first.
+        migrations.AlterField(
+            model_name="user",
+            name="phone_key",
+            field=models.BigIntegerField(editable=False, unique=True, verbose_name="کلید شماره موبایل"),
+        ),
+        # phone_number stays unique, which already indexes it.
+        migrations.RemoveIndex(
+            model_name="user",
+            name="credit_char_phone_n_c32595_idx",
+        ),
+    ]
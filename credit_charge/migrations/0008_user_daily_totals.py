@@ -0,0 +1,74 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("credit_charge", "0007_user_phone_key"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserDailyTotals",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("day", models.DateField(verbose_name="روز")),
+                ("slot", models.PositiveSmallIntegerField(default=0, verbose_name="بخش")),
+                (
+                    "charged_amount",
+                    models.DecimalField(
+                        decimal_places=0,
+                        default=0,
+                        help_text="تومان",
+                        max_digits=18,
+                        verbose_name="مبلغ شارژ",
+                    ),
+                ),
+                ("charges", models.PositiveIntegerField(default=0, verbose_name="تعداد شارژ")),
+                ("rejected_charges", models.PositiveIntegerField(default=0, verbose_name="تعداد شارژ ردشده")),
+                (
+                    "sent_amount",
+                    models.DecimalField(
+                        decimal_places=0,
+                        default=0,
+                        help_text="تومان",
+                        max_digits=18,
+                        verbose_name="مبلغ ارسالی",
+                    ),
+                ),
+                ("transfers_sent", models.PositiveIntegerField(default=0, verbose_name="تعداد ارسال")),
+                (
+                    "received_amount",
+                    models.DecimalField(
+                        decimal_places=0,
+                        default=0,
+                        help_text="تومان",
+                        max_digits=18,
+                        verbose_name="مبلغ دریافتی",
+                    ),
+                ),
+                ("transfers_received", models.PositiveIntegerField(default=0, verbose_name="تعداد دریافت")),
+                ("failed_transfers", models.PositiveIntegerField(default=0, verbose_name="تعداد ارسال ناموفق")),
+                (
+                    "user",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name="daily_totals",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="کاربر",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "جمع روزانه کاربر",
+                "verbose_name_plural": "جمع\u200cهای روزانه کاربران",
+                "constraints": [
+                    models.UniqueConstraint(fields=("user", "day", "slot"), name="unique_user_daily_totals"),
+                ],
+            },
+        ),
+    ]
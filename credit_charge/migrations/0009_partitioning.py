@@ -0,0 +1,172 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:20
+
+import datetime
+import re
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+# The partitioning DDL is copied here rather than imported from credit_charge.partitions, so
+# that later changes there leave what this migration does unchanged.
+
+TABLES = ("credit_charge_usertransaction", "credit_charge_charge")
+PARTITION_KEY = "created_at"
+
+PARTITIONED_TABLE_SQL = """
+SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))
+"""
+
+INDEX_DEFINITIONS_SQL = """
+SELECT pg_get_indexdef(indexrelid), indisunique
+FROM pg_index
+WHERE indrelid = to_regclass(%s) AND NOT indisprimary
+"""
+
+FOREIGN_KEYS_SQL = """
+SELECT conname, pg_get_constraintdef(oid)
+FROM pg_constraint
+WHERE conrelid = to_regclass(%s) AND contype = 'f'
+"""
+
+CREATE_PARTITIONED_TABLE_SQL = """
+CREATE TABLE {table} (
+    LIKE {source} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE,
+    PRIMARY KEY (id, {key})
+) PARTITION BY RANGE ({key})
+"""
+
+OLDEST_ROW_SQL = """
+SELECT MIN({key}) FROM {table}
+"""
+
+COPY_ROWS_SQL = """
+INSERT INTO {table} SELECT * FROM {source}
+"""
+
+RESET_SEQUENCE_SQL = """
+SELECT setval(%s, COALESCE(MAX(id), 0) + 1, false) FROM {table}
+"""
+
+
+def add_months(month, months):
+    year, index = divmod(month.month - 1 + months, 12)
+    return datetime.date(month.year + year, index + 1, 1)
+
+
+def bound(month):
+    return f"'{month.isoformat()} 00:00:00+00'"
+
+
+def partition_table(cursor, quote, table, months_ahead):
+    # Converts a regular table into a partitioned one holding the same rows, indexes and
+    # foreign keys. Rows are copied, so on a large table this runs in a maintenance window.
+    # Unique indexes get the partition key appended, as PostgreSQL requires, which drops the
+    # guarantee that id and transaction_id are unique on their own; see credit_charge.partitions.
+    source = f"{table}_unpartitioned"
+    cursor.execute(INDEX_DEFINITIONS_SQL, [table])
+    indexes = cursor.fetchall()
+    cursor.execute(FOREIGN_KEYS_SQL, [table])
+    foreign_keys = cursor.fetchall()
+    cursor.execute(OLDEST_ROW_SQL.format(key=quote(PARTITION_KEY), table=quote(table)))
+    (oldest,) = cursor.fetchone()
+
+    cursor.execute(f"ALTER TABLE {quote(table)} RENAME TO {quote(source)}")
+    cursor.execute(
+        CREATE_PARTITIONED_TABLE_SQL.format(table=quote(table), source=quote(source), key=quote(PARTITION_KEY)),
+    )
+    cursor.execute(f"CREATE TABLE {quote(f'{table}_pdefault')} PARTITION OF {quote(table)} DEFAULT")
+
+    current_month = timezone.now().astimezone(datetime.UTC).date().replace(day=1)
+    month = current_month if oldest is None else oldest.astimezone(datetime.UTC).date().replace(day=1)
+    while month <= add_months(current_month, months_ahead):
+        cursor.execute(
+            f"CREATE TABLE {quote(f'{table}_p{month:%Y%m}')} PARTITION OF {quote(table)} "
+            f"FOR VALUES FROM ({bound(month)}) TO ({bound(add_months(month, 1))})",
+        )
+        month = add_months(month, 1)
+
+    cursor.execute(COPY_ROWS_SQL.format(table=quote(table), source=quote(source)))
+    cursor.execute(f"DROP TABLE {quote(source)}")
+
+    sequence = quote(f"{table}_id_seq")
+    cursor.execute(f"CREATE SEQUENCE {sequence} OWNED BY {quote(table)}.id")
+    cursor.execute(f"ALTER TABLE {quote(table)} ALTER COLUMN id SET DEFAULT nextval('{sequence}')")
+    cursor.execute(RESET_SEQUENCE_SQL.format(table=quote(table)), [f"{table}_id_seq"])
+
+    for definition, unique in indexes:
+        if unique:
+            definition = re.sub(r"\)$", f", {quote(PARTITION_KEY)})", definition)
+        cursor.execute(definition)
+    for name, definition in foreign_keys:
+        cursor.execute(f"ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(name)} {definition}")
+
+
+def partition_tables(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cursor:
+        for table in TABLES:
+            cursor.execute(PARTITIONED_TABLE_SQL, [table])
+            # Tables a rollback left partitioned are kept as they are.
+            if cursor.fetchone()[0]:
+                continue
+            partition_table(cursor, connection.ops.quote_name, table, months_ahead=settings.PARTITION_MONTHS_AHEAD)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("credit_charge", "0008_user_daily_totals"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="ledgerentry",
+            name="charge",
+            field=models.ForeignKey(
+                blank=True,
+                db_constraint=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="ledger_entries",
+                to="credit_charge.charge",
+                verbose_name="شارژ حساب",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="ledgerentry",
+            name="user_transaction",
+            field=models.ForeignKey(
+                blank=True,
+                db_constraint=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="ledger_entries",
+                to="credit_charge.usertransaction",
+                verbose_name="تراکنش بین کاربران",
+            ),
+        ),
+        migrations.CreateModel(
+            name="ArchivedRow",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("table", models.CharField(max_length=63, verbose_name="جدول")),
+                ("transaction_id", models.UUIDField(verbose_name="شناسه تراکنش")),
+                ("month", models.DateField(verbose_name="ماه")),
+                ("path", models.CharField(max_length=255, verbose_name="فایل بایگانی")),
+            ],
+            options={
+                "verbose_name": "ردیف بایگانی‌شده",
+                "verbose_name_plural": "ردیف‌های بایگانی‌شده",
+                "constraints": [
+                    models.UniqueConstraint(fields=("transaction_id", "table"), name="unique_archived_row"),
+                ],
+            },
+        ),
+        # Copies both tables into partitioned ones; see partition_table before running it on a large database.
+        # Rolling back leaves them partitioned: earlier migrations see the same columns and indexes, and
+        # un-partitioning would copy every row again. Applying this migration again skips them.
+        migrations.RunPython(partition_tables, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,16 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("credit_charge", "0009_partitioning"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="charge",
+            index=models.Index(condition=models.Q(("status", "WAITING")), fields=["id"], name="charge_waiting_idx"),
+        ),
+    ]
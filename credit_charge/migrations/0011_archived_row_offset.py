@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-18 20:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("credit_charge", "0010_charge_waiting_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="archivedrow",
+            name="offset",
+            field=models.BigIntegerField(default=0, verbose_name="موقعیت در فایل"),
+        ),
+    ]
@@ -2,20 +2,43 @@ import decimal
 import logging
 import uuid
 
+import django.core.exceptions
 import model_utils
 from django.contrib.auth import models as django_auth_models
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 import credit_charge.consts
 import credit_charge.exceptions
+import credit_charge.metrics
 import credit_charge.model_validators
+import credit_charge.phone_numbers
+import credit_charge.user_cache
 import utils.consts
 import utils.models
 
 logger = logging.getLogger(__name__)
 
 
+class UserManager(django_auth_models.UserManager):
+    def with_shard_balance(self) -> models.QuerySet["User"]:
+        shard_balance = (
+            BalanceShard.objects.filter(user=models.OuterRef("pk"))
+            .values("user")
+            .annotate(total=models.Sum("balance"))
+            .values("total")
+        )
+        return self.annotate(
+            shard_balance=models.Case(
+                models.When(balance_shard_count=0, then=models.Value(None)),
+                default=models.Subquery(shard_balance),
+                output_field=models.DecimalField(max_digits=12, decimal_places=0),
+            ),
+        )
+
+
 class User(django_auth_models.AbstractUser, utils.models.CreateUpdateTracker):
     phone_number = models.CharField(
         **utils.consts.nbfalse,
@@ -24,6 +47,14 @@ class User(django_auth_models.AbstractUser, utils.models.CreateUpdateTracker):
         verbose_name=_("شماره موبایل"),
         validators=[credit_charge.model_validators.validate_phone_number],
     )
+    # Filled from phone_number on save; users are looked up by this key, whatever form the
+    # phone number was given in.
+    phone_key = models.BigIntegerField(
+        **utils.consts.nbfalse,
+        unique=True,
+        editable=False,
+        verbose_name=_("کلید شماره موبایل"),
+    )
     balance = models.DecimalField(
         **utils.consts.nbfalse,
         verbose_name=_("بالانس حساب کاربر"),
@@ -37,6 +68,20 @@ class User(django_auth_models.AbstractUser, utils.models.CreateUpdateTracker):
         verbose_name=_("فروشنده"),
         default=False,
     )
+    balance_shard_count = models.PositiveSmallIntegerField(
+        **utils.consts.nbfalse,
+        verbose_name=_("تعداد بخش‌های بالانس"),
+        help_text=_("با مقدار صفر، بالانس کاربر بخش‌بندی نمی‌شود."),
+        default=0,
+    )
+    token_version = models.PositiveIntegerField(
+        **utils.consts.nbfalse,
+        verbose_name=_("نسخه توکن"),
+        help_text=_("با افزایش این مقدار، توکن‌های صادرشده برای کاربر باطل می‌شوند."),
+        default=0,
+    )
+
+    objects = UserManager()
 
     def __str__(self) -> str:
         return str(self.phone_number)
@@ -44,33 +89,97 @@ class User(django_auth_models.AbstractUser, utils.models.CreateUpdateTracker):
     class Meta:
         verbose_name = _("کاربر")
         verbose_name_plural = _("کاربران")
-        indexes = [
-            models.Index(fields=["phone_number"]),
-        ]
         ordering = ("-created_at",)
 
+    def clean(self):
+        super().clean()
+        phone_key = credit_charge.phone_numbers.to_phone_key(self.phone_number or "")
+        if phone_key is not None and User.objects.filter(phone_key=phone_key).exclude(pk=self.pk).exists():
+            raise django.core.exceptions.ValidationError(
+                {"phone_number": _("کاربری با این شماره موبایل وجود دارد.")},
+            )
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "phone_number" in update_fields:
+            self.phone_key = credit_charge.phone_numbers.to_phone_key(self.phone_number)
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, "phone_key"}
+        super().save(*args, **kwargs)
+
+    @property
+    def is_balance_sharded(self) -> bool:
+        return self.balance_shard_count > 0
+
+    @property
+    def total_balance(self) -> decimal.Decimal:
+        if not self.is_balance_sharded:
+            return self.balance
+        shard_balance = getattr(self, "shard_balance", None)
+        if shard_balance is None:
+            shard_balance = self.balance_shards.aggregate(total=models.Sum("balance"))["total"]
+        return self.balance + (shard_balance or 0)
+
     def update_balance(
         self,
         amount: decimal.Decimal,
     ):
         try:
-            initial_balance = self.balance
-            self.balance += amount
-            if self.balance < 0:
-                raise credit_charge.exceptions.NegetavieBalanceError(
-                    amount=amount,
-                    user=self,
-                    user_balance=initial_balance,
-                )
-            self.save(update_fields=["balance"])
+            with credit_charge.metrics.BALANCE_UPDATE_SECONDS.time():
+                initial_balance = self.balance
+                self.balance += amount
+                if self.balance < 0:
+                    raise credit_charge.exceptions.NegetavieBalanceError(
+                        amount=amount,
+                        user=self,
+                        user_balance=initial_balance,
+                    )
+                self.save(update_fields=["balance"])
+                credit_charge.user_cache.invalidate([self.pk])
+            credit_charge.metrics.BALANCE_UPDATES.inc(outcome="applied")
         except credit_charge.exceptions.NegetavieBalanceError as e:
+            credit_charge.metrics.BALANCE_UPDATES.inc(outcome="insufficient_balance")
             logger.error(f"User {self} has insufficient balance: {e}")
             raise e
         except Exception as e:
+            credit_charge.metrics.BALANCE_UPDATES.inc(outcome="error")
             logger.error(f"Error raised during updating {self} wallet balance: {e}")
             raise e
 
 
+class BalanceShard(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.PROTECT,
+        **utils.consts.nbfalse,
+        related_name="balance_shards",
+        verbose_name=_("کاربر"),
+    )
+    index = models.PositiveSmallIntegerField(
+        **utils.consts.nbfalse,
+        verbose_name=_("شماره بخش"),
+    )
+    balance = models.DecimalField(
+        **utils.consts.nbfalse,
+        verbose_name=_("بالانس بخش"),
+        help_text=_("تومان"),
+        max_digits=12,
+        decimal_places=0,
+        default=0,
+    )
+
+    class Meta:
+        verbose_name = _("بخش بالانس")
+        verbose_name_plural = _("بخش‌های بالانس")
+        constraints = [
+            models.UniqueConstraint(fields=["user", "index"], name="unique_balance_shard_index"),
+        ]
+        ordering = ("user", "index")
+
+    def __str__(self) -> str:
+        return f"{self.user_id} - {self.index}"
+
+
 class Charge(utils.models.CreateUpdateTracker):
     user = models.ForeignKey(
         User,
@@ -78,6 +187,7 @@ class Charge(utils.models.CreateUpdateTracker):
         **utils.consts.nbfalse,
         related_name="charges",
         verbose_name=_("کاربر"),
+        db_index=False,
     )
     status = models.CharField(
         max_length=16,
@@ -94,6 +204,9 @@ class Charge(utils.models.CreateUpdateTracker):
         help_text=_("تومان"),
     )
 
+    # On PostgreSQL the table is partitioned (credit_charge.partitions) and the database only
+    # enforces (transaction_id, created_at) as unique; transaction_id alone is unique because
+    # every code path generates it with uuid4, not because of a constraint.
     transaction_id = models.UUIDField(
         **utils.consts.nbfalse,
         verbose_name=_("شناسه شارژ"),
@@ -106,6 +219,17 @@ class Charge(utils.models.CreateUpdateTracker):
         verbose_name = _("شارژ حساب")
         verbose_name_plural = _("شارژ حساب‌ها")
         ordering = ("-created_at",)
+        # The leading user column also serves the foreign key, so it has no index of its own.
+        indexes = [
+            models.Index(fields=["user", "created_at"]),
+            models.Index(fields=["user", "status", "created_at"]),
+            # The queue of the charge worker, and the count of its depth.
+            models.Index(
+                fields=["id"],
+                condition=models.Q(status=credit_charge.consts.TransactionStatus.WAITING),
+                name="charge_waiting_idx",
+            ),
+        ]
 
     def __str__(self) -> str:
         return f"{self.user} - {self.status}"
@@ -143,6 +267,7 @@ class UserTransaction(utils.models.CreateUpdateTracker):
         on_delete=models.PROTECT,
         **utils.consts.nbfalse,
         related_name="sender_payments",
+        db_index=False,
         verbose_name=_("فروشنده"),
     )
     receiver_user = models.ForeignKey(
@@ -150,8 +275,12 @@ class UserTransaction(utils.models.CreateUpdateTracker):
         on_delete=models.PROTECT,
         **utils.consts.nbfalse,
         related_name="receiver_payments",
+        db_index=False,
         verbose_name=_("کاربر دریافت کننده"),
     )
+    # On PostgreSQL the table is partitioned (credit_charge.partitions) and the database only
+    # enforces (transaction_id, created_at) as unique; transaction_id alone is unique because
+    # every code path generates it with uuid4, not because of a constraint.
     transaction_id = models.UUIDField(
         **utils.consts.nbfalse,
         verbose_name=_("کد پیگیری"),
@@ -184,6 +313,12 @@ class UserTransaction(utils.models.CreateUpdateTracker):
         verbose_name = _("تراکنش بین کاربران")
         verbose_name_plural = _("تراکنش‌های بین کاربران")
         ordering = ("-created_at",)
+        indexes = [
+            models.Index(fields=["seller", "created_at"]),
+            models.Index(fields=["receiver_user", "created_at"]),
+            models.Index(fields=["seller", "status", "created_at"]),
+            models.Index(fields=["receiver_user", "status", "created_at"]),
+        ]
 
     @classmethod
     def create_transaction(cls, amount: decimal.Decimal, receiver_user: User, seller: User) -> "UserTransaction":
@@ -203,7 +338,7 @@ class UserTransaction(utils.models.CreateUpdateTracker):
     def reject_transaction(self, reason: credit_charge.consts.UserTransactionDescription):
         self.status = credit_charge.consts.TransactionStatus.FAILED
         self.description = reason
-        self.save(update_fields=["status"])
+        self.save(update_fields=["status", "description"])
 
     def clean(self, **kwargs):
         credit_charge.model_validators.validate_transaction_status(self)
@@ -212,3 +347,245 @@ class UserTransaction(utils.models.CreateUpdateTracker):
     def save(self, **kwargs):
         self.clean()
         return super().save(**kwargs)
+
+
+class LedgerEntry(models.Model):
+    # Entries are append-only. Every posting writes entries that sum to zero, with a null
+    # user standing for money entering or leaving the system (e.g. a confirmed charge).
+    # Charges and transfers are partitioned and archived on PostgreSQL (credit_charge.partitions),
+    # so the entries outlive them and reference them without a database constraint.
+    user = models.ForeignKey(
+        User,
+        on_delete=models.PROTECT,
+        **utils.consts.nbtrue,
+        related_name="ledger_entries",
+        verbose_name=_("کاربر"),
+    )
+    amount = models.DecimalField(
+        max_digits=12,
+        decimal_places=0,
+        **utils.consts.nbfalse,
+        verbose_name=_("مبلغ"),
+        help_text=_("تومان"),
+    )
+    kind = models.CharField(
+        max_length=16,
+        **utils.consts.nbfalse,
+        choices=credit_charge.consts.LedgerEntryKind,
+        verbose_name=_("نوع"),
+    )
+    charge = models.ForeignKey(
+        Charge,
+        on_delete=models.PROTECT,
+        **utils.consts.nbtrue,
+        related_name="ledger_entries",
+        verbose_name=_("شارژ حساب"),
+        db_constraint=False,
+    )
+    user_transaction = models.ForeignKey(
+        UserTransaction,
+        on_delete=models.PROTECT,
+        **utils.consts.nbtrue,
+        related_name="ledger_entries",
+        verbose_name=_("تراکنش بین کاربران"),
+        db_constraint=False,
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = _("سند دفتر کل")
+        verbose_name_plural = _("اسناد دفتر کل")
+        indexes = [
+            models.Index(fields=["user", "created_at"]),
+            models.Index(fields=["user", "id"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.user} - {self.kind} - {self.amount}"
+
+    def save(self, **kwargs):
+        if not self._state.adding:
+            raise credit_charge.exceptions.ImmutableLedgerEntryError(self)
+        return super().save(**kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise credit_charge.exceptions.ImmutableLedgerEntryError(self)
+
+
+class BalanceSnapshot(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.PROTECT,
+        **utils.consts.nbfalse,
+        related_name="balance_snapshots",
+        verbose_name=_("کاربر"),
+    )
+    balance = models.DecimalField(
+        max_digits=12,
+        decimal_places=0,
+        **utils.consts.nbfalse,
+        verbose_name=_("بالانس"),
+        help_text=_("تومان"),
+    )
+    last_entry_id = models.BigIntegerField(
+        **utils.consts.nbfalse,
+        verbose_name=_("آخرین سند"),
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = _("تصویر بالانس")
+        verbose_name_plural = _("تصاویر بالانس")
+        indexes = [
+            models.Index(fields=["user", "created_at"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.user} - {self.balance} - {self.created_at}"
+
+
+class UserDailyTotals(models.Model):
+    # Per user and day sums of charges and transfers, added to by the transaction that
+    # confirms them (credit_charge.rollups). Debits of a sharded seller go to slot 1 + the index
+    # of the balance shard they were taken from, so that they do not queue on a single row;
+    # every other update goes to slot 0.
+    user = models.ForeignKey(
+        User,
+        on_delete=models.PROTECT,
+        **utils.consts.nbfalse,
+        related_name="daily_totals",
+        verbose_name=_("کاربر"),
+        db_index=False,
+    )
+    day = models.DateField(
+        **utils.consts.nbfalse,
+        verbose_name=_("روز"),
+    )
+    slot = models.PositiveSmallIntegerField(
+        **utils.consts.nbfalse,
+        verbose_name=_("بخش"),
+        default=0,
+    )
+    charged_amount = models.DecimalField(
+        max_digits=18,
+        decimal_places=0,
+        **utils.consts.nbfalse,
+        verbose_name=_("مبلغ شارژ"),
+        help_text=_("تومان"),
+        default=0,
+    )
+    charges = models.PositiveIntegerField(**utils.consts.nbfalse, verbose_name=_("تعداد شارژ"), default=0)
+    rejected_charges = models.PositiveIntegerField(
+        **utils.consts.nbfalse,
+        verbose_name=_("تعداد شارژ ردشده"),
+        default=0,
+    )
+    sent_amount = models.DecimalField(
+        max_digits=18,
+        decimal_places=0,
+        **utils.consts.nbfalse,
+        verbose_name=_("مبلغ ارسالی"),
+        help_text=_("تومان"),
+        default=0,
+    )
+    transfers_sent = models.PositiveIntegerField(**utils.consts.nbfalse, verbose_name=_("تعداد ارسال"), default=0)
+    received_amount = models.DecimalField(
+        max_digits=18,
+        decimal_places=0,
+        **utils.consts.nbfalse,
+        verbose_name=_("مبلغ دریافتی"),
+        help_text=_("تومان"),
+        default=0,
+    )
+    transfers_received = models.PositiveIntegerField(
+        **utils.consts.nbfalse,
+        verbose_name=_("تعداد دریافت"),
+        default=0,
+    )
+    failed_transfers = models.PositiveIntegerField(
+        **utils.consts.nbfalse,
+        verbose_name=_("تعداد ارسال ناموفق"),
+        default=0,
+    )
+
+    class Meta:
+        verbose_name = _("جمع روزانه کاربر")
+        verbose_name_plural = _("جمع‌های روزانه کاربران")
+        # Also serves the user foreign key and the day range scans of a user's summary.
+        constraints = [
+            models.UniqueConstraint(fields=["user", "day", "slot"], name="unique_user_daily_totals"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.user_id} - {self.day} - {self.slot}"
+
+
+class ArchivedRow(models.Model):
+    # Where an archived transaction or charge is, by transaction_id (credit_charge.partitions).
+    table = models.CharField(
+        max_length=63,
+        **utils.consts.nbfalse,
+        verbose_name=_("جدول"),
+    )
+    transaction_id = models.UUIDField(
+        **utils.consts.nbfalse,
+        verbose_name=_("شناسه تراکنش"),
+    )
+    month = models.DateField(
+        **utils.consts.nbfalse,
+        verbose_name=_("ماه"),
+    )
+    path = models.CharField(
+        max_length=255,
+        **utils.consts.nbfalse,
+        verbose_name=_("فایل بایگانی"),
+    )
+    # Byte offset of the gzip member holding the row; the file is one member per chunk of rows.
+    offset = models.BigIntegerField(
+        **utils.consts.nbfalse,
+        default=0,
+        verbose_name=_("موقعیت در فایل"),
+    )
+
+    class Meta:
+        verbose_name = _("ردیف بایگانی‌شده")
+        verbose_name_plural = _("ردیف‌های بایگانی‌شده")
+        constraints = [
+            models.UniqueConstraint(fields=["transaction_id", "table"], name="unique_archived_row"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.table} - {self.transaction_id}"
+
+
+class IdempotencyKey(models.Model):
+    # key and request_fingerprint are truncated SHA-256 digests stored in native UUID columns.
+    key = models.UUIDField(
+        primary_key=True,
+        verbose_name=_("کلید"),
+    )
+    request_fingerprint = models.UUIDField(
+        **utils.consts.nbfalse,
+        verbose_name=_("اثر درخواست"),
+    )
+    status_code = models.PositiveSmallIntegerField(
+        **utils.consts.nbtrue,
+        verbose_name=_("کد وضعیت پاسخ"),
+    )
+    response_body = models.JSONField(
+        **utils.consts.nbtrue,
+        encoder=DjangoJSONEncoder,
+        verbose_name=_("بدنه پاسخ"),
+    )
+    expires_at = models.DateTimeField(
+        **utils.consts.nbfalse,
+        db_index=True,
+        verbose_name=_("زمان انقضا"),
+    )
+
+    class Meta:
+        verbose_name = _("کلید یکتایی درخواست")
+        verbose_name_plural = _("کلیدهای یکتایی درخواست")
+
+    def __str__(self) -> str:
+        return str(self.key)
@@ -0,0 +1,207 @@
+import dataclasses
+import datetime
+import gzip
+import json
+import logging
+import os
+import re
+import uuid
+
+from django.conf import settings
+from django.core import exceptions as django_exceptions
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+import credit_charge.consts
+import credit_charge.exceptions
+import credit_charge.exports
+import credit_charge.models
+import credit_charge.queries
+
+logger = logging.getLogger(__name__)
+
+# On PostgreSQL, UserTransaction and Charge are range partitioned by created_at, one UTC month
+# per partition (migration 0009). Partitions are named <table>_pYYYYMM and a <table>_pdefault
+# partition catches rows no monthly partition covers. `manage_partitions` creates partitions
+# ahead of time and archives old ones: their rows are written to a gzipped NDJSON file,
+# indexed by transaction_id in ArchivedRow, and the partition is dropped. Retrieving an
+# archived transaction or charge through the API reads it back from its file. Every chunk of
+# EXPORT_CHUNK_SIZE rows is its own gzip member, ArchivedRow keeps the member's offset, so a
+# lookup decompresses one chunk rather than the month.
+#
+# PostgreSQL requires unique indexes on a partitioned table to include the partition key, so
+# migration 0009 turned every unique index into one on (..., created_at). Rows of different
+# months are not checked against each other: the database no longer guarantees that
+# transaction_id is unique, only that it is unique among rows created at the same instant.
+
+PARTITION_KEY = "created_at"
+
+
+@dataclasses.dataclass(frozen=True)
+class PartitionedTable:
+    model: type[models.Model]
+    # Columns of the users a row belongs to, archived rows are only shown to them.
+    owner_fields: tuple[str, ...]
+
+    @property
+    def table(self) -> str:
+        return self.model._meta.db_table
+
+
+TRANSACTIONS = PartitionedTable(
+    model=credit_charge.models.UserTransaction,
+    owner_fields=("seller_id", "receiver_user_id"),
+)
+CHARGES = PartitionedTable(model=credit_charge.models.Charge, owner_fields=("user_id",))
+TABLES = (TRANSACTIONS, CHARGES)
+
+
+def add_months(month: datetime.date, months: int) -> datetime.date:
+    year, index = divmod(month.month - 1 + months, 12)
+    return datetime.date(month.year + year, index + 1, 1)
+
+
+def current_month() -> datetime.date:
+    return timezone.now().astimezone(datetime.UTC).date().replace(day=1)
+
+
+def partition_name(table: str, month: datetime.date) -> str:
+    return f"{table}_p{month:%Y%m}"
+
+
+def default_partition_name(table: str) -> str:
+    return f"{table}_pdefault"
+
+
+def _bound(month: datetime.date) -> str:
+    return f"'{month.isoformat()} 00:00:00+00'"
+
+
+def is_partitioned(table: str, using=None) -> bool:
+    using = using or connection
+    if using.vendor != "postgresql":
+        return False
+    with using.cursor() as cursor:
+        cursor.execute(credit_charge.queries.PARTITIONED_TABLE_SQL, [table])
+        return cursor.fetchone()[0]
+
+
+def monthly_partitions(table: str, using=None) -> dict[datetime.date, str]:
+    using = using or connection
+    pattern = re.compile(rf"^{re.escape(table)}_p(\d{{4}})(\d{{2}})$")
+    with using.cursor() as cursor:
+        cursor.execute(credit_charge.queries.PARTITIONS_SQL, [table])
+        names = [name for (name,) in cursor.fetchall()]
+    return {
+        datetime.date(int(match[1]), int(match[2]), 1): name
+        for name, match in ((name, pattern.match(name)) for name in names)
+        if match is not None
+    }
+
+
+def create_partition(table: str, month: datetime.date, using=None) -> str:
+    using = using or connection
+    quote = using.ops.quote_name
+    name = partition_name(table, month)
+    names = {
+        "table": quote(table),
+        "partition": quote(name),
+        "default": quote(default_partition_name(table)),
+        "key": quote(PARTITION_KEY),
+        "start": _bound(month),
+        "end": _bound(add_months(month, 1)),
+    }
+    with transaction.atomic(using=using.alias), using.cursor() as cursor:
+        cursor.execute(credit_charge.queries.CREATE_PARTITION_TABLE_SQL.format(**names))
+        cursor.execute(credit_charge.queries.MOVE_DEFAULT_PARTITION_ROWS_SQL.format(**names))
+        cursor.execute(credit_charge.queries.ATTACH_PARTITION_SQL.format(**names))
+    logger.info(f"Created partition {name}")
+    return name
+
+
+def create_future_partitions(table: str, months_ahead: int, using=None) -> list[str]:
+    existing = monthly_partitions(table, using=using)
+    months = (add_months(current_month(), offset) for offset in range(months_ahead + 1))
+    return [create_partition(table, month, using=using) for month in months if month not in existing]
+
+
+@transaction.atomic
+def archive_partition(partitioned: PartitionedTable, month: datetime.date, directory: str) -> int:
+    # Writes the rows of the partition to <directory>/<partition>.ndjson.gz, indexes them in
+    # ArchivedRow, then detaches and drops it. Rows are read while the partition is still
+    # attached; the lock that blocks writers to the table is only taken by the detach at the
+    # end and held until the commit. Partitions with WAITING rows are left alone, those rows
+    # may still change.
+    quote = connection.ops.quote_name
+    name = partition_name(partitioned.table, month)
+    path = os.path.join(directory, f"{name}.ndjson.gz")
+    os.makedirs(directory, exist_ok=True)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            credit_charge.queries.PARTITION_HAS_STATUS_SQL.format(partition=quote(name)),
+            [credit_charge.consts.TransactionStatus.WAITING.value],
+        )
+        if cursor.fetchone()[0]:
+            raise credit_charge.exceptions.PartitionInUseError(name)
+
+    count = 0
+    with connection.chunked_cursor() as cursor, open(f"{path}.tmp", "wb") as file:
+        cursor.execute(credit_charge.queries.PARTITION_ROWS_SQL.format(partition=quote(name)))
+        columns = [column[0] for column in cursor.description]
+        while rows := cursor.fetchmany(settings.EXPORT_CHUNK_SIZE):
+            offset = file.tell()
+            lines, archived = [], []
+            for row in rows:
+                row = dict(zip(columns, map(credit_charge.exports.encode_value, row), strict=True))
+                lines.append(json.dumps(row, ensure_ascii=False) + "\n")
+                archived.append(
+                    credit_charge.models.ArchivedRow(
+                        table=partitioned.table,
+                        transaction_id=row["transaction_id"],
+                        month=month,
+                        path=path,
+                        offset=offset,
+                    ),
+                )
+            file.write(gzip.compress("".join(lines).encode()))
+            credit_charge.models.ArchivedRow.objects.bulk_create(archived)
+            count += len(rows)
+    os.replace(f"{path}.tmp", path)
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {quote(partitioned.table)} DETACH PARTITION {quote(name)}")
+        cursor.execute(f"DROP TABLE {quote(name)}")
+    logger.info(f"Archived {count} rows of {name} to {path}")
+    return count
+
+
+def archived_row(partitioned: PartitionedTable, transaction_id: str | uuid.UUID) -> dict | None:
+    # The archived row in the form `values()` returns it, or None. Only the gzip member at
+    # the row's offset is read, up to the row.
+    try:
+        archived = credit_charge.models.ArchivedRow.objects.filter(
+            table=partitioned.table,
+            transaction_id=transaction_id,
+        ).first()
+    except (ValueError, django_exceptions.ValidationError):
+        return None
+    if archived is None:
+        return None
+
+    transaction_id = str(archived.transaction_id)
+    with open(archived.path, "rb") as raw:
+        raw.seek(archived.offset)
+        with gzip.open(raw, "rt", encoding="utf-8") as file:
+            for line in file:
+                if transaction_id not in line:
+                    continue
+                row = json.loads(line)
+                if row["transaction_id"] == transaction_id:
+                    return {
+                        field.attname: field.to_python(row[field.column])
+                        for field in partitioned.model._meta.concrete_fields
+                        if field.column in row
+                    }
+    logger.error(f"Archived {partitioned.table} row {transaction_id} is missing from {archived.path}")
+    return None
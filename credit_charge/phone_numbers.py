@@ -0,0 +1,20 @@
+from django.conf import settings
+
+
+def to_phone_key(phone_number: str) -> int | None:
+    # The numeric E.164 form of a phone number, used for lookups: "+989121234567",
+    # "00989121234567" and "09121234567" all map to 989121234567. National numbers, with a
+    # single leading zero, are taken to be in PHONE_NUMBER_COUNTRY_CODE. Returns None for
+    # anything that is not a phone number.
+    value = phone_number.strip()
+    if value.startswith("+"):
+        digits = value[1:]
+    elif value.startswith("00"):
+        digits = value[2:]
+    elif value.startswith("0"):
+        digits = settings.PHONE_NUMBER_COUNTRY_CODE + value[1:]
+    else:
+        digits = value
+    if not digits.isascii() or not digits.isdigit() or len(digits) > 15:
+        return None
+    return int(digits)
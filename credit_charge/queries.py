@@ -0,0 +1,180 @@
+TRANSFER_SQL = """
+WITH seller_info AS (
+    SELECT id, phone_number, balance, is_seller, balance_shard_count
+    FROM credit_charge_user
+    WHERE phone_key = %(seller_phone_key)s
+),
+locked AS (
+    SELECT id, phone_number, phone_key, balance, is_seller, balance_shard_count
+    FROM credit_charge_user
+    WHERE phone_key = %(receiver_phone_key)s
+        OR (phone_key = %(seller_phone_key)s AND balance_shard_count = 0)
+    ORDER BY id
+    FOR NO KEY UPDATE
+),
+seller AS (
+    SELECT id, balance, is_seller
+    FROM locked
+    WHERE phone_key = %(seller_phone_key)s AND balance_shard_count = 0
+),
+receiver AS (
+    SELECT id, phone_number, balance, is_seller, balance_shard_count
+    FROM locked
+    WHERE phone_key = %(receiver_phone_key)s
+),
+transfer AS (
+    SELECT seller.id AS seller_id, receiver.id AS receiver_id, seller.balance >= %(amount)s AS confirmed
+    FROM seller, receiver
+    WHERE seller.is_seller
+),
+balances AS (
+    UPDATE credit_charge_user AS u
+    SET balance = u.balance
+        - CASE WHEN u.id = transfer.seller_id THEN %(amount)s ELSE 0 END
+        + CASE WHEN u.id = transfer.receiver_id THEN %(amount)s ELSE 0 END
+    FROM transfer
+    WHERE transfer.confirmed AND u.id IN (transfer.seller_id, transfer.receiver_id)
+    RETURNING u.id, u.balance
+),
+inserted AS (
+    INSERT INTO credit_charge_usertransaction (
+        created_at, updated_at, seller_id, receiver_user_id, transaction_id, amount, status, description
+    )
+    SELECT
+        %(now)s,
+        %(now)s,
+        transfer.seller_id,
+        transfer.receiver_id,
+        %(transaction_id)s,
+        %(amount)s,
+        CASE WHEN transfer.confirmed THEN %(confirmed)s ELSE %(failed)s END,
+        CASE WHEN transfer.confirmed THEN NULL ELSE %(insufficient_balance)s END
+    FROM transfer
+    RETURNING id, created_at, updated_at, seller_id, receiver_user_id, transaction_id, amount, status, description
+),
+ledger AS (
+    INSERT INTO credit_charge_ledgerentry (user_id, amount, kind, user_transaction_id, created_at)
+    SELECT entry.user_id, entry.amount, %(ledger_kind)s, inserted.id, inserted.created_at
+    FROM inserted
+    CROSS JOIN LATERAL (
+        VALUES (inserted.seller_id, -inserted.amount), (inserted.receiver_user_id, inserted.amount)
+    ) AS entry (user_id, amount)
+    WHERE inserted.status = %(confirmed)s
+),
+rollups AS (
+    INSERT INTO credit_charge_userdailytotals (
+        user_id, day, slot, charged_amount, charges, rejected_charges,
+        sent_amount, transfers_sent, received_amount, transfers_received, failed_transfers
+    )
+    SELECT entry.user_id, %(day)s, 0, 0, 0, 0,
+        SUM(entry.sent_amount), SUM(entry.transfers_sent),
+        SUM(entry.received_amount), SUM(entry.transfers_received), SUM(entry.failed_transfers)
+    FROM inserted
+    CROSS JOIN LATERAL (
+        VALUES
+            (inserted.seller_id, inserted.amount, 1, 0, 0, 0, TRUE),
+            (inserted.receiver_user_id, 0, 0, inserted.amount, 1, 0, TRUE),
+            (inserted.seller_id, 0, 0, 0, 0, 1, FALSE)
+    ) AS entry (
+        user_id, sent_amount, transfers_sent, received_amount, transfers_received, failed_transfers, confirmed
+    )
+    WHERE (inserted.status = %(confirmed)s) = entry.confirmed
+    GROUP BY entry.user_id
+    ORDER BY entry.user_id
+    ON CONFLICT (user_id, day, slot) DO UPDATE SET
+        sent_amount = credit_charge_userdailytotals.sent_amount + EXCLUDED.sent_amount,
+        transfers_sent = credit_charge_userdailytotals.transfers_sent + EXCLUDED.transfers_sent,
+        received_amount = credit_charge_userdailytotals.received_amount + EXCLUDED.received_amount,
+        transfers_received = credit_charge_userdailytotals.transfers_received + EXCLUDED.transfers_received,
+        failed_transfers = credit_charge_userdailytotals.failed_transfers + EXCLUDED.failed_transfers
+)
+SELECT
+    seller_info.id,
+    seller_info.phone_number,
+    COALESCE((SELECT balances.balance FROM balances WHERE balances.id = seller_info.id), seller.balance, seller_info.balance),
+    seller_info.is_seller,
+    seller_info.balance_shard_count,
+    receiver.id,
+    receiver.phone_number,
+    COALESCE((SELECT balances.balance FROM balances WHERE balances.id = receiver.id), receiver.balance),
+    receiver.is_seller,
+    receiver.balance_shard_count,
+    inserted.id,
+    inserted.created_at,
+    inserted.updated_at,
+    inserted.seller_id,
+    inserted.receiver_user_id,
+    inserted.transaction_id,
+    inserted.amount,
+    inserted.status,
+    inserted.description
+FROM (SELECT 1) AS one
+LEFT JOIN seller_info ON TRUE
+LEFT JOIN seller ON TRUE
+LEFT JOIN receiver ON TRUE
+LEFT JOIN inserted ON TRUE
+"""
+
+# `{charges}` is a compiled `SELECT id` subquery. Re-checking the status in the UPDATE makes
+# concurrent confirmations of the same charge serialize on its row lock, and only the first
+# one sees it as WAITING.
+TRANSITION_CHARGES_SQL = """
+UPDATE credit_charge_charge
+SET status = %s, updated_at = %s
+WHERE status = %s AND id IN (
+    SELECT id
+    FROM credit_charge_charge
+    WHERE id IN ({charges})
+    ORDER BY id
+    {lock}
+)
+RETURNING id, user_id, amount
+"""
+
+LOCK_DAILY_TOTALS_SQL = """
+LOCK TABLE credit_charge_userdailytotals IN SHARE ROW EXCLUSIVE MODE
+"""
+
+UPSERT_DAILY_TOTALS_SQL = """
+INSERT INTO credit_charge_userdailytotals (user_id, day, slot, {columns})
+VALUES {values}
+ON CONFLICT (user_id, day, slot) DO UPDATE SET {updates}
+"""
+
+# Catalog queries and DDL of the monthly partitions, see credit_charge.partitions. Identifiers
+# are quoted and bounds formatted by the caller; DDL does not take bind parameters.
+PARTITIONED_TABLE_SQL = """
+SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))
+"""
+
+PARTITIONS_SQL = """
+SELECT child.relname
+FROM pg_inherits
+JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+WHERE pg_inherits.inhparent = to_regclass(%s)
+"""
+
+CREATE_PARTITION_TABLE_SQL = """
+CREATE TABLE {partition} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE)
+"""
+
+PARTITION_HAS_STATUS_SQL = """
+SELECT EXISTS (SELECT 1 FROM {partition} WHERE status = %s)
+"""
+
+PARTITION_ROWS_SQL = """
+SELECT * FROM {partition} ORDER BY id
+"""
+
+# Rows of the month that already landed in the default partition are moved into the new one,
+# otherwise attaching it would fail.
+MOVE_DEFAULT_PARTITION_ROWS_SQL = """
+WITH moved AS (
+    DELETE FROM {default} WHERE {key} >= {start} AND {key} < {end} RETURNING *
+)
+INSERT INTO {partition} SELECT * FROM moved
+"""
+
+ATTACH_PARTITION_SQL = """
+ALTER TABLE {table} ATTACH PARTITION {partition} FOR VALUES FROM ({start}) TO ({end})
+"""
@@ -0,0 +1,104 @@
+import dataclasses
+import decimal
+from collections.abc import Callable
+
+from django.db import models
+
+import credit_charge.user_cache
+
+# Read-only counterparts of the serializers in credit_charge/serializers.py. Rows are fetched
+# with `values()` and turned into the exact dicts the serializers produce, without building
+# model instances or walking DRF fields. Keep the keys and their order in sync with the
+# serializers; TestFastReads compares both outputs byte for byte.
+
+
+@dataclasses.dataclass(frozen=True)
+class Representation:
+    fields: tuple[str, ...]
+    render: Callable[..., dict]
+    # Foreign keys to users rendered with UserSerializer. They are resolved through
+    # credit_charge.user_cache and passed to `render` as a dict keyed by user id.
+    user_fields: tuple[str, ...] = ()
+
+    def values(self, queryset: models.QuerySet) -> models.QuerySet:
+        return queryset.values(*self.fields)
+
+    def render_many(self, rows) -> list[dict]:
+        if not self.user_fields:
+            return list(map(self.render, rows))
+        rows = list(rows)
+        users = credit_charge.user_cache.get_users({row[field] for row in rows for field in self.user_fields})
+        return [self.render(row, users) for row in rows]
+
+    def render_one(self, row: dict) -> dict:
+        return self.render_many([row])[0]
+
+    async def arender_many(self, rows: list[dict]) -> list[dict]:
+        if not self.user_fields:
+            return list(map(self.render, rows))
+        users = await credit_charge.user_cache.aget_users({row[field] for row in rows for field in self.user_fields})
+        return [self.render(row, users) for row in rows]
+
+    async def arender_one(self, row: dict) -> dict:
+        return (await self.arender_many([row]))[0]
+
+
+def _decimal(value: decimal.Decimal) -> str:
+    return format(value, "f")
+
+
+def _render_user(row: dict) -> dict:
+    total_balance = row["balance"]
+    if row["balance_shard_count"]:
+        total_balance += row["shard_balance"] or 0
+    return {
+        "phone_number": row["phone_number"],
+        "balance": _decimal(total_balance),
+        "is_seller": row["is_seller"],
+    }
+
+
+def _render_charge(row: dict, users: dict[int, dict]) -> dict:
+    return {
+        "user": users[row["user_id"]],
+        "amount": _decimal(row["amount"]),
+        "transaction_id": row["transaction_id"],
+        "status": row["status"],
+    }
+
+
+def _render_user_transaction(row: dict, users: dict[int, dict]) -> dict:
+    return {
+        "seller": users[row["seller_id"]],
+        "receiver_user": users[row["receiver_user_id"]],
+        "amount": _decimal(row["amount"]),
+        "status": row["status"],
+        "transaction_id": row["transaction_id"],
+        "description": row["description"],
+    }
+
+
+# The user queryset is expected to come from `User.objects.with_shard_balance()`.
+USER = Representation(
+    fields=("id", "created_at", "phone_number", "balance", "is_seller", "balance_shard_count", "shard_balance"),
+    render=_render_user,
+)
+CHARGE = Representation(
+    fields=("id", "created_at", "user_id", "amount", "transaction_id", "status"),
+    render=_render_charge,
+    user_fields=("user_id",),
+)
+USER_TRANSACTION = Representation(
+    fields=(
+        "id",
+        "created_at",
+        "seller_id",
+        "receiver_user_id",
+        "amount",
+        "status",
+        "transaction_id",
+        "description",
+    ),
+    render=_render_user_transaction,
+    user_fields=("seller_id", "receiver_user_id"),
+)
@@ -0,0 +1,164 @@
+import collections
+import datetime
+import decimal
+import logging
+
+from django.db import connection, models, transaction
+from django.db.models import functions
+from django.utils import timezone
+
+import credit_charge.consts
+import credit_charge.models
+import credit_charge.queries
+
+logger = logging.getLogger(__name__)
+
+FIELDS = (
+    "charged_amount",
+    "charges",
+    "rejected_charges",
+    "sent_amount",
+    "transfers_sent",
+    "received_amount",
+    "transfers_received",
+    "failed_transfers",
+)
+AMOUNT_FIELDS = ("charged_amount", "sent_amount", "received_amount")
+
+
+def _add(totals: dict[tuple[int, datetime.date, int], collections.Counter]):
+    totals = {key: counter for key, counter in totals.items() if any(counter.values())}
+    if not totals:
+        return
+    ops = connection.ops
+    values, params = [], []
+    # Rows are upserted in key order, like users are locked, so two writers cannot deadlock on them.
+    for (user_id, day, slot), counter in sorted(totals.items()):
+        values.append(f"({', '.join(['%s'] * (3 + len(FIELDS)))})")
+        params.extend((user_id, ops.adapt_datefield_value(day), slot))
+        params.extend(
+            ops.adapt_decimalfield_value(decimal.Decimal(counter[field])) if field in AMOUNT_FIELDS else counter[field]
+            for field in FIELDS
+        )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            credit_charge.queries.UPSERT_DAILY_TOTALS_SQL.format(
+                columns=", ".join(FIELDS),
+                values=", ".join(values),
+                updates=", ".join(
+                    f"{field} = credit_charge_userdailytotals.{field} + EXCLUDED.{field}" for field in FIELDS
+                ),
+            ),
+            params,
+        )
+
+
+def record_transfers(user_transactions: list[credit_charge.models.UserTransaction], seller_slot: int = 0):
+    totals = collections.defaultdict(collections.Counter)
+    for user_transaction in user_transactions:
+        day = timezone.localdate(user_transaction.created_at)
+        seller = totals[(user_transaction.seller_id, day, seller_slot)]
+        if user_transaction.status == credit_charge.consts.TransactionStatus.CONFIRMED:
+            seller["sent_amount"] += user_transaction.amount
+            seller["transfers_sent"] += 1
+            receiver = totals[(user_transaction.receiver_user_id, day, 0)]
+            receiver["received_amount"] += user_transaction.amount
+            receiver["transfers_received"] += 1
+        elif user_transaction.status == credit_charge.consts.TransactionStatus.FAILED:
+            seller["failed_transfers"] += 1
+    _add(totals)
+
+
+def record_charges(charges: list[credit_charge.models.Charge]):
+    # Charges count on the day they were confirmed or rejected.
+    day = timezone.localdate()
+    totals = collections.defaultdict(collections.Counter)
+    for charge in charges:
+        user = totals[(charge.user_id, day, 0)]
+        if charge.status == credit_charge.consts.TransactionStatus.CONFIRMED:
+            user["charged_amount"] += charge.amount
+            user["charges"] += 1
+        elif charge.status == credit_charge.consts.TransactionStatus.FAILED:
+            user["rejected_charges"] += 1
+    _add(totals)
+
+
+def summarize(user_id: int, since: datetime.date, until: datetime.date) -> dict:
+    # Reads at most (until - since + 1) days times the balance shards rows, whatever the history.
+    days = (
+        credit_charge.models.UserDailyTotals.objects.filter(user_id=user_id, day__gte=since, day__lte=until)
+        .values("day")
+        .annotate(**{field: models.Sum(field) for field in FIELDS})
+        .order_by("day")
+    )
+    days = [{"day": row["day"], **{field: row[field] for field in FIELDS}} for row in days]
+    totals = {
+        field: sum((day[field] for day in days), decimal.Decimal("0") if field in AMOUNT_FIELDS else 0)
+        for field in FIELDS
+    }
+    return {"since": since, "until": until, "totals": totals, "days": days}
+
+
+@transaction.atomic
+def rebuild(since: datetime.date | None = None) -> int:
+    # Recomputes the rollups of `since` and later days (all of them by default) from the
+    # charges and transfers. On PostgreSQL the table is locked in SHARE ROW EXCLUSIVE mode
+    # first, which blocks the live upserts (and other rebuilds) until the rebuild commits, so
+    # they wait rather than get lost or collide with the rebuilt rows.
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(credit_charge.queries.LOCK_DAILY_TOTALS_SQL)
+    rollups = credit_charge.models.UserDailyTotals.objects.all()
+    if since is not None:
+        rollups = rollups.filter(day__gte=since)
+    rollups.delete()
+
+    totals = collections.defaultdict(collections.Counter)
+    charges = credit_charge.models.Charge.objects.filter(
+        status__in=(credit_charge.consts.TransactionStatus.CONFIRMED, credit_charge.consts.TransactionStatus.FAILED),
+    )
+    transfers = credit_charge.models.UserTransaction.objects.all()
+    if since is not None:
+        charges = charges.filter(updated_at__date__gte=since)
+        transfers = transfers.filter(created_at__date__gte=since)
+
+    charge_rows = (
+        charges.annotate(day=functions.TruncDate("updated_at"))
+        .values("user_id", "day", "status")
+        .annotate(amount=models.Sum("amount"), count=models.Count("id"))
+        .order_by()
+    )
+    for row in charge_rows:
+        user = totals[(row["user_id"], row["day"], 0)]
+        if row["status"] == credit_charge.consts.TransactionStatus.CONFIRMED:
+            user["charged_amount"] += row["amount"]
+            user["charges"] += row["count"]
+        else:
+            user["rejected_charges"] += row["count"]
+
+    transfer_rows = (
+        transfers.annotate(day=functions.TruncDate("created_at"))
+        .values("seller_id", "receiver_user_id", "day", "status")
+        .annotate(amount=models.Sum("amount"), count=models.Count("id"))
+        .order_by()
+    )
+    for row in transfer_rows:
+        seller = totals[(row["seller_id"], row["day"], 0)]
+        if row["status"] == credit_charge.consts.TransactionStatus.CONFIRMED:
+            seller["sent_amount"] += row["amount"]
+            seller["transfers_sent"] += row["count"]
+            receiver = totals[(row["receiver_user_id"], row["day"], 0)]
+            receiver["received_amount"] += row["amount"]
+            receiver["transfers_received"] += row["count"]
+        elif row["status"] == credit_charge.consts.TransactionStatus.FAILED:
+            seller["failed_transfers"] += row["count"]
+
+    credit_charge.models.UserDailyTotals.objects.bulk_create(
+        (
+            credit_charge.models.UserDailyTotals(user_id=user_id, day=day, slot=slot, **counter)
+            for (user_id, day, slot), counter in totals.items()
+        ),
+        batch_size=2000,
+    )
+    logger.info(f"Rebuilt {len(totals)} daily user totals")
+    return len(totals)
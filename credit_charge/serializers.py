@@ -1,16 +1,52 @@
+import datetime
+
 import django.core.exceptions
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
 from rest_framework import serializers
+from rest_framework_simplejwt import serializers as simplejwt_serializers
 
+import credit_charge.consts
+import credit_charge.exports
 import credit_charge.model_validators
 import credit_charge.models
 
 
 class UserSerializer(serializers.ModelSerializer):
+    balance = serializers.DecimalField(source="total_balance", max_digits=12, decimal_places=0, read_only=True)
+
     class Meta:
         model = credit_charge.models.User
         fields = ("phone_number", "balance", "is_seller")
 
 
+class PhoneNumberField(serializers.CharField):
+    def __init__(self, **kwargs):
+        kwargs.setdefault("max_length", 16)
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        value = super().to_internal_value(data)
+        try:
+            credit_charge.model_validators.validate_phone_number(value)
+        except django.core.exceptions.ValidationError as e:
+            raise serializers.ValidationError(e.message) from e
+        return value
+
+
+class TokenObtainPairSerializer(simplejwt_serializers.TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        # Read by credit_charge.authentication.ClaimsJWTAuthentication instead of the user row.
+        token["phone_number"] = user.phone_number
+        token["is_seller"] = user.is_seller
+        token["is_staff"] = user.is_staff
+        token["token_version"] = user.token_version
+        return token
+
+
 class ChargeSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     amount = serializers.DecimalField(max_digits=12, decimal_places=0, min_value=0)
@@ -25,7 +61,7 @@ class UserTransactionSerializer(serializers.ModelSerializer):
     seller = UserSerializer(read_only=True)
     receiver_user = UserSerializer(read_only=True)
 
-    receiver_phone_number = serializers.CharField(write_only=True, max_length=16)
+    receiver_phone_number = PhoneNumberField(write_only=True)
     amount = serializers.DecimalField(max_digits=12, decimal_places=0, min_value=0)
 
     class Meta:
@@ -47,9 +83,109 @@ class UserTransactionSerializer(serializers.ModelSerializer):
             "description",
         )
 
-    def validate_receiver_phone_number(self, value):
-        try:
-            credit_charge.model_validators.validate_phone_number(value)
-            return value
-        except django.core.exceptions.ValidationError as e:
-            raise serializers.ValidationError(e.message) from e
+
+class BatchUserTransactionItemSerializer(serializers.Serializer):
+    receiver_phone_number = PhoneNumberField()
+    amount = serializers.DecimalField(max_digits=12, decimal_places=0, min_value=0)
+
+
+class BatchUserTransactionSerializer(serializers.Serializer):
+    items = serializers.ListField(
+        child=BatchUserTransactionItemSerializer(),
+        allow_empty=False,
+        max_length=settings.TRANSACTION_BATCH_MAX_SIZE,
+    )
+
+
+class BatchUserTransactionResultSerializer(serializers.Serializer):
+    receiver_phone_number = serializers.CharField()
+    amount = serializers.DecimalField(max_digits=12, decimal_places=0)
+    status = serializers.CharField(source="user_transaction.status", default=None)
+    transaction_id = serializers.UUIDField(source="user_transaction.transaction_id", default=None)
+    description = serializers.CharField(source="user_transaction.description", default=None)
+    error = serializers.CharField()
+
+
+class ChargeFilterSerializer(serializers.Serializer):
+    status = serializers.ChoiceField(choices=credit_charge.consts.TransactionStatus.choices, required=False)
+    created_after = serializers.DateTimeField(required=False)
+    created_before = serializers.DateTimeField(required=False)
+    min_amount = serializers.DecimalField(max_digits=12, decimal_places=0, required=False)
+    max_amount = serializers.DecimalField(max_digits=12, decimal_places=0, required=False)
+
+    lookups = {
+        "status": "status",
+        "created_after": "created_at__gte",
+        "created_before": "created_at__lt",
+        "min_amount": "amount__gte",
+        "max_amount": "amount__lte",
+    }
+
+    def scope(self, queryset: models.QuerySet, user_id: int) -> models.QuerySet:
+        return queryset.filter(user_id=user_id)
+
+    def filter_queryset(self, queryset: models.QuerySet, user_id: int) -> models.QuerySet:
+        filters = {self.lookups[name]: value for name, value in self.validated_data.items() if name in self.lookups}
+        return self.scope(queryset, user_id).filter(**filters)
+
+
+class UserTransactionFilterSerializer(ChargeFilterSerializer):
+    role = serializers.ChoiceField(choices=("seller", "receiver"), required=False)
+
+    def scope(self, queryset: models.QuerySet, user_id: int) -> models.QuerySet:
+        role = self.validated_data.get("role")
+        if role == "seller":
+            return queryset.filter(seller_id=user_id)
+        if role == "receiver":
+            return queryset.filter(receiver_user_id=user_id)
+        return queryset.filter(models.Q(seller_id=user_id) | models.Q(receiver_user_id=user_id))
+
+
+class ExportFilterMixin(serializers.Serializer):
+    output = serializers.ChoiceField(choices=tuple(credit_charge.exports.FORMATS), default="ndjson")
+
+
+class ChargeExportFilterSerializer(ExportFilterMixin, ChargeFilterSerializer):
+    pass
+
+
+class UserTransactionExportFilterSerializer(ExportFilterMixin, UserTransactionFilterSerializer):
+    pass
+
+
+class UserSummaryFilterSerializer(serializers.Serializer):
+    since = serializers.DateField(required=False)
+    until = serializers.DateField(required=False)
+
+    default_days = 30
+
+    def validate(self, attrs):
+        until = attrs.get("until") or timezone.localdate()
+        since = attrs.get("since") or until - datetime.timedelta(days=self.default_days - 1)
+        if since > until:
+            raise serializers.ValidationError("since must not be after until.")
+        if (until - since).days >= settings.USER_SUMMARY_MAX_DAYS:
+            raise serializers.ValidationError(f"A summary covers at most {settings.USER_SUMMARY_MAX_DAYS} days.")
+        return {"since": since, "until": until}
+
+
+class UserTotalsSerializer(serializers.Serializer):
+    charged_amount = serializers.DecimalField(max_digits=18, decimal_places=0)
+    charges = serializers.IntegerField()
+    rejected_charges = serializers.IntegerField()
+    sent_amount = serializers.DecimalField(max_digits=18, decimal_places=0)
+    transfers_sent = serializers.IntegerField()
+    received_amount = serializers.DecimalField(max_digits=18, decimal_places=0)
+    transfers_received = serializers.IntegerField()
+    failed_transfers = serializers.IntegerField()
+
+
+class UserDailyTotalsSerializer(UserTotalsSerializer):
+    day = serializers.DateField()
+
+
+class UserSummarySerializer(serializers.Serializer):
+    since = serializers.DateField()
+    until = serializers.DateField()
+    totals = UserTotalsSerializer()
+    days = UserDailyTotalsSerializer(many=True)
@@ -1,18 +1,79 @@
 # services.py
+import collections
+import dataclasses
 import decimal
+import functools
 import logging
+import operator
+import time
+import uuid
 
 import rest_framework.exceptions
-from django.db import transaction
+from django.conf import settings
+from django.db import connection, connections, models, transaction
+from django.utils import timezone
 
+import credit_charge.charge_rules
 import credit_charge.consts
 import credit_charge.exceptions
+import credit_charge.group_commit
+import credit_charge.ledger
+import credit_charge.metrics
 import credit_charge.models
+import credit_charge.phone_numbers
+import credit_charge.queries
+import credit_charge.rollups
+import credit_charge.user_cache
+import utils.db_retry
 
 logger = logging.getLogger(__name__)
 
+USER_FIELDS = ("id", "phone_number", "balance", "is_seller", "balance_shard_count")
+USER_TRANSACTION_FIELDS = (
+    "id",
+    "created_at",
+    "updated_at",
+    "seller_id",
+    "receiver_user_id",
+    "transaction_id",
+    "amount",
+    "status",
+    "description",
+)
+
+
+@dataclasses.dataclass
+class ChargeProcessingResult:
+    processed: int = 0
+    skipped: int = 0
+    users: int = 0
+    amount: decimal.Decimal = decimal.Decimal("0")
+
+
+@dataclasses.dataclass
+class ChargeWorkerResult:
+    claimed: int = 0
+    confirmed: int = 0
+    rejected: int = 0
+    # Claimed charges no rule decided; the worker does not claim them again.
+    undecided: list[int] = dataclasses.field(default_factory=list)
+
+
+@dataclasses.dataclass
+class BatchTransactionResult:
+    receiver_phone_number: str
+    amount: decimal.Decimal
+    user_transaction: credit_charge.models.UserTransaction | None = None
+    error: str | None = None
+
+
+def use_sql_transfer_engine() -> bool:
+    engine = settings.TRANSFER_ENGINE
+    if engine == "auto":
+        return connection.vendor == "postgresql"
+    return engine == "sql"
+
 
-@transaction.atomic
 def create_transaction(
     seller_phone_number: str,
     receiver_phone_number: str,
@@ -21,13 +82,79 @@ def create_transaction(
     if amount <= 0:
         raise rest_framework.exceptions.ValidationError("Amount must be greater than 0.")
 
-    users = credit_charge.models.User.objects.select_for_update(of=["self"]).filter(
-        phone_number__in=[seller_phone_number, receiver_phone_number],
+    with credit_charge.metrics.track_transfer(seller_phone_number):
+        try:
+            # Group commit only applies to standalone transfers, a caller's own transaction must see the transfer.
+            if settings.TRANSFER_GROUP_COMMIT and not transaction.get_connection().in_atomic_block:
+                user_transaction = _create_transaction_group_commit(
+                    seller_phone_number=seller_phone_number,
+                    receiver_phone_number=receiver_phone_number,
+                    amount=amount,
+                )
+            else:
+                user_transaction = _create_transaction(
+                    seller_phone_number=seller_phone_number,
+                    receiver_phone_number=receiver_phone_number,
+                    amount=amount,
+                )
+        except Exception as e:
+            credit_charge.metrics.TRANSFERS.inc(status="ERROR", description=type(e).__name__)
+            raise
+    credit_charge.metrics.TRANSFERS.inc(status=user_transaction.status, description=user_transaction.description or "")
+    return user_transaction
+
+
+@utils.db_retry.retry_transient_errors(operation="transfer")
+def _create_transaction_group_commit(
+    seller_phone_number: str,
+    receiver_phone_number: str,
+    amount: decimal.Decimal,
+) -> credit_charge.models.UserTransaction:
+    future = credit_charge.group_commit.get_committer().submit(
+        seller_phone_number=seller_phone_number,
+        receiver_phone_number=receiver_phone_number,
+        amount=amount,
     )
-    users_by_phone = {user.phone_number: user for user in users}
+    try:
+        return future.result(timeout=settings.TRANSFER_GROUP_COMMIT_TIMEOUT)
+    except TimeoutError:
+        if future.cancel():
+            raise credit_charge.exceptions.TransferTimeoutError(
+                timeout=settings.TRANSFER_GROUP_COMMIT_TIMEOUT,
+            ) from None
+    # The transfer was already taken into a group that is committing, its outcome is due. A
+    # committer that is stuck still only holds the request for another timeout.
+    try:
+        return future.result(timeout=settings.TRANSFER_GROUP_COMMIT_TIMEOUT)
+    except TimeoutError:
+        raise credit_charge.exceptions.TransferTimeoutError(
+            timeout=2 * settings.TRANSFER_GROUP_COMMIT_TIMEOUT,
+            cancelled=False,
+        ) from None
+
+
+@utils.db_retry.retry_transient_errors(operation="transfer")
+def _create_transaction(
+    seller_phone_number: str,
+    receiver_phone_number: str,
+    amount: decimal.Decimal,
+) -> credit_charge.models.UserTransaction:
+    create = _create_transaction_sql if use_sql_transfer_engine() else _create_transaction_orm
+    with transaction.atomic():
+        user_transaction = create(
+            seller_phone_number=seller_phone_number,
+            receiver_phone_number=receiver_phone_number,
+            amount=amount,
+        )
+        commit_started = time.perf_counter()
+    credit_charge.metrics.TRANSFER_PHASE_SECONDS.observe(time.perf_counter() - commit_started, phase="commit")
+    return user_transaction
+
 
-    seller = users_by_phone.get(seller_phone_number)
-    receiver = users_by_phone.get(receiver_phone_number)
+def _validate_transfer_parties(
+    seller: credit_charge.models.User | None,
+    receiver: credit_charge.models.User | None,
+):
     if seller is None:
         raise rest_framework.exceptions.ValidationError("Seller with this phone number does not exist.")
     if receiver is None:
@@ -35,18 +162,425 @@ def create_transaction(
     if not seller.is_seller:
         raise rest_framework.exceptions.ValidationError("Only sellers are allowed to create transaction.")
 
-    user_transaction = credit_charge.models.UserTransaction.create_transaction(
-        seller=seller,
-        receiver_user=receiver,
-        amount=amount,
+
+def _create_transaction_sql(
+    seller_phone_number: str,
+    receiver_phone_number: str,
+    amount: decimal.Decimal,
+) -> credit_charge.models.UserTransaction:
+    # Debit, credit, the transaction row, its ledger entries and the daily rollups are written
+    # by a single statement, so the seller row is locked for exactly one round trip.
+    now = timezone.now()
+    with connection.cursor() as cursor, credit_charge.metrics.TRANSFER_PHASE_SECONDS.time(phase="statement"):
+        cursor.execute(
+            credit_charge.queries.TRANSFER_SQL,
+            {
+                "seller_phone_key": credit_charge.phone_numbers.to_phone_key(seller_phone_number),
+                "receiver_phone_key": credit_charge.phone_numbers.to_phone_key(receiver_phone_number),
+                "amount": amount,
+                "now": now,
+                "day": timezone.localdate(now),
+                "transaction_id": uuid.uuid4(),
+                "confirmed": credit_charge.consts.TransactionStatus.CONFIRMED.value,
+                "failed": credit_charge.consts.TransactionStatus.FAILED.value,
+                "insufficient_balance": credit_charge.consts.UserTransactionDescription.INSUFFICIENT_BALANCE.value,
+                "ledger_kind": credit_charge.consts.LedgerEntryKind.TRANSFER.value,
+            },
+        )
+        row = cursor.fetchone()
+
+    seller_row = row[: len(USER_FIELDS)]
+    receiver_row = row[len(USER_FIELDS) : 2 * len(USER_FIELDS)]
+    user_transaction_row = row[2 * len(USER_FIELDS) :]
+
+    seller = None if seller_row[0] is None else _user_from_row(seller_row)
+    receiver = None if receiver_row[0] is None else _user_from_row(receiver_row)
+    _validate_transfer_parties(seller=seller, receiver=receiver)
+    if seller.is_balance_sharded:
+        return _create_transaction_sharded(seller=seller, receiver=receiver, amount=amount)
+
+    user_transaction = credit_charge.models.UserTransaction.from_db(
+        connection.alias,
+        USER_TRANSACTION_FIELDS,
+        user_transaction_row,
     )
+    if user_transaction.status == credit_charge.consts.TransactionStatus.CONFIRMED:
+        credit_charge.user_cache.invalidate([seller.pk, receiver.pk])
+    user_transaction.seller = seller
+    user_transaction.receiver_user = receiver
+    return user_transaction
+
+
+def lock_users(users: models.Q) -> list[credit_charge.models.User]:
+    # Transactions that lock several users lock them all at once in id order, so two of
+    # them touching the same users queue on the first shared row instead of deadlocking.
+    return list(credit_charge.models.User.objects.select_for_update(no_key=True).filter(users).order_by("pk"))
+
+
+def _user_from_row(row: tuple) -> credit_charge.models.User:
+    return credit_charge.models.User.from_db(connection.alias, USER_FIELDS, row)
+
+
+def _create_transaction_orm(
+    seller_phone_number: str,
+    receiver_phone_number: str,
+    amount: decimal.Decimal,
+) -> credit_charge.models.UserTransaction:
+    seller_phone_key = credit_charge.phone_numbers.to_phone_key(seller_phone_number)
+    receiver_phone_key = credit_charge.phone_numbers.to_phone_key(receiver_phone_number)
+    # Sharded sellers are not locked here, their debits only lock a single balance shard.
+    with credit_charge.metrics.TRANSFER_PHASE_SECONDS.time(phase="lock"):
+        users = lock_users(
+            models.Q(phone_key=receiver_phone_key) | models.Q(phone_key=seller_phone_key, balance_shard_count=0),
+        )
+    users_by_phone_key = {user.phone_key: user for user in users}
+
+    seller = users_by_phone_key.get(seller_phone_key)
+    receiver = users_by_phone_key.get(receiver_phone_key)
+    if seller is None:
+        seller = credit_charge.models.User.objects.filter(phone_key=seller_phone_key).first()
+    _validate_transfer_parties(seller=seller, receiver=receiver)
+    if seller.is_balance_sharded:
+        return _create_transaction_sharded(seller=seller, receiver=receiver, amount=amount)
+
+    with credit_charge.metrics.TRANSFER_PHASE_SECONDS.time(phase="insert"):
+        user_transaction = credit_charge.models.UserTransaction.create_transaction(
+            seller=seller,
+            receiver_user=receiver,
+            amount=amount,
+        )
     try:
-        seller.update_balance(amount=decimal.Decimal("-1") * amount)
-        receiver.update_balance(amount=amount)
+        with credit_charge.metrics.TRANSFER_PHASE_SECONDS.time(phase="balance_update"):
+            seller.update_balance(amount=decimal.Decimal("-1") * amount)
+            receiver.update_balance(amount=amount)
         user_transaction.confirm_transaction()
     except credit_charge.exceptions.NegetavieBalanceError:
         user_transaction.reject_transaction(reason=credit_charge.consts.UserTransactionDescription.INSUFFICIENT_BALANCE)
     except Exception as e:
         logger.error(f"Error raised during updating {seller} and {receiver} wallet balance: {e}")
         user_transaction.reject_transaction(reason=credit_charge.consts.UserTransactionDescription.OTHER_REASONS)
+    with credit_charge.metrics.TRANSFER_PHASE_SECONDS.time(phase="ledger"):
+        credit_charge.ledger.record_transfers([user_transaction])
+        credit_charge.rollups.record_transfers([user_transaction])
+    return user_transaction
+
+
+def _create_transaction_sharded(
+    seller: credit_charge.models.User,
+    receiver: credit_charge.models.User,
+    amount: decimal.Decimal,
+) -> credit_charge.models.UserTransaction:
+    # The receiver is locked before any shard so that transfers and rebalances always
+    # acquire user rows ahead of shard rows.
+    with credit_charge.metrics.TRANSFER_PHASE_SECONDS.time(phase="lock"):
+        receiver = credit_charge.models.User.objects.select_for_update(no_key=True).get(pk=receiver.pk)
+
+        shard = _lock_balance_shard(seller=seller, amount=amount)
+        if shard is None:
+            rebalance_balance_shards(seller=seller, required_amount=amount)
+            if receiver.pk == seller.pk:
+                receiver.refresh_from_db(fields=["balance"])
+            shard = _lock_balance_shard(seller=seller, amount=amount)
+
+    if shard is None:
+        user_transaction = credit_charge.models.UserTransaction.objects.create(
+            seller=seller,
+            receiver_user=receiver,
+            amount=amount,
+            status=credit_charge.consts.TransactionStatus.FAILED,
+            description=credit_charge.consts.UserTransactionDescription.INSUFFICIENT_BALANCE,
+            transaction_id=uuid.uuid4(),
+        )
+        credit_charge.rollups.record_transfers([user_transaction])
+        return user_transaction
+
+    with credit_charge.metrics.TRANSFER_PHASE_SECONDS.time(phase="balance_update"):
+        credit_charge.models.BalanceShard.objects.filter(pk=shard.pk).update(balance=models.F("balance") - amount)
+        credit_charge.user_cache.invalidate([seller.pk])
+        receiver.update_balance(amount=amount)
+    with credit_charge.metrics.TRANSFER_PHASE_SECONDS.time(phase="insert"):
+        user_transaction = credit_charge.models.UserTransaction.objects.create(
+            seller=seller,
+            receiver_user=receiver,
+            amount=amount,
+            status=credit_charge.consts.TransactionStatus.CONFIRMED,
+            transaction_id=uuid.uuid4(),
+        )
+    with credit_charge.metrics.TRANSFER_PHASE_SECONDS.time(phase="ledger"):
+        credit_charge.ledger.record_transfers([user_transaction])
+        credit_charge.rollups.record_transfers([user_transaction], seller_slot=shard.index + 1)
     return user_transaction
+
+
+def _lock_balance_shard(
+    seller: credit_charge.models.User,
+    amount: decimal.Decimal,
+) -> credit_charge.models.BalanceShard | None:
+    shards = credit_charge.models.BalanceShard.objects.filter(user=seller, balance__gte=amount).order_by("?")
+    shard = shards.select_for_update(skip_locked=True).first()
+    if shard is None:
+        # Every shard that can cover the amount is busy, wait for one of them.
+        shard = shards.select_for_update().first()
+    return shard
+
+
+def _distribute_balance(
+    seller: credit_charge.models.User,
+    shards: list[credit_charge.models.BalanceShard],
+    total: decimal.Decimal,
+    required_amount: decimal.Decimal = decimal.Decimal("0"),
+):
+    # The first shard is topped up with required_amount so that a pending debit fits in one shard.
+    if required_amount > total:
+        required_amount = decimal.Decimal("0")
+    share, remainder = divmod(total - required_amount, len(shards))
+    for shard in shards:
+        shard.balance = share + (1 if shard.index < remainder else 0)
+    shards[0].balance += required_amount
+    credit_charge.models.BalanceShard.objects.bulk_update(shards, fields=["balance"])
+    credit_charge.models.User.objects.filter(pk=seller.pk).update(balance=0)
+    credit_charge.user_cache.invalidate([seller.pk])
+    seller.balance = decimal.Decimal("0")
+
+
+@transaction.atomic
+def rebalance_balance_shards(
+    seller: credit_charge.models.User,
+    required_amount: decimal.Decimal = decimal.Decimal("0"),
+):
+    # FOR NO KEY UPDATE does not conflict with the key share lock taken by in-flight
+    # transfers inserting rows that reference this seller.
+    seller = credit_charge.models.User.objects.select_for_update(no_key=True).get(pk=seller.pk)
+    if not seller.is_balance_sharded:
+        return
+    shards = list(credit_charge.models.BalanceShard.objects.select_for_update().filter(user=seller).order_by("index"))
+    total = seller.balance + sum((shard.balance for shard in shards), decimal.Decimal("0"))
+    _distribute_balance(seller=seller, shards=shards, total=total, required_amount=required_amount)
+    logger.info(f"Rebalanced {len(shards)} balance shards of {seller}")
+
+
+@transaction.atomic
+def set_balance_shard_count(seller: credit_charge.models.User, shard_count: int) -> credit_charge.models.User:
+    seller = credit_charge.models.User.objects.select_for_update(no_key=True).get(pk=seller.pk)
+    shards = list(credit_charge.models.BalanceShard.objects.select_for_update().filter(user=seller).order_by("index"))
+    total = seller.balance + sum((shard.balance for shard in shards), decimal.Decimal("0"))
+
+    credit_charge.models.BalanceShard.objects.filter(user=seller, index__gte=shard_count).delete()
+    shards = shards[:shard_count]
+    shards.extend(
+        credit_charge.models.BalanceShard.objects.bulk_create(
+            credit_charge.models.BalanceShard(user=seller, index=index) for index in range(len(shards), shard_count)
+        ),
+    )
+    seller.balance_shard_count = shard_count
+    seller.save(update_fields=["balance_shard_count"])
+
+    if shard_count == 0:
+        credit_charge.models.User.objects.filter(pk=seller.pk).update(balance=total)
+        seller.balance = total
+    else:
+        _distribute_balance(seller=seller, shards=shards, total=total)
+    return seller
+
+
+def apply_balance_deltas(deltas: dict[int, decimal.Decimal]):
+    deltas = {user_id: delta for user_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    credit_charge.models.User.objects.filter(pk__in=deltas).update(
+        balance=models.F("balance")
+        + models.Case(
+            *(models.When(pk=user_id, then=models.Value(delta)) for user_id, delta in deltas.items()),
+            output_field=models.DecimalField(max_digits=12, decimal_places=0),
+        ),
+    )
+    credit_charge.user_cache.invalidate(deltas)
+
+
+@utils.db_retry.retry_transient_errors(operation="batch_transfer")
+@transaction.atomic
+def create_batch_transaction(
+    seller_phone_number: str,
+    items: list[tuple[str, decimal.Decimal]],
+) -> tuple[credit_charge.models.User, list[BatchTransactionResult]]:
+    seller_phone_key = credit_charge.phone_numbers.to_phone_key(seller_phone_number)
+    receiver_phone_keys = {
+        receiver_phone_number: credit_charge.phone_numbers.to_phone_key(receiver_phone_number)
+        for receiver_phone_number, _ in items
+    }
+    users_by_phone_key = {
+        user.phone_key: user
+        for user in lock_users(
+            models.Q(phone_key=seller_phone_key) | models.Q(phone_key__in=set(receiver_phone_keys.values())),
+        )
+    }
+    seller = users_by_phone_key.get(seller_phone_key)
+    if seller is None:
+        raise rest_framework.exceptions.ValidationError("Seller with this phone number does not exist.")
+    if not seller.is_seller:
+        raise rest_framework.exceptions.ValidationError("Only sellers are allowed to create transaction.")
+
+    shards = []
+    available = seller.balance
+    if seller.is_balance_sharded:
+        shards = list(
+            credit_charge.models.BalanceShard.objects.select_for_update().filter(user=seller).order_by("index"),
+        )
+        available += sum((shard.balance for shard in shards), decimal.Decimal("0"))
+
+    receivers_by_phone = {
+        receiver_phone_number: users_by_phone_key[phone_key]
+        for receiver_phone_number, phone_key in receiver_phone_keys.items()
+        if phone_key in users_by_phone_key
+    }
+
+    results = []
+    credits = collections.Counter()
+    for receiver_phone_number, amount in items:
+        result = BatchTransactionResult(receiver_phone_number=receiver_phone_number, amount=amount)
+        results.append(result)
+        receiver = receivers_by_phone.get(receiver_phone_number)
+        if amount <= 0:
+            result.error = "Amount must be greater than 0."
+            continue
+        if receiver is None:
+            result.error = "Receiver with this phone number does not exist."
+            continue
+
+        user_transaction = credit_charge.models.UserTransaction(
+            seller=seller,
+            receiver_user=receiver,
+            amount=amount,
+            transaction_id=uuid.uuid4(),
+        )
+        if amount <= available:
+            available -= amount
+            credits[receiver.pk] += amount
+            user_transaction.status = credit_charge.consts.TransactionStatus.CONFIRMED
+        else:
+            user_transaction.status = credit_charge.consts.TransactionStatus.FAILED
+            user_transaction.description = credit_charge.consts.UserTransactionDescription.INSUFFICIENT_BALANCE
+        result.user_transaction = user_transaction
+
+    user_transactions = credit_charge.models.UserTransaction.objects.bulk_create(
+        [result.user_transaction for result in results if result.user_transaction is not None],
+    )
+    credit_charge.ledger.record_transfers(user_transactions)
+    credit_charge.rollups.record_transfers(user_transactions)
+
+    self_credit = credits.get(seller.pk, decimal.Decimal("0"))
+    if shards:
+        _distribute_balance(seller=seller, shards=shards, total=available)
+    else:
+        credits[seller.pk] += available - seller.balance
+        seller.balance = available
+    seller.balance += self_credit
+    apply_balance_deltas(credits)
+    return seller, results
+
+
+def _transition_waiting_charges(
+    charges: models.QuerySet[credit_charge.models.Charge],
+    status: credit_charge.consts.TransactionStatus,
+) -> tuple[int, list[credit_charge.models.Charge]]:
+    selected = charges.count()
+    db_connection = connections[charges.db]
+    charges_sql, charges_params = charges.order_by().values("pk").query.sql_with_params()
+    # Charges are locked in id order, an UPDATE would lock them in whatever order it scans them.
+    lock_sql = db_connection.ops.for_update_sql(no_key=True) if db_connection.features.has_select_for_update else ""
+    with db_connection.cursor() as cursor:
+        cursor.execute(
+            credit_charge.queries.TRANSITION_CHARGES_SQL.format(charges=charges_sql, lock=lock_sql),
+            [
+                status,
+                db_connection.ops.adapt_datetimefield_value(timezone.now()),
+                credit_charge.consts.TransactionStatus.WAITING,
+                *charges_params,
+            ],
+        )
+        rows = cursor.fetchall()
+    transitioned = [
+        credit_charge.models.Charge(id=charge_id, user_id=user_id, amount=decimal.Decimal(str(amount)), status=status)
+        for charge_id, user_id, amount in rows
+    ]
+    return selected, transitioned
+
+
+@utils.db_retry.retry_transient_errors(operation="confirm_charges")
+@transaction.atomic
+def confirm_charges(charges: models.QuerySet[credit_charge.models.Charge]) -> ChargeProcessingResult:
+    selected, confirmed = _transition_waiting_charges(charges, credit_charge.consts.TransactionStatus.CONFIRMED)
+    credits = collections.defaultdict(decimal.Decimal)
+    for charge in confirmed:
+        credits[charge.user_id] += charge.amount
+    lock_users(models.Q(pk__in=credits))
+    apply_balance_deltas(credits)
+    credit_charge.ledger.record_charges(confirmed)
+    credit_charge.rollups.record_charges(confirmed)
+
+    result = ChargeProcessingResult(
+        processed=len(confirmed),
+        skipped=selected - len(confirmed),
+        users=len(credits),
+        amount=sum(credits.values(), decimal.Decimal("0")),
+    )
+    logger.info(f"Confirmed {result.processed} charges for {result.users} users, skipped {result.skipped}")
+    return result
+
+
+@utils.db_retry.retry_transient_errors(operation="reject_charges")
+@transaction.atomic
+def reject_charges(charges: models.QuerySet[credit_charge.models.Charge]) -> ChargeProcessingResult:
+    selected, rejected = _transition_waiting_charges(charges, credit_charge.consts.TransactionStatus.FAILED)
+    credit_charge.rollups.record_charges(rejected)
+    result = ChargeProcessingResult(
+        processed=len(rejected),
+        skipped=selected - len(rejected),
+        users=len({charge.user_id for charge in rejected}),
+        amount=sum((charge.amount for charge in rejected), decimal.Decimal("0")),
+    )
+    logger.info(f"Rejected {result.processed} charges for {result.users} users, skipped {result.skipped}")
+    return result
+
+
+@utils.db_retry.retry_transient_errors(operation="charge_worker")
+@transaction.atomic
+def process_waiting_charges(
+    rules: list[credit_charge.charge_rules.ChargeRule],
+    batch_size: int,
+    exclude: frozenset[int] | set[int] = frozenset(),
+) -> ChargeWorkerResult:
+    # Claims up to batch_size WAITING charges that some rule may decide, skipping the ones
+    # other workers hold, so that any number of workers can run side by side. Charges are
+    # claimed through the partial index on WAITING charges, in id order.
+    candidates = functools.reduce(operator.or_, (rule.candidates() for rule in rules))
+    charges = list(
+        credit_charge.models.Charge.objects.filter(candidates, status=credit_charge.consts.TransactionStatus.WAITING)
+        .exclude(pk__in=exclude)
+        .only("pk", "user_id", "amount")
+        .order_by("pk")
+        .select_for_update(skip_locked=True, no_key=True)[:batch_size],
+    )
+
+    result = ChargeWorkerResult(claimed=len(charges))
+    decided = collections.defaultdict(list)
+    decisions = collections.Counter()
+    for charge in charges:
+        for rule in rules:
+            status = rule.decide(charge)
+            if status is not None:
+                decided[status].append(charge.pk)
+                decisions[(status, rule.name)] += 1
+                break
+        else:
+            result.undecided.append(charge.pk)
+
+    confirmed = decided[credit_charge.consts.TransactionStatus.CONFIRMED]
+    if confirmed:
+        result.confirmed = confirm_charges(credit_charge.models.Charge.objects.filter(pk__in=confirmed)).processed
+    rejected = decided[credit_charge.consts.TransactionStatus.FAILED]
+    if rejected:
+        result.rejected = reject_charges(credit_charge.models.Charge.objects.filter(pk__in=rejected)).processed
+    for (status, rule), count in decisions.items():
+        credit_charge.metrics.CHARGE_WORKER_CHARGES.inc(count, status=status, rule=rule)
+    return result
@@ -1,12 +1,56 @@
+import concurrent.futures
+import csv
+import datetime
 import decimal
+import gzip
+import io
+import itertools
+import json
 import random
+import tempfile
+import unittest
+import unittest.mock
+import uuid
+from urllib import parse
 
+import rest_framework.exceptions
+import rest_framework.renderers
+import rest_framework.test
+from asgiref.sync import async_to_sync
 from django import test
-from django.db import models
+from django.conf import settings
+from django.core import exceptions as django_exceptions
+from django.core import management
+from django.core.cache import cache
+from django.db import OperationalError, connection, connections, models, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework_simplejwt import tokens
 
+import credit_charge.admin
+import credit_charge.async_views
+import credit_charge.authentication
+import credit_charge.charge_rules
 import credit_charge.consts
+import credit_charge.exceptions
+import credit_charge.exports
+import credit_charge.group_commit
+import credit_charge.idempotency
+import credit_charge.ledger
+import credit_charge.metrics
 import credit_charge.models
+import credit_charge.partitions
+import credit_charge.phone_numbers
+import credit_charge.rollups
+import credit_charge.serializers
 import credit_charge.services
+import credit_charge.user_cache
+import utils.db_retry
+import utils.metrics
+import utils.renderers
+import utils.replicas
+import utils.request_log
 
 
 def check_user_balance(user: credit_charge.models.User) -> None:
@@ -84,3 +128,1612 @@ class TestServices(test.TestCase):
         check_user_balance(self.seller_2)
         self.assertEqual(self.seller_1.balance, decimal.Decimal("1_555_000") - seller_1_total_expense)
         self.assertEqual(self.seller_2.balance, decimal.Decimal("2_280_000") - seller_2_total_expense)
+
+
+class TestTransferEngine(test.TestCase):
+    fixtures = ["data.json"]
+
+    def setUp(self):
+        self.seller = credit_charge.models.User.objects.get(phone_number="+989097907343")
+        self.customer = credit_charge.models.User.objects.filter(is_seller=False).first()
+
+    @test.override_settings(TRANSFER_ENGINE="auto")
+    def test_auto_engine_falls_back_to_orm_on_other_backends(self):
+        self.assertEqual(
+            credit_charge.services.use_sql_transfer_engine(),
+            connection.vendor == "postgresql",
+        )
+
+    @test.override_settings(TRANSFER_ENGINE="orm")
+    def test_insufficient_balance_is_persisted_as_failed(self):
+        user_transaction = credit_charge.services.create_transaction(
+            seller_phone_number=self.seller.phone_number,
+            receiver_phone_number=self.customer.phone_number,
+            amount=self.seller.balance + 1,
+        )
+        user_transaction.refresh_from_db()
+        self.assertEqual(user_transaction.status, credit_charge.consts.TransactionStatus.FAILED)
+        self.assertEqual(
+            user_transaction.description,
+            credit_charge.consts.UserTransactionDescription.INSUFFICIENT_BALANCE,
+        )
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.balance, decimal.Decimal("1_555_000"))
+
+    @unittest.skipUnless(connection.vendor == "postgresql", "single statement transfers require PostgreSQL")
+    @test.override_settings(TRANSFER_ENGINE="sql")
+    def test_sql_engine_transfers_in_one_query(self):
+        with self.assertNumQueries(1):
+            user_transaction = credit_charge.services.create_transaction(
+                seller_phone_number=self.seller.phone_number,
+                receiver_phone_number=self.customer.phone_number,
+                amount=decimal.Decimal("1000"),
+            )
+        self.assertEqual(user_transaction.status, credit_charge.consts.TransactionStatus.CONFIRMED)
+        self.assertEqual(user_transaction.seller.balance, decimal.Decimal("1_554_000"))
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.balance, decimal.Decimal("1_554_000"))
+
+
+@test.override_settings(TRANSFER_ENGINE="orm")
+class TestBalanceSharding(test.TestCase):
+    fixtures = ["data.json"]
+
+    def setUp(self):
+        self.seller = credit_charge.services.set_balance_shard_count(
+            seller=credit_charge.models.User.objects.get(phone_number="+989097907343"),
+            shard_count=4,
+        )
+        self.customer = credit_charge.models.User.objects.filter(is_seller=False).first()
+
+    def test_balance_is_split_across_shards(self):
+        shards = credit_charge.models.BalanceShard.objects.filter(user=self.seller)
+        self.assertEqual(shards.count(), 4)
+        self.assertEqual(self.seller.balance, decimal.Decimal("0"))
+        self.assertEqual(shards.aggregate(total=models.Sum("balance"))["total"], decimal.Decimal("1_555_000"))
+        self.assertEqual(
+            credit_charge.serializers.UserSerializer(self.seller).data["balance"],
+            "1555000",
+        )
+
+    def test_dry_shard_is_rebalanced(self):
+        # No single shard can cover 500_000 after this transfer, the rebalancer has to refill one.
+        for _ in range(3):
+            user_transaction = credit_charge.services.create_transaction(
+                seller_phone_number=self.seller.phone_number,
+                receiver_phone_number=self.customer.phone_number,
+                amount=decimal.Decimal("350_000"),
+            )
+            self.assertEqual(user_transaction.status, credit_charge.consts.TransactionStatus.CONFIRMED)
+
+        user_transaction = credit_charge.services.create_transaction(
+            seller_phone_number=self.seller.phone_number,
+            receiver_phone_number=self.customer.phone_number,
+            amount=decimal.Decimal("500_000"),
+        )
+        self.assertEqual(user_transaction.status, credit_charge.consts.TransactionStatus.CONFIRMED)
+        seller = credit_charge.models.User.objects.with_shard_balance().get(pk=self.seller.pk)
+        self.assertEqual(seller.total_balance, decimal.Decimal("5_000"))
+
+    def test_insufficient_total_balance_fails(self):
+        user_transaction = credit_charge.services.create_transaction(
+            seller_phone_number=self.seller.phone_number,
+            receiver_phone_number=self.customer.phone_number,
+            amount=decimal.Decimal("1_555_001"),
+        )
+        self.assertEqual(user_transaction.status, credit_charge.consts.TransactionStatus.FAILED)
+
+    def test_batch_reports_the_committed_shard_balance(self):
+        client = rest_framework.test.APIClient()
+        client.force_authenticate(user=self.seller)
+        response = client.post(
+            "/api/v1/transactions/batch/",
+            {"items": [{"receiver_phone_number": self.customer.phone_number, "amount": "555000"}]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["seller"]["balance"], "1000000")
+
+    def test_disabling_sharding_restores_balance(self):
+        seller = credit_charge.services.set_balance_shard_count(seller=self.seller, shard_count=0)
+        self.assertEqual(seller.balance, decimal.Decimal("1_555_000"))
+        self.assertFalse(credit_charge.models.BalanceShard.objects.filter(user=seller).exists())
+
+
+class TestBatchTransactionView(test.TestCase):
+    fixtures = ["data.json"]
+
+    def setUp(self):
+        self.seller = credit_charge.models.User.objects.get(phone_number="+989097907343")
+        self.customers = list(credit_charge.models.User.objects.filter(is_seller=False)[:2])
+        self.client = rest_framework.test.APIClient()
+        self.client.force_authenticate(user=self.seller)
+
+    def test_batch_rejects_items_individually(self):
+        response = self.client.post(
+            "/api/v1/transactions/batch/",
+            {
+                "items": [
+                    {"receiver_phone_number": self.customers[0].phone_number, "amount": "1000000"},
+                    {"receiver_phone_number": self.customers[1].phone_number, "amount": "1000000"},
+                    {"receiver_phone_number": "+989000000000", "amount": "10"},
+                    {"receiver_phone_number": self.customers[1].phone_number, "amount": "555000"},
+                ],
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        results = response.json()["results"]
+        self.assertEqual(
+            [result["status"] for result in results],
+            ["CONFIRMED", "FAILED", None, "CONFIRMED"],
+        )
+        self.assertEqual(results[1]["description"], "INSUFFICIENT_BALANCE")
+        self.assertIsNotNone(results[2]["error"])
+        self.assertEqual(response.json()["seller"]["balance"], "0")
+
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.balance, decimal.Decimal("0"))
+        customer = credit_charge.models.User.objects.get(pk=self.customers[1].pk)
+        self.assertEqual(customer.balance, self.customers[1].balance + 555000)
+        self.assertEqual(credit_charge.models.UserTransaction.objects.filter(seller=self.seller).count(), 3)
+
+    def test_batch_requires_seller(self):
+        self.client.force_authenticate(user=self.customers[0])
+        response = self.client.post(
+            "/api/v1/transactions/batch/",
+            {"items": [{"receiver_phone_number": self.seller.phone_number, "amount": "10"}]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_invalid_phone_numbers_are_rejected(self):
+        item = {"receiver_phone_number": "not a number", "amount": "10"}
+        response = self.client.post("/api/v1/transactions/", item, format="json")
+        self.assertEqual(response.json(), {"receiver_phone_number": ["Enter a valid phone number."]})
+        response = self.client.post("/api/v1/transactions/batch/", {"items": [item]}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["items"], {"0": {"receiver_phone_number": ["Enter a valid phone number."]}})
+
+
+class TestGroupCommit(test.TestCase):
+    fixtures = ["data.json"]
+
+    def setUp(self):
+        self.seller = credit_charge.models.User.objects.get(phone_number="+989097907343")
+        self.customer = credit_charge.models.User.objects.filter(is_seller=False).first()
+        self.committer = credit_charge.group_commit.GroupCommitter(interval=0.005, max_batch_size=10, autostart=False)
+
+    def submit(self, seller_phone_number: str, amount: str):
+        return self.committer.submit(
+            seller_phone_number=seller_phone_number,
+            receiver_phone_number=self.customer.phone_number,
+            amount=decimal.Decimal(amount),
+        )
+
+    def test_each_caller_gets_its_own_outcome(self):
+        confirmed = self.submit(self.seller.phone_number, "1_000_000")
+        failed = self.submit(self.seller.phone_number, "1_000_000")
+        unknown_seller = self.submit("+989000000000", "10")
+        self.committer.flush()
+
+        self.assertEqual(confirmed.result().status, credit_charge.consts.TransactionStatus.CONFIRMED)
+        self.assertEqual(failed.result().status, credit_charge.consts.TransactionStatus.FAILED)
+        self.assertNotEqual(confirmed.result().transaction_id, failed.result().transaction_id)
+        self.assertIsInstance(unknown_seller.exception(), rest_framework.exceptions.ValidationError)
+
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.balance, decimal.Decimal("555_000"))
+
+    @test.override_settings(TRANSFER_GROUP_COMMIT_TIMEOUT=0.01)
+    def test_timed_out_transfers_are_cancelled(self):
+        transfer_count = credit_charge.models.UserTransaction.objects.count()
+        with unittest.mock.patch.object(credit_charge.group_commit, "get_committer", return_value=self.committer):
+            with self.assertRaises(credit_charge.exceptions.TransferTimeoutError):
+                credit_charge.services._create_transaction_group_commit(
+                    seller_phone_number=self.seller.phone_number,
+                    receiver_phone_number=self.customer.phone_number,
+                    amount=decimal.Decimal("10"),
+                )
+        self.committer.flush()
+        self.assertEqual(credit_charge.models.UserTransaction.objects.count(), transfer_count)
+
+        client = rest_framework.test.APIClient()
+        client.force_authenticate(user=self.seller)
+        with unittest.mock.patch.object(
+            credit_charge.services,
+            "create_transaction",
+            side_effect=credit_charge.exceptions.TransferTimeoutError(timeout=0.01),
+        ):
+            response = client.post(
+                "/api/v1/transactions/",
+                {"receiver_phone_number": self.customer.phone_number, "amount": "10"},
+                format="json",
+            )
+        self.assertEqual(response.status_code, 503)
+
+    @test.override_settings(TRANSFER_GROUP_COMMIT_TIMEOUT=0.01)
+    def test_transfers_of_a_stuck_group_time_out(self):
+        # The committer took the transfer into a group that never finishes.
+        future = concurrent.futures.Future()
+        future.set_running_or_notify_cancel()
+        with unittest.mock.patch.object(self.committer, "submit", return_value=future):
+            with unittest.mock.patch.object(credit_charge.group_commit, "get_committer", return_value=self.committer):
+                with self.assertRaises(credit_charge.exceptions.TransferTimeoutError) as raised:
+                    credit_charge.services._create_transaction_group_commit(
+                        seller_phone_number=self.seller.phone_number,
+                        receiver_phone_number=self.customer.phone_number,
+                        amount=decimal.Decimal("10"),
+                    )
+        self.assertFalse(raised.exception.cancelled)
+
+    @test.override_settings(TRANSFER_GROUP_COMMIT=True)
+    def test_transfers_inside_a_transaction_are_not_queued(self):
+        user_transaction = credit_charge.services.create_transaction(
+            seller_phone_number=self.seller.phone_number,
+            receiver_phone_number=self.customer.phone_number,
+            amount=decimal.Decimal("10"),
+        )
+        self.assertEqual(user_transaction.status, credit_charge.consts.TransactionStatus.CONFIRMED)
+
+
+@test.override_settings(TRANSFER_ENGINE="orm")
+class TestLedger(test.TestCase):
+    fixtures = ["data.json"]
+
+    def setUp(self):
+        credit_charge.ledger.record_opening_balances()
+        self.seller = credit_charge.models.User.objects.get(phone_number="+989097907343")
+        self.customers = list(credit_charge.models.User.objects.filter(is_seller=False)[:3])
+
+    def transfer(self, amount: str):
+        for customer in self.customers:
+            credit_charge.services.create_transaction(
+                seller_phone_number=self.seller.phone_number,
+                receiver_phone_number=customer.phone_number,
+                amount=decimal.Decimal(amount),
+            )
+
+    def test_ledger_balances_match_user_balances(self):
+        self.transfer("1000")
+        credit_charge.services.create_batch_transaction(
+            seller_phone_number=self.seller.phone_number,
+            items=[(customer.phone_number, decimal.Decimal("500")) for customer in self.customers],
+        )
+
+        for user in [self.seller, *self.customers]:
+            user.refresh_from_db()
+            self.assertEqual(credit_charge.ledger.balance_of(user), user.balance)
+        self.assertEqual(
+            credit_charge.models.LedgerEntry.objects.aggregate(total=models.Sum("amount"))["total"],
+            decimal.Decimal("0"),
+        )
+
+    def test_snapshot_plus_delta(self):
+        self.transfer("1000")
+        credit_charge.ledger.take_snapshots(lag=datetime.timedelta(0))
+        snapshot = credit_charge.models.BalanceSnapshot.objects.get(user=self.seller)
+        self.assertEqual(snapshot.balance, decimal.Decimal("1_552_000"))
+        snapshot_time = timezone.now()
+        self.transfer("2000")
+
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.balance, decimal.Decimal("1_546_000"))
+        self.assertEqual(credit_charge.ledger.balance_of(self.seller), decimal.Decimal("1_546_000"))
+        self.assertEqual(credit_charge.ledger.balance_of(self.seller, at=snapshot_time), decimal.Decimal("1_552_000"))
+
+    def test_snapshots_only_read_new_entries(self):
+        self.transfer("1000")
+        credit_charge.ledger.take_snapshots(lag=datetime.timedelta(0))
+        self.assertEqual(credit_charge.ledger.take_snapshots(lag=datetime.timedelta(0)), 0)
+
+        credit_charge.services.create_transaction(
+            seller_phone_number=self.seller.phone_number,
+            receiver_phone_number=self.customers[0].phone_number,
+            amount=decimal.Decimal("2000"),
+        )
+        self.assertEqual(credit_charge.ledger.take_snapshots(lag=datetime.timedelta(0)), 2)
+        for user in (self.seller, *self.customers):
+            user.refresh_from_db()
+            snapshot = credit_charge.models.BalanceSnapshot.objects.filter(user=user).latest("id")
+            self.assertEqual(snapshot.balance, user.balance)
+
+    def test_entries_are_immutable(self):
+        self.transfer("1000")
+        entry = credit_charge.models.LedgerEntry.objects.filter(user=self.seller).last()
+        entry.amount = 0
+        with self.assertRaises(credit_charge.exceptions.ImmutableLedgerEntryError):
+            entry.save()
+        with self.assertRaises(credit_charge.exceptions.ImmutableLedgerEntryError):
+            entry.delete()
+
+
+class TestIdempotencyKeys(test.TestCase):
+    fixtures = ["data.json"]
+
+    def setUp(self):
+        self.seller = credit_charge.models.User.objects.get(phone_number="+989097907343")
+        self.customer = credit_charge.models.User.objects.filter(is_seller=False).first()
+        self.client = rest_framework.test.APIClient()
+        self.client.force_authenticate(user=self.seller)
+
+    def test_retried_transfer_is_replayed(self):
+        data = {"receiver_phone_number": self.customer.phone_number, "amount": "1000"}
+        first = self.client.post("/api/v1/transactions/", data, format="json", HTTP_IDEMPOTENCY_KEY="retry-1")
+        second = self.client.post("/api/v1/transactions/", data, format="json", HTTP_IDEMPOTENCY_KEY="retry-1")
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(credit_charge.models.UserTransaction.objects.count(), 1)
+        self.seller.refresh_from_db()
+        self.assertEqual(self.seller.balance, decimal.Decimal("1_554_000"))
+
+    def test_retried_charge_is_replayed(self):
+        charge_count = credit_charge.models.Charge.objects.filter(user=self.seller).count()
+        for _ in range(2):
+            response = self.client.post(
+                "/api/v1/charges/",
+                {"amount": "1000"},
+                format="json",
+                HTTP_IDEMPOTENCY_KEY="c-1",
+            )
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(credit_charge.models.Charge.objects.filter(user=self.seller).count(), charge_count + 1)
+
+    def test_key_reused_with_different_request_is_rejected(self):
+        self.client.post("/api/v1/charges/", {"amount": "1000"}, format="json", HTTP_IDEMPOTENCY_KEY="c-2")
+        response = self.client.post("/api/v1/charges/", {"amount": "2000"}, format="json", HTTP_IDEMPOTENCY_KEY="c-2")
+        self.assertEqual(response.status_code, 422)
+
+    def test_expired_keys_are_purged(self):
+        self.client.post("/api/v1/charges/", {"amount": "1000"}, format="json", HTTP_IDEMPOTENCY_KEY="c-3")
+        credit_charge.models.IdempotencyKey.objects.update(expires_at=timezone.now())
+        self.assertEqual(credit_charge.idempotency.purge_expired_keys(), 1)
+
+    @test.override_settings(IDEMPOTENCY_KEY_WAIT_SECONDS=0)
+    def test_key_in_progress_conflicts_until_its_lease_expires(self):
+        self.client.post("/api/v1/charges/", {"amount": "1000"}, format="json", HTTP_IDEMPOTENCY_KEY="c-4")
+        credit_charge.models.IdempotencyKey.objects.update(
+            status_code=None,
+            response_body=None,
+            expires_at=timezone.now() + datetime.timedelta(minutes=1),
+        )
+        response = self.client.post("/api/v1/charges/", {"amount": "1000"}, format="json", HTTP_IDEMPOTENCY_KEY="c-4")
+        self.assertEqual(response.status_code, 409)
+
+        credit_charge.models.IdempotencyKey.objects.update(expires_at=timezone.now())
+        response = self.client.post("/api/v1/charges/", {"amount": "1000"}, format="json", HTTP_IDEMPOTENCY_KEY="c-4")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(credit_charge.models.IdempotencyKey.objects.get().status_code, 201)
+
+
+@test.override_settings(TRANSFER_GROUP_COMMIT=True)
+class TestIdempotencyKeysWithGroupCommit(test.TransactionTestCase):
+    # The request runs outside of the key's transaction, which TestCase would wrap it in.
+    fixtures = ["data.json"]
+
+    def test_keyed_transfer_is_group_committed(self):
+        seller = credit_charge.models.User.objects.get(phone_number="+989097907343")
+        customer = credit_charge.models.User.objects.filter(is_seller=False).first()
+        client = rest_framework.test.APIClient()
+        client.force_authenticate(user=seller)
+        data = {"receiver_phone_number": customer.phone_number, "amount": "1000"}
+
+        with unittest.mock.patch.object(
+            credit_charge.services,
+            "_create_transaction_group_commit",
+            wraps=credit_charge.services._create_transaction_group_commit,
+        ) as group_commit:
+            first = client.post("/api/v1/transactions/", data, format="json", HTTP_IDEMPOTENCY_KEY="gc-1")
+            second = client.post("/api/v1/transactions/", data, format="json", HTTP_IDEMPOTENCY_KEY="gc-1")
+
+        self.assertEqual(group_commit.call_count, 1)
+        self.assertEqual((first.status_code, second.status_code), (201, 201))
+        self.assertEqual(second.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(credit_charge.models.UserTransaction.objects.count(), 1)
+
+
+class TestKeysetPagination(test.TestCase):
+    fixtures = ["data.json"]
+
+    def setUp(self):
+        self.user = credit_charge.models.User.objects.get(phone_number="+989097907343")
+        self.client = rest_framework.test.APIClient()
+        self.client.force_authenticate(user=self.user)
+        # Rows sharing a created_at must still be paged exactly once.
+        credit_charge.models.User.objects.filter(pk__in=list(range(1, 20))).update(created_at=timezone.now())
+
+    def test_pages_cover_every_row_once(self):
+        phone_numbers = []
+        url = "/api/v1/users/?page_size=7"
+        pages = []
+        while url:
+            body = self.client.get(url).json()
+            self.assertIsNone(body["count"])
+            self.assertLessEqual(len(body["results"]), 7)
+            phone_numbers += [user["phone_number"] for user in body["results"]]
+            pages.append(body)
+            url = body["next"]
+
+        expected = credit_charge.models.User.objects.order_by("-created_at", "-id").values_list(
+            "phone_number",
+            flat=True,
+        )
+        self.assertEqual(phone_numbers, list(expected))
+        self.assertIsNone(pages[0]["previous"])
+
+        previous = self.client.get(pages[2]["previous"]).json()
+        self.assertEqual(previous["results"], pages[1]["results"])
+        self.assertEqual(previous["next"], pages[1]["next"])
+
+    def test_page_size_is_capped(self):
+        with self.settings(PAGINATION_MAX_PAGE_SIZE=15):
+            body = self.client.get("/api/v1/users/?page_size=1000").json()
+        self.assertEqual(len(body["results"]), 15)
+
+    def test_count_is_optional(self):
+        body = self.client.get("/api/v1/users/?count=true").json()
+        self.assertEqual(body["count"], credit_charge.models.User.objects.count())
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/api/v1/users/?cursor=garbage")
+        self.assertEqual(response.status_code, 404)
+
+
+class TestScopedListing(test.TestCase):
+    fixtures = ["data.json"]
+
+    def setUp(self):
+        self.seller = credit_charge.models.User.objects.get(phone_number="+989097907343")
+        self.customer = credit_charge.models.User.objects.filter(is_seller=False).first()
+        self.other_seller = credit_charge.models.User.objects.get(phone_number="+989203016403")
+        self.client = rest_framework.test.APIClient()
+        self.client.force_authenticate(user=self.seller)
+        self.small = credit_charge.services.create_transaction(
+            seller_phone_number=self.seller.phone_number,
+            receiver_phone_number=self.customer.phone_number,
+            amount=decimal.Decimal("1000"),
+        )
+        self.failed = credit_charge.services.create_transaction(
+            seller_phone_number=self.seller.phone_number,
+            receiver_phone_number=self.customer.phone_number,
+            amount=decimal.Decimal("10000000"),
+        )
+        self.incoming = credit_charge.services.create_transaction(
+            seller_phone_number=self.other_seller.phone_number,
+            receiver_phone_number=self.seller.phone_number,
+            amount=decimal.Decimal("5000"),
+        )
+        self.unrelated = credit_charge.services.create_transaction(
+            seller_phone_number=self.other_seller.phone_number,
+            receiver_phone_number=self.customer.phone_number,
+            amount=decimal.Decimal("5000"),
+        )
+
+    def list_transaction_ids(self, query: str = "") -> set[str]:
+        response = self.client.get(f"/api/v1/transactions/?{query}")
+        self.assertEqual(response.status_code, 200)
+        return {transaction["transaction_id"] for transaction in response.json()["results"]}
+
+    def test_transactions_are_scoped_to_the_caller(self):
+        own = {str(t.transaction_id) for t in (self.small, self.failed, self.incoming)}
+        self.assertEqual(self.list_transaction_ids(), own)
+        self.assertEqual(self.list_transaction_ids("role=receiver"), {str(self.incoming.transaction_id)})
+        self.assertEqual(self.list_transaction_ids("role=seller&status=FAILED"), {str(self.failed.transaction_id)})
+        self.assertEqual(self.list_transaction_ids("role=seller&max_amount=1000"), {str(self.small.transaction_id)})
+        self.assertEqual(self.list_transaction_ids("created_after=2999-01-01T00:00:00Z"), set())
+
+        response = self.client.get(f"/api/v1/transactions/{self.unrelated.transaction_id}/")
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(f"/api/v1/transactions/{self.incoming.transaction_id}/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_charges_are_scoped_to_the_caller(self):
+        response = self.client.get("/api/v1/charges/?page_size=100")
+        charges = response.json()["results"]
+        self.assertEqual(len(charges), credit_charge.models.Charge.objects.filter(user=self.seller).count())
+        self.assertEqual({charge["user"]["phone_number"] for charge in charges}, {self.seller.phone_number})
+
+    def test_invalid_filters_are_rejected(self):
+        response = self.client.get("/api/v1/transactions/?status=UNKNOWN")
+        self.assertEqual(response.status_code, 400)
+
+    def assert_uses_indexes(self, queryset: models.QuerySet, table: str):
+        queryset = queryset.order_by("-created_at", "-id")[:11]
+        if connection.vendor == "postgresql":
+            self.assert_uses_user_indexes(queryset)
+            return
+        plan = queryset.explain()
+        steps = [line for line in plan.splitlines() if f" {table} " in f"{line} "]
+        self.assertTrue(steps, plan)
+        for step in steps:
+            self.assertRegex(step, rf"SEARCH {table} USING INDEX", plan)
+
+    def assert_uses_user_indexes(self, queryset: models.QuerySet):
+        # The fixture is small enough for a sequential scan to win, with them disabled the planner
+        # still falls back to one when no index serves the filters. Every index scanned, on the
+        # table or on one of its partitions, has to lead with the column the list is scoped by.
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            plan = json.loads(queryset.explain(format="json"))
+            nodes, index_names = [plan["Plan"]], []
+            while nodes:
+                node = nodes.pop()
+                nodes.extend(node.get("Plans", []))
+                self.assertNotEqual(node["Node Type"], "Seq Scan", plan)
+                if "Index Name" in node:
+                    index_names.append(node["Index Name"])
+            self.assertTrue(index_names, plan)
+            for index_name in index_names:
+                cursor.execute("SELECT pg_get_indexdef(to_regclass(%s))", [index_name])
+                self.assertRegex(cursor.fetchone()[0], r"USING btree \((seller_id|receiver_user_id|user_id)\b", plan)
+
+    @unittest.skipUnless(connection.vendor in ("sqlite", "postgresql"), "Plan assertions need SQLite or PostgreSQL")
+    def test_every_filter_combination_uses_an_index(self):
+        values = {
+            "status": "CONFIRMED",
+            "created_after": "2024-01-01T00:00:00Z",
+            "created_before": "2999-01-01T00:00:00Z",
+            "min_amount": "10",
+            "max_amount": "100000",
+        }
+        for role in (None, "seller", "receiver"):
+            for size in range(len(values) + 1):
+                for names in itertools.combinations(values, size):
+                    data = {name: values[name] for name in names}
+                    transaction_filters = credit_charge.serializers.UserTransactionFilterSerializer(
+                        data={**data, "role": role} if role else data,
+                    )
+                    self.assertTrue(transaction_filters.is_valid())
+                    self.assert_uses_indexes(
+                        transaction_filters.filter_queryset(
+                            credit_charge.models.UserTransaction.objects,
+                            self.seller.pk,
+                        ),
+                        "credit_charge_usertransaction",
+                    )
+                    if role is None:
+                        charge_filters = credit_charge.serializers.ChargeFilterSerializer(data=data)
+                        self.assertTrue(charge_filters.is_valid())
+                        self.assert_uses_indexes(
+                            charge_filters.filter_queryset(credit_charge.models.Charge.objects, self.seller.pk),
+                            "credit_charge_charge",
+                        )
+
+
+class TestChargeProcessing(test.TestCase):
+    fixtures = ["data.json"]
+
+    def setUp(self):
+        self.users = list(credit_charge.models.User.objects.filter(is_seller=False)[:2])
+        self.balances = {user.pk: user.balance for user in self.users}
+        self.charges = [
+            credit_charge.models.Charge.create_charge(amount=decimal.Decimal(amount), user=user)
+            for user, amount in ((self.users[0], "100"), (self.users[0], "250"), (self.users[1], "1000"))
+        ]
+        self.queryset = credit_charge.models.Charge.objects.filter(pk__in=[charge.pk for charge in self.charges])
+
+    def assert_credited(self, expected: dict[int, str]):
+        for user in self.users:
+            user.refresh_from_db()
+            self.assertEqual(user.balance, self.balances[user.pk] + decimal.Decimal(expected.get(user.pk, "0")))
+
+    def test_confirm_credits_each_user_once(self):
+        result = credit_charge.services.confirm_charges(self.queryset)
+        self.assertEqual((result.processed, result.skipped, result.users), (3, 0, 2))
+        self.assertEqual(result.amount, decimal.Decimal("1350"))
+        self.assert_credited({self.users[0].pk: "350", self.users[1].pk: "1000"})
+        self.assertEqual(
+            set(self.queryset.values_list("status", flat=True)),
+            {credit_charge.consts.TransactionStatus.CONFIRMED},
+        )
+        self.assertEqual(
+            credit_charge.models.LedgerEntry.objects.filter(charge__in=self.charges, user__isnull=False).count(),
+            3,
+        )
+
+    def test_processed_charges_are_skipped(self):
+        credit_charge.services.reject_charges(self.queryset.filter(pk=self.charges[0].pk))
+        credit_charge.services.confirm_charges(self.queryset.filter(pk=self.charges[1].pk))
+
+        result = credit_charge.services.confirm_charges(self.queryset)
+        self.assertEqual((result.processed, result.skipped), (1, 2))
+        result = credit_charge.services.confirm_charges(self.queryset)
+        self.assertEqual((result.processed, result.skipped), (0, 3))
+        self.assert_credited({self.users[0].pk: "250", self.users[1].pk: "1000"})
+        self.charges[0].refresh_from_db()
+        self.assertEqual(self.charges[0].status, credit_charge.consts.TransactionStatus.FAILED)
+
+    def test_command_processes_in_batches(self):
+        transaction_ids = [f"--transaction-id={charge.transaction_id}" for charge in self.charges]
+        management.call_command("process_charges", "confirm", "--batch-size=2", *transaction_ids, stdout=io.StringIO())
+        self.assert_credited({self.users[0].pk: "350", self.users[1].pk: "1000"})
+
+    @test.override_settings(TIME_ZONE="Asia/Tehran")
+    def test_naive_created_before_is_local_time(self):
+        # 10:00 UTC is 13:30 in Tehran.
+        self.queryset.filter(pk=self.charges[0].pk).update(
+            created_at=datetime.datetime(2024, 1, 1, 10, tzinfo=datetime.UTC),
+        )
+        for created_before, expected in (
+            ("2024-01-01T12:00:00", {}),
+            ("2024-01-01T14:00:00", {self.users[0].pk: "100"}),
+        ):
+            management.call_command(
+                "process_charges",
+                "confirm",
+                f"--created-before={created_before}",
+                stdout=io.StringIO(),
+            )
+            self.assert_credited(expected)
+
+
+class TestFastReads(test.TestCase):
+    fixtures = ["data.json"]
+
+    def setUp(self):
+        self.seller = credit_charge.models.User.objects.get(phone_number="+989097907343")
+        self.customer = credit_charge.models.User.objects.filter(is_seller=False).first()
+        credit_charge.services.set_balance_shard_count(seller=self.seller, shard_count=3)
+        for amount in ("1000", "10000000", "2500"):
+            credit_charge.services.create_transaction(
+                seller_phone_number=self.seller.phone_number,
+                receiver_phone_number=self.customer.phone_number,
+                amount=decimal.Decimal(amount),
+            )
+        credit_charge.services.create_transaction(
+            seller_phone_number="+989203016403",
+            receiver_phone_number=self.seller.phone_number,
+            amount=decimal.Decimal("7"),
+        )
+        self.client = rest_framework.test.APIClient()
+        self.client.force_authenticate(user=self.seller)
+
+    def assert_same_response(self, url: str):
+        with self.settings(API_FAST_READS=False):
+            expected = self.client.get(url)
+        with self.settings(API_FAST_READS=True):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response.content, expected.content)
+        return response
+
+    def test_responses_match_the_serializers(self):
+        transaction = credit_charge.models.UserTransaction.objects.filter(seller=self.seller).first()
+        charge = credit_charge.models.Charge.objects.filter(user=self.seller).first()
+        for url in (
+            "/api/v1/users/?page_size=100",
+            f"/api/v1/users/{self.seller.phone_number}/",
+            "/api/v1/charges/",
+            f"/api/v1/charges/{charge.transaction_id}/",
+            "/api/v1/transactions/",
+            f"/api/v1/transactions/{transaction.transaction_id}/",
+            f"/api/v1/transactions/{uuid.uuid4()}/",
+            "/api/v1/transactions/not-a-uuid/",
+        ):
+            self.assert_same_response(url)
+
+        body = self.assert_same_response("/api/v1/transactions/?role=seller&status=FAILED").json()
+        self.assertEqual(body["results"][0]["description"], "INSUFFICIENT_BALANCE")
+        self.assertEqual(body["results"][0]["seller"]["balance"], str(self.seller.balance - 3500 + 7))
+
+    def test_renderer_matches_json_renderer(self):
+        data = {
+            "text": 'سلام \u2028 \u2029 "quoted"',
+            "lazy": gettext_lazy("Charge"),
+            "error": rest_framework.exceptions.ErrorDetail("invalid", code="invalid"),
+            "created_at": timezone.now(),
+            "date": datetime.date(2024, 1, 2),
+            "amount": decimal.Decimal("12.50"),
+            "id": uuid.uuid4(),
+            "nested": [{1: None, "flag": True}, 1.5, 10**30],
+        }
+        self.assertEqual(
+            utils.renderers.ORJSONRenderer().render(data),
+            rest_framework.renderers.JSONRenderer().render(data),
+        )
+
+
+class TestClaimsAuthentication(test.TestCase):
+    fixtures = ["data.json"]
+
+    def setUp(self):
+        cache.clear()
+        self.seller = credit_charge.models.User.objects.get(phone_number="+989097907343")
+        self.seller.set_password("secret")
+        self.seller.save()
+        self.client = rest_framework.test.APIClient()
+
+    def get_access_token(self) -> str:
+        response = self.client.post(
+            "/api/v1/token/",
+            {"username": self.seller.username, "password": "secret"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()["access"]
+
+    def count_queries(self, access_token: str, url: str = "/api/v1/charges/") -> int:
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {access_token}")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_claims_replace_the_user_query(self):
+        access_token = self.get_access_token()
+        claims = tokens.AccessToken(access_token)
+        self.assertEqual(claims["phone_number"], self.seller.phone_number)
+        self.assertTrue(claims["is_seller"])
+
+        self.count_queries(access_token)
+        legacy_token = tokens.AccessToken.for_user(self.seller)
+        self.assertEqual(self.count_queries(access_token) + 1, self.count_queries(str(legacy_token)))
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {access_token}")
+        response = self.client.post(
+            "/api/v1/transactions/",
+            {"receiver_phone_number": "+989203016403", "amount": "10"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["seller"]["phone_number"], self.seller.phone_number)
+
+    def test_revoked_tokens_are_rejected(self):
+        access_token = self.get_access_token()
+        self.count_queries(access_token)
+        with self.captureOnCommitCallbacks(execute=True):
+            credit_charge.authentication.revoke_tokens(self.seller)
+        self.assertEqual(self.client.get("/api/v1/charges/").status_code, 401)
+
+        # Tokens issued after the revocation carry the new version.
+        self.count_queries(self.get_access_token())
+
+    def test_inactive_users_are_rejected(self):
+        access_token = self.get_access_token()
+        credit_charge.models.User.objects.filter(pk=self.seller.pk).update(is_active=False)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {access_token}")
+        self.assertEqual(self.client.get("/api/v1/charges/").status_code, 401)
+
+    def test_own_summary_with_a_login_token(self):
+        url = f"/api/v1/users/{self.seller.phone_number}/summary/"
+        access_token = self.get_access_token()
+        # Newer simplejwt releases issue the user id claim as a string.
+        string_claim_token = tokens.AccessToken(access_token)
+        string_claim_token["user_id"] = str(self.seller.pk)
+        for token in (access_token, str(string_claim_token)):
+            self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_staff_claim_reaches_other_users_summaries(self):
+        url = f"/api/v1/users/{credit_charge.models.User.objects.exclude(pk=self.seller.pk).first().phone_number}/summary/"
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.get_access_token()}")
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        credit_charge.models.User.objects.filter(pk=self.seller.pk).update(is_staff=True)
+        access_token = self.get_access_token()
+        self.assertTrue(tokens.AccessToken(access_token)["is_staff"])
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {access_token}")
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+@test.override_settings(USER_CACHE_BACKEND="lru")
+class TestUserCache(test.TestCase):
+    fixtures = ["data.json"]
+
+    def setUp(self):
+        cache.clear()
+        credit_charge.user_cache.clear()
+        self.seller = credit_charge.models.User.objects.get(phone_number="+989097907343")
+        self.customer = credit_charge.models.User.objects.filter(is_seller=False).first()
+        self.client = rest_framework.test.APIClient()
+        self.client.force_authenticate(user=self.seller)
+
+    def test_cached_users_are_served_without_queries(self):
+        users = credit_charge.user_cache.get_users([self.seller.pk, self.customer.pk])
+        self.assertEqual(users[self.seller.pk]["balance"], "1555000")
+        with self.assertNumQueries(0):
+            self.assertEqual(credit_charge.user_cache.get_users([self.seller.pk, self.customer.pk]), users)
+
+        self.client.get(f"/api/v1/users/{self.seller.phone_number}/")
+        with self.assertNumQueries(0):
+            response = self.client.get(f"/api/v1/users/{self.seller.phone_number}/")
+        self.assertEqual(response.json(), users[self.seller.pk])
+
+    def test_balance_writes_invalidate_entries(self):
+        credit_charge.user_cache.get_users([self.seller.pk, self.customer.pk])
+        credit_charge.services.create_transaction(
+            seller_phone_number=self.seller.phone_number,
+            receiver_phone_number=self.customer.phone_number,
+            amount=decimal.Decimal("5000"),
+        )
+        users = credit_charge.user_cache.get_users([self.seller.pk, self.customer.pk])
+        self.assertEqual(users[self.seller.pk]["balance"], "1550000")
+        self.assertEqual(users[self.customer.pk]["balance"], str(self.customer.balance + 5000))
+
+        credit_charge.services.set_balance_shard_count(seller=self.seller, shard_count=2)
+        credit_charge.services.create_transaction(
+            seller_phone_number=self.seller.phone_number,
+            receiver_phone_number=self.customer.phone_number,
+            amount=decimal.Decimal("1000"),
+        )
+        response = self.client.get(f"/api/v1/users/{self.seller.phone_number}/")
+        self.assertEqual(response.json()["balance"], "1549000")
+
+    def test_fill_racing_a_write_is_not_served(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            credit_charge.user_cache.get_users([self.customer.pk])
+            # A reader that loaded the row before the write committed stored the old balance.
+            self.customer.update_balance(amount=decimal.Decimal("10"))
+            stale_version = credit_charge.user_cache._get_versions([self.customer.pk])[self.customer.pk]
+            credit_charge.user_cache.get_backend().set_many(
+                {f"user:{self.customer.pk}": (stale_version, {"balance": "stale"})},
+                60,
+            )
+        users = credit_charge.user_cache.get_users([self.customer.pk])
+        self.assertEqual(users[self.customer.pk]["balance"], str(self.customer.balance))
+
+
+@test.override_settings(USER_CACHE_BACKEND="django")
+class TestFastReadsWithUserCache(TestFastReads):
+    def setUp(self):
+        cache.clear()
+        super().setUp()
+
+
+@test.override_settings(API_ASYNC_READS=True, ROOT_URLCONF=credit_charge.async_views.async_urlconf())
+class TestAsyncReads(TestFastReads):
+    def setUp(self):
+        super().setUp()
+        access_token = credit_charge.serializers.TokenObtainPairSerializer.get_token(self.seller).access_token
+        self.async_client = test.AsyncClient()
+        self.headers = {"authorization": f"Bearer {access_token}"}
+
+    def assert_same_response(self, url: str):
+        with self.settings(API_FAST_READS=False):
+            expected = self.client.get(url)
+        response = async_to_sync(self.async_client.get)(url, headers=self.headers)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response.content, expected.content)
+        return response
+
+    async def test_writes_are_served_by_the_sync_views(self):
+        response = await self.async_client.post(
+            "/api/v1/charges/",
+            {"amount": "1000"},
+            content_type="application/json",
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 201)
+        response = await self.async_client.get(
+            f"/api/v1/charges/{response.json()['transaction_id']}/",
+            headers=self.headers,
+        )
+        self.assertEqual(response.json()["amount"], "1000")
+
+    async def test_invalid_tokens_are_rejected(self):
+        response = await self.async_client.get("/api/v1/charges/", headers={"authorization": "Bearer invalid"})
+        self.assertEqual(response.status_code, 401)
+
+
+class TestPoolStats(test.TestCase):
+    fixtures = ["data.json"]
+
+    def setUp(self):
+        self.client = rest_framework.test.APIClient()
+
+    def test_pool_stats_require_staff(self):
+        self.client.force_authenticate(user=credit_charge.models.User.objects.filter(is_staff=False).first())
+        self.assertEqual(self.client.get("/api/v1/db-pool/").status_code, 403)
+
+    @unittest.skipUnless(connection.settings_dict["OPTIONS"].get("pool"), "DB_POOL is not enabled")
+    def test_pool_stats_count_checkouts(self):
+        self.client.force_authenticate(user=credit_charge.models.User(is_staff=True))
+        before = self.client.get("/api/v1/db-pool/").json()["default"]
+        with connections["default"].pool.connection():
+            pass
+        after = self.client.get("/api/v1/db-pool/").json()["default"]
+        self.assertEqual(after["checkouts"], before["checkouts"] + 1)
+        self.assertLessEqual(after["saturation"], 1)
+
+
+@unittest.skipUnless("replica_0" in connections, "DB_REPLICA_HOSTS is not set")
+@test.override_settings(DB_READ_REPLICAS=["replica_0"])
+class TestReplicaReads(test.TransactionTestCase):
+    # Replicas mirror the test database, so the data has to be committed to be seen there.
+    fixtures = ["data.json"]
+    databases = {"default", "replica_0"} if "replica_0" in connections else {"default"}
+
+    def setUp(self):
+        cache.clear()
+        utils.replicas.reset()
+        self.seller = credit_charge.models.User.objects.get(phone_number="+989097907343")
+        self.client = rest_framework.test.APIClient()
+        self.client.force_authenticate(user=self.seller)
+
+    def get(self, url: str) -> tuple[int, int]:
+        with CaptureQueriesContext(connections["default"]) as primary:
+            with CaptureQueriesContext(connections["replica_0"]) as replica:
+                self.assertEqual(self.client.get(url).status_code, 200)
+        return len(primary), len(replica)
+
+    def test_reads_go_to_the_replica(self):
+        for url in ("/api/v1/transactions/", "/api/v1/charges/", f"/api/v1/users/{self.seller.phone_number}/"):
+            primary, replica = self.get(url)
+            self.assertEqual(primary, 0)
+            self.assertGreater(replica, 0)
+
+    def test_writers_read_from_the_primary(self):
+        response = self.client.post("/api/v1/charges/", {"amount": "1000"}, format="json")
+        self.assertEqual(response.status_code, 201)
+        primary, replica = self.get("/api/v1/charges/")
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+        with self.settings(DB_REPLICA_PIN_SECONDS=0):
+            utils.replicas.pin_to_primary(self.seller.pk)
+            self.assertEqual(self.get("/api/v1/charges/")[0], 0)
+
+    def test_failing_replica_falls_back_to_the_primary(self):
+        replica = connections["replica_0"]
+        name = replica.settings_dict["NAME"]
+        replica.close()
+        replica.settings_dict["NAME"] = "/nonexistent/replica.sqlite3"
+        try:
+            with CaptureQueriesContext(connections["default"]) as primary:
+                self.assertEqual(self.client.get("/api/v1/transactions/").status_code, 200)
+        finally:
+            replica.settings_dict["NAME"] = name
+        self.assertGreater(len(primary), 0)
+        self.assertFalse(utils.replicas.is_available("replica_0"))
+        self.assertGreater(self.get("/api/v1/transactions/")[0], 0)
+
+
+class TestMetrics(test.TestCase):
+    fixtures = ["data.json"]
+
+    def setUp(self):
+        utils.metrics.reset()
+        self.seller = credit_charge.models.User.objects.get(phone_number="+989097907343")
+        self.customer = credit_charge.models.User.objects.filter(is_seller=False).first()
+
+    def get_metrics(self) -> str:
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_transfers_are_counted_by_outcome_and_phase(self):
+        for amount in ("1000", "10000000"):
+            credit_charge.services.create_transaction(
+                seller_phone_number=self.seller.phone_number,
+                receiver_phone_number=self.customer.phone_number,
+                amount=decimal.Decimal(amount),
+            )
+        with self.assertRaises(rest_framework.exceptions.ValidationError):
+            credit_charge.services.create_transaction(
+                seller_phone_number=self.customer.phone_number,
+                receiver_phone_number=self.seller.phone_number,
+                amount=decimal.Decimal("1"),
+            )
+
+        metrics = self.get_metrics()
+        self.assertIn('credit_charge_transfers_total{status="CONFIRMED",description=""} 1\n', metrics)
+        self.assertIn('credit_charge_transfers_total{status="FAILED",description="INSUFFICIENT_BALANCE"} 1\n', metrics)
+        self.assertIn('credit_charge_transfers_total{status="ERROR",description="ValidationError"} 1\n', metrics)
+        self.assertIn("credit_charge_transfer_seconds_count 3\n", metrics)
+        # The invalid transfer fails after taking its locks.
+        for phase, count in (("lock", 3), ("insert", 2), ("ledger", 2), ("commit", 2)):
+            self.assertIn(f'credit_charge_transfer_phase_seconds_count{{phase="{phase}"}} {count}\n', metrics)
+        self.assertIn('credit_charge_balance_updates_total{outcome="insufficient_balance"} 1\n', metrics)
+
+    def test_queries_are_counted_per_request(self):
+        client = rest_framework.test.APIClient()
+        client.force_authenticate(user=self.seller)
+        with CaptureQueriesContext(connection) as queries:
+            client.get("/api/v1/charges/")
+        self.assertIn(
+            f'http_request_queries_sum{{method="GET",route="api/v1/charges/$"}} {len(queries)}\n',
+            self.get_metrics(),
+        )
+
+    def test_seller_lock_waiters(self):
+        with credit_charge.metrics.track_transfer(self.seller.phone_number):
+            with credit_charge.metrics.track_transfer(self.seller.phone_number):
+                self.assertIn(
+                    f'credit_charge_seller_lock_waiters{{seller="{self.seller.pk}"}} 1\n',
+                    self.get_metrics(),
+                )
+        self.assertNotIn("credit_charge_seller_lock_waiters{", self.get_metrics())
+        self.assertNotIn(self.seller.phone_number, self.get_metrics())
+
+    @test.override_settings(METRICS_TOKEN="secret")  # noqa: S106
+    def test_token_is_required_when_set(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+        self.assertEqual(self.client.get("/metrics", headers={"authorization": "Bearer secre"}).status_code, 403)
+        self.assertEqual(self.client.get("/metrics", headers={"authorization": "Bearer secret"}).status_code, 200)
+
+
+class TestTransientErrorRetries(test.TransactionTestCase):
+    # Retries only happen outside of an atomic block, which TestCase would wrap every test in.
+    fixtures = ["data.json"]
+
+    def setUp(self):
+        utils.metrics.reset()
+        self.calls = 0
+
+    def fail(self, times: int, error: Exception):
+        @utils.db_retry.retry_transient_errors(operation="test")
+        def run():
+            self.calls += 1
+            if self.calls <= times:
+                raise error
+            return self.calls
+
+        return run
+
+    @test.override_settings(DB_RETRY_ATTEMPTS=3, DB_RETRY_BASE_DELAY_MS=0)
+    def test_transient_errors_are_retried(self):
+        self.assertEqual(self.fail(2, OperationalError("database is locked"))(), 3)
+        metrics = utils.metrics.render()
+        self.assertIn('db_transaction_retries_total{operation="test",reason="database_locked"} 2\n', metrics)
+        self.assertNotIn("db_transaction_give_ups_total{", metrics)
+
+    @test.override_settings(DB_RETRY_ATTEMPTS=3, DB_RETRY_BASE_DELAY_MS=0)
+    def test_gives_up_after_the_last_attempt(self):
+        with self.assertRaises(OperationalError):
+            self.fail(5, OperationalError("database is locked"))()
+        self.assertEqual(self.calls, 3)
+        self.assertIn(
+            'db_transaction_give_ups_total{operation="test",reason="database_locked"} 1\n',
+            utils.metrics.render(),
+        )
+
+    @test.override_settings(DB_RETRY_BASE_DELAY_MS=0)
+    def test_other_errors_and_nested_transactions_are_not_retried(self):
+        with self.assertRaises(OperationalError):
+            self.fail(5, OperationalError("no such table: missing"))()
+        with self.assertRaises(OperationalError), transaction.atomic():
+            self.fail(5, OperationalError("database is locked"))()
+        self.assertEqual(self.calls, 2)
+
+    def test_postgres_errors_are_classified_by_sqlstate(self):
+        try:
+            import psycopg.errors
+        except ImportError:
+            self.skipTest("psycopg is not installed")
+        for cause, reason in (
+            (psycopg.errors.DeadlockDetected(), "deadlock"),
+            (psycopg.errors.SerializationFailure(), "serialization_failure"),
+            (psycopg.errors.LockNotAvailable(), "lock_timeout"),
+            (psycopg.errors.UniqueViolation(), None),
+        ):
+            error = OperationalError(str(cause))
+            error.__cause__ = cause
+            self.assertEqual(utils.db_retry.transient_reason(error), reason)
+
+    def test_transfer_parties_are_locked_in_id_order(self):
+        seller = credit_charge.models.User.objects.get(phone_number="+989097907343")
+        receivers = list(credit_charge.models.User.objects.filter(is_seller=False)[:2])
+        with CaptureQueriesContext(connection) as queries:
+            credit_charge.services.create_batch_transaction(
+                seller_phone_number=seller.phone_number,
+                items=[(receiver.phone_number, decimal.Decimal("10")) for receiver in receivers],
+            )
+        user_queries = [query["sql"] for query in queries if query["sql"].startswith("SELECT")]
+        self.assertIn('FROM "credit_charge_user"', user_queries[0])
+        self.assertIn('ORDER BY "credit_charge_user"."id" ASC', user_queries[0])
+
+
+class TestBenchTransfers(test.TransactionTestCase):
+    # The benchmark threads use their own connections, which only see committed data.
+
+    def test_results_are_written_and_compared(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = f"{directory}/results.json"
+            management.call_command(
+                "bench_transfers",
+                "--transfers=20",
+                "--concurrency=1",
+                "--sellers=2",
+                "--receivers=5",
+                "--skew=hot",
+                "--seller-balance=50",
+                "--amount-max=10",
+                f"--output={output}",
+                stdout=io.StringIO(),
+                stderr=io.StringIO(),
+            )
+            with open(output) as file:
+                results = json.load(file)
+            self.assertEqual(sum(results["outcomes"].values()), 20)
+            self.assertLessEqual(set(results["outcomes"]), {"CONFIRMED", "FAILED:INSUFFICIENT_BALANCE"})
+            self.assertLessEqual(results["latency_ms"]["p50"], results["latency_ms"]["p99"])
+            self.assertIn("lock", results["phase_mean_ms"])
+
+            with self.assertRaises(management.CommandError):
+                management.call_command(
+                    "bench_transfers",
+                    "--transfers=20",
+                    "--concurrency=1",
+                    f"--baseline={output}",
+                    "--max-regression=-100",
+                    stdout=io.StringIO(),
+                    stderr=io.StringIO(),
+                )
+
+
+@test.override_settings(MIDDLEWARE=[*settings.MIDDLEWARE, "utils.request_log.RequestLogMiddleware"])
+class TestRequestReplay(test.LiveServerTestCase):
+    fixtures = ["data.json"]
+
+    def setUp(self):
+        self.seller = credit_charge.models.User.objects.get(phone_number="+989097907343")
+        self.customer = credit_charge.models.User.objects.filter(is_seller=False).first()
+
+    def record(self) -> list[str]:
+        client = rest_framework.test.APIClient()
+        client.force_authenticate(user=self.seller)
+        with self.assertLogs("utils.request_log") as logs:
+            client.get("/api/v1/charges/")
+            client.post(
+                "/api/v1/transactions/",
+                {"receiver_phone_number": self.customer.phone_number, "amount": "10"},
+                format="json",
+            )
+            self.client.get("/api/v1/users/")
+        return [record.getMessage() for record in logs.records]
+
+    def replay(self, lines: list[str], *args) -> dict:
+        with tempfile.TemporaryDirectory() as directory:
+            with open(f"{directory}/requests.jsonl", "w") as file:
+                file.write("\n".join(lines))
+            management.call_command(
+                "replay_requests",
+                f"{directory}/requests.jsonl",
+                f"--host={self.live_server_url}",
+                "--speed=100",
+                f"--output={directory}/results.json",
+                *args,
+                stdout=io.StringIO(),
+                stderr=io.StringIO(),
+            )
+            with open(f"{directory}/results.json") as file:
+                return json.load(file)
+
+    def test_recorded_requests_are_replayed(self):
+        lines = self.record()
+        entries = [json.loads(line) for line in lines]
+        self.assertEqual([entry["user"] for entry in entries], [self.seller.phone_number] * 2 + [None])
+        self.assertEqual(entries[1]["body"], {"receiver_phone_number": self.customer.phone_number, "amount": "10"})
+        self.assertEqual([entry["status"] for entry in entries], [200, 201, 401])
+
+        results = self.replay(lines, "--slo=p99=60000")
+        endpoints = results["endpoints"]
+        self.assertEqual(results["requests"], 3)
+        self.assertEqual(endpoints["GET api/v1/charges/$"]["statuses"], {"200": 1})
+        self.assertEqual(endpoints["POST api/v1/transactions/$"]["statuses"], {"201": 1})
+        self.assertEqual(endpoints["GET api/v1/users/$"]["statuses"], {"401": 1})
+        self.assertEqual(results["violations"], [])
+        self.assertEqual(credit_charge.models.UserTransaction.objects.filter(seller=self.seller).count(), 2)
+
+    def test_slo_violations_fail(self):
+        with self.assertRaises(management.CommandError):
+            self.replay(self.record(), "--slo=GET api/v1/charges/$ p50=0")
+
+    def test_credentials_are_not_recorded(self):
+        self.seller.set_password("secret-password")
+        self.seller.save()
+        client = rest_framework.test.APIClient()
+        with self.assertLogs("utils.request_log") as logs:
+            response = client.post(
+                "/api/v1/token/",
+                {"username": self.seller.username, "password": "secret-password"},
+                format="json",
+            )
+            client.post("/api/v1/token/refresh/", {"refresh": response.data["refresh"]}, format="json")
+        self.assertEqual([json.loads(record.getMessage())["body"] for record in logs.records], [None, None])
+        self.assertNotIn("secret-password", "".join(record.getMessage() for record in logs.records))
+        self.assertEqual(
+            utils.request_log.redact({"items": [{"password": "secret-password", "amount": "10"}]}),
+            {"items": [{"password": "[REDACTED]", "amount": "10"}]},
+        )
+
+
+class TestPhoneKey(test.TestCase):
+    fixtures = ["data.json"]
+
+    def setUp(self):
+        cache.clear()
+        credit_charge.user_cache.clear()
+        self.seller = credit_charge.models.User.objects.get(phone_number="+989097907343")
+        self.customer = credit_charge.models.User.objects.filter(is_seller=False).first()
+
+    def test_forms_of_a_number_share_a_key(self):
+        for phone_number in ("+989121234567", "00989121234567", "09121234567", " 989121234567"):
+            self.assertEqual(credit_charge.phone_numbers.to_phone_key(phone_number), 989121234567)
+        for phone_number in ("", "+", "+98 912", "٠٩١٢١٢٣٤٥٦٧", "+9891212345678901"):
+            self.assertIsNone(credit_charge.phone_numbers.to_phone_key(phone_number))
+
+    def test_key_is_filled_on_save(self):
+        user = credit_charge.models.User.objects.create_user(username="new", phone_number="09120000001")
+        self.assertEqual(user.phone_key, 989120000001)
+        user.phone_number = "+989120000002"
+        user.save(update_fields=["phone_number"])
+        user.refresh_from_db()
+        self.assertEqual(user.phone_key, 989120000002)
+
+        duplicate = credit_charge.models.User(username="other", phone_number="00989120000002")
+        with self.assertRaises(django_exceptions.ValidationError):
+            duplicate.clean()
+
+    def test_lookups_accept_any_form(self):
+        national = "0" + self.customer.phone_number[3:]
+        user_transaction = credit_charge.services.create_transaction(
+            seller_phone_number=self.seller.phone_number,
+            receiver_phone_number=national,
+            amount=decimal.Decimal("10"),
+        )
+        self.assertEqual(user_transaction.receiver_user.pk, self.customer.pk)
+
+        client = rest_framework.test.APIClient()
+        client.force_authenticate(user=self.seller)
+        for fast_reads in (True, False):
+            with self.settings(API_FAST_READS=fast_reads):
+                response = client.get(f"/api/v1/users/{national}/")
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()["phone_number"], self.customer.phone_number)
+                self.assertEqual(client.get("/api/v1/users/not-a-number/").status_code, 404)
+
+    def test_login_with_any_form_of_the_phone_number(self):
+        self.seller.set_password("password")
+        self.seller.save(update_fields=["password"])
+        for username in ("0" + self.seller.phone_number[3:], self.seller.phone_number):
+            response = self.client.post("/api/v1/token/", {"username": username, "password": "password"})
+            self.assertEqual(response.status_code, 200)
+        response = self.client.post("/api/v1/token/", {"username": self.seller.phone_number, "password": "wrong"})
+        self.assertEqual(response.status_code, 401)
+
+
+class TestRollups(test.TestCase):
+    fixtures = ["data.json"]
+
+    def setUp(self):
+        self.seller = credit_charge.models.User.objects.get(phone_number="+989097907343")
+        self.customer = credit_charge.models.User.objects.filter(is_seller=False).first()
+        for amount in ("100", "250", "10_000_000"):
+            credit_charge.services.create_transaction(
+                seller_phone_number=self.seller.phone_number,
+                receiver_phone_number=self.customer.phone_number,
+                amount=decimal.Decimal(amount),
+            )
+        charges = [
+            credit_charge.models.Charge.create_charge(amount=decimal.Decimal(amount), user=self.customer)
+            for amount in ("1000", "2000")
+        ]
+        credit_charge.services.confirm_charges(credit_charge.models.Charge.objects.filter(pk=charges[0].pk))
+        credit_charge.services.reject_charges(credit_charge.models.Charge.objects.filter(pk=charges[1].pk))
+
+    def summary_totals(self, user: credit_charge.models.User) -> dict:
+        today = timezone.localdate()
+        return credit_charge.rollups.summarize(user_id=user.pk, since=today, until=today)["totals"]
+
+    def test_rollups_follow_transfers_and_charges(self):
+        seller = self.summary_totals(self.seller)
+        self.assertEqual(seller["sent_amount"], decimal.Decimal("350"))
+        self.assertEqual((seller["transfers_sent"], seller["failed_transfers"]), (2, 1))
+        customer = self.summary_totals(self.customer)
+        self.assertEqual(customer["received_amount"], decimal.Decimal("350"))
+        self.assertEqual(customer["charged_amount"], decimal.Decimal("1000"))
+        self.assertEqual((customer["transfers_received"], customer["charges"], customer["rejected_charges"]), (2, 1, 1))
+
+    def test_rebuild_matches_incremental_rollups(self):
+        expected = {user.pk: self.summary_totals(user) for user in (self.seller, self.customer)}
+        management.call_command("rebuild_rollups", stdout=io.StringIO())
+        for user in (self.seller, self.customer):
+            self.assertEqual(self.summary_totals(user), expected[user.pk])
+
+    def test_summary_endpoint(self):
+        client = rest_framework.test.APIClient()
+        client.force_authenticate(user=self.seller)
+        response = client.get(f"/api/v1/users/{self.seller.phone_number}/summary/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["totals"]["transfers_sent"], 2)
+        self.assertEqual(response.json()["days"][0]["day"], timezone.localdate().isoformat())
+        self.assertEqual(client.get(f"/api/v1/users/{self.customer.phone_number}/summary/").status_code, 404)
+        response = client.get(f"/api/v1/users/{self.seller.phone_number}/summary/", {"since": "2000-01-01"})
+        self.assertEqual(response.status_code, 400)
+
+
+@test.override_settings(EXPORT_CHUNK_SIZE=2)
+class TestExports(test.TestCase):
+    fixtures = ["data.json"]
+
+    def setUp(self):
+        self.seller = credit_charge.models.User.objects.get(phone_number="+989097907343")
+        self.customer = credit_charge.models.User.objects.filter(is_seller=False).first()
+        self.transactions = [
+            credit_charge.services.create_transaction(
+                seller_phone_number=self.seller.phone_number,
+                receiver_phone_number=self.customer.phone_number,
+                amount=decimal.Decimal(amount),
+            )
+            for amount in ("10", "20", "30", "10_000_000")
+        ]
+        self.client = rest_framework.test.APIClient()
+        self.client.force_authenticate(user=self.seller)
+
+    def test_ndjson_export_streams_every_row(self):
+        response = self.client.get("/api/v1/transactions/export/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(
+            [row["transaction_id"] for row in rows],
+            [str(user_transaction.transaction_id) for user_transaction in self.transactions],
+        )
+        self.assertEqual(rows[0]["seller"], self.seller.phone_number)
+        self.assertEqual(rows[0]["amount"], "10")
+
+    def test_csv_export_applies_filters(self):
+        response = self.client.get(
+            "/api/v1/transactions/export/",
+            {"output": "csv", "status": credit_charge.consts.TransactionStatus.FAILED},
+        )
+        rows = list(csv.reader(b"".join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0], list(credit_charge.exports.TRANSACTIONS.columns))
+        self.assertEqual([row[0] for row in rows[1:]], [str(self.transactions[-1].transaction_id)])
+        self.assertEqual(self.client.get("/api/v1/charges/export/", {"output": "xml"}).status_code, 400)
+
+    @test.override_settings(EXPORT_CHUNK_SIZE=1)
+    def test_export_streams_chunk_by_chunk_under_asgi(self):
+        access_token = credit_charge.serializers.TokenObtainPairSerializer.get_token(self.seller).access_token
+        client = test.AsyncClient()
+
+        async def export() -> list[bytes]:
+            response = await client.get(
+                "/api/v1/transactions/export/",
+                headers={"authorization": f"Bearer {access_token}"},
+            )
+            self.assertTrue(response.is_async)
+            return [chunk async for chunk in response.streaming_content]
+
+        chunks = async_to_sync(export)()
+        self.assertEqual(len(chunks), len(self.transactions))
+        self.assertEqual(
+            [json.loads(chunk)["transaction_id"] for chunk in chunks],
+            [str(user_transaction.transaction_id) for user_transaction in self.transactions],
+        )
+
+    def test_command_exports_to_a_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/transactions.ndjson"
+            management.call_command("export_rows", "transactions", f"--file={path}", stderr=io.StringIO())
+            with open(path) as file:
+                self.assertEqual(
+                    len(file.readlines()),
+                    credit_charge.models.UserTransaction.objects.count(),
+                )
+
+
+class TestPartitionArchive(test.TestCase):
+    fixtures = ["data.json"]
+
+    def setUp(self):
+        self.seller = credit_charge.models.User.objects.get(phone_number="+989097907343")
+        self.customer = credit_charge.models.User.objects.filter(is_seller=False).first()
+        # Failed transfers write no ledger entries, so they can be removed from the table.
+        self.user_transaction = credit_charge.services.create_transaction(
+            seller_phone_number=self.seller.phone_number,
+            receiver_phone_number=self.customer.phone_number,
+            amount=decimal.Decimal("10_000_000"),
+        )
+        self.client = rest_framework.test.APIClient()
+        self.client.force_authenticate(user=self.seller)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def get(self, user: credit_charge.models.User):
+        self.client.force_authenticate(user=user)
+        return self.client.get(f"/api/v1/transactions/{self.user_transaction.transaction_id}/")
+
+    def archive_transaction(self):
+        month = credit_charge.partitions.current_month()
+        path = f"{self.directory.name}/archive.ndjson.gz"
+        row = (
+            credit_charge.models.UserTransaction.objects.filter(pk=self.user_transaction.pk)
+            .values(*(field.column for field in credit_charge.models.UserTransaction._meta.concrete_fields))
+            .get()
+        )
+        # One gzip member per chunk of rows, the row is in the second one.
+        first_chunk = gzip.compress(json.dumps({"transaction_id": str(uuid.uuid4())}).encode() + b"\n")
+        with open(path, "wb") as file:
+            file.write(first_chunk)
+            row = {key: credit_charge.exports.encode_value(value) for key, value in row.items()}
+            file.write(gzip.compress(json.dumps(row).encode() + b"\n"))
+        credit_charge.models.ArchivedRow.objects.create(
+            table=credit_charge.partitions.TRANSACTIONS.table,
+            transaction_id=self.user_transaction.transaction_id,
+            month=month,
+            path=path,
+            offset=len(first_chunk),
+        )
+        self.user_transaction.delete()
+
+    def test_archived_rows_are_retrieved_transparently(self):
+        expected = self.get(self.seller).json()
+        self.archive_transaction()
+        for fast_reads in (True, False):
+            with self.settings(API_FAST_READS=fast_reads):
+                self.assertEqual(self.get(self.seller).json(), expected)
+                other = credit_charge.models.User.objects.exclude(pk__in=[self.seller.pk, self.customer.pk]).first()
+                self.assertEqual(self.get(other).status_code, 404)
+
+    def test_archived_rows_are_retrieved_with_a_login_token(self):
+        expected = self.get(self.seller).json()
+        self.archive_transaction()
+        self.seller.set_password("secret")
+        self.seller.save()
+        client = rest_framework.test.APIClient()
+        response = client.post(
+            "/api/v1/token/",
+            {"username": self.seller.username, "password": "secret"},
+            format="json",
+        )
+        access_token = response.json()["access"]
+        # Newer simplejwt releases issue the user id claim as a string.
+        string_claim_token = tokens.AccessToken(access_token)
+        string_claim_token["user_id"] = str(self.seller.pk)
+        for token in (access_token, str(string_claim_token)):
+            client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+            response = client.get(f"/api/v1/transactions/{self.user_transaction.transaction_id}/")
+            self.assertEqual(response.json(), expected)
+
+    @unittest.skipUnless(connection.vendor == "postgresql", "partitioning requires PostgreSQL")
+    def test_old_partitions_are_archived(self):
+        table = credit_charge.partitions.TRANSACTIONS.table
+        self.assertTrue(credit_charge.partitions.is_partitioned(table))
+        month = credit_charge.partitions.add_months(credit_charge.partitions.current_month(), -24)
+        credit_charge.models.UserTransaction.objects.filter(pk=self.user_transaction.pk).update(
+            created_at=datetime.datetime(month.year, month.month, 15, tzinfo=datetime.UTC),
+        )
+        # The row landed in the default partition and moves into the new one.
+        credit_charge.partitions.create_partition(table, month)
+        expected = self.get(self.seller).json()
+
+        management.call_command(
+            "manage_partitions",
+            "--retain-months=12",
+            f"--archive-dir={self.directory.name}",
+            stdout=io.StringIO(),
+            stderr=io.StringIO(),
+        )
+        partitions = credit_charge.partitions.monthly_partitions(table)
+        self.assertNotIn(month, partitions)
+        self.assertIn(credit_charge.partitions.add_months(credit_charge.partitions.current_month(), 3), partitions)
+        self.assertFalse(credit_charge.models.UserTransaction.objects.filter(pk=self.user_transaction.pk).exists())
+        self.assertEqual(self.get(self.seller).json(), expected)
+
+
+class TestChargeWorker(test.TestCase):
+    fixtures = ["data.json"]
+
+    def setUp(self):
+        utils.metrics.reset()
+        self.trusted, self.other = credit_charge.models.User.objects.filter(is_seller=False, charges__isnull=True)[:2]
+        self.charges = {
+            name: credit_charge.models.Charge.create_charge(amount=decimal.Decimal(amount), user=user)
+            for name, amount, user in (
+                ("small", "500", self.other),
+                ("large", "5000", self.other),
+                ("trusted", "5000", self.trusted),
+            )
+        }
+
+    def status(self, name: str) -> str:
+        self.charges[name].refresh_from_db()
+        return self.charges[name].status
+
+    def test_rules_approve_matching_charges(self):
+        balance = self.trusted.balance
+        with self.settings(CHARGE_AUTO_APPROVE_MAX_AMOUNT=decimal.Decimal("1000")):
+            rules = credit_charge.charge_rules.get_rules(["amount"])
+        rules += [credit_charge.charge_rules.TrustedUsersRule(phone_numbers=[self.trusted.phone_number])]
+        result = credit_charge.services.process_waiting_charges(rules=rules, batch_size=100)
+
+        self.assertEqual(result.confirmed, result.claimed)
+        self.assertEqual(self.status("small"), credit_charge.consts.TransactionStatus.CONFIRMED)
+        self.assertEqual(self.status("trusted"), credit_charge.consts.TransactionStatus.CONFIRMED)
+        self.assertEqual(self.status("large"), credit_charge.consts.TransactionStatus.WAITING)
+        self.trusted.refresh_from_db()
+        self.assertEqual(self.trusted.balance, balance + decimal.Decimal("5000"))
+        self.assertIn(
+            'credit_charge_charge_worker_charges_total{status="CONFIRMED",rule="trusted"} 1',
+            utils.metrics.render(),
+        )
+
+        again = credit_charge.services.process_waiting_charges(rules=rules, batch_size=100)
+        self.assertEqual(again.claimed, 0)
+
+    @test.override_settings(
+        CHARGE_AUTO_APPROVE_MAX_AMOUNT=decimal.Decimal("1000"),
+        CHARGE_TRUSTED_PHONE_NUMBERS=[],
+    )
+    def test_command_drains_the_queue(self):
+        stdout = io.StringIO()
+        management.call_command("run_charge_worker", "--once", "--batch-size=1", stdout=stdout)
+        self.assertEqual(self.status("small"), credit_charge.consts.TransactionStatus.CONFIRMED)
+        self.assertEqual(self.status("large"), credit_charge.consts.TransactionStatus.WAITING)
+        self.assertIn("credit_charge_waiting_charges", utils.metrics.render())
+
+
+class TestLargeTableAdmin(test.TestCase):
+    fixtures = ["data.json"]
+
+    def setUp(self):
+        self.admin = credit_charge.models.User.objects.create_superuser(
+            username="admin",
+            password=None,
+            phone_number="+989000000001",
+        )
+        self.client.force_login(self.admin)
+        self.seller, self.receiver, self.other = credit_charge.models.User.objects.exclude(pk=self.admin.pk)[:3]
+        self.transactions = [
+            credit_charge.models.UserTransaction.objects.create(
+                seller=self.seller,
+                receiver_user=receiver,
+                transaction_id=uuid.uuid4(),
+                amount=decimal.Decimal("10"),
+                status=credit_charge.consts.TransactionStatus.CONFIRMED,
+            )
+            for receiver in (self.receiver, self.receiver, self.other)
+        ]
+
+    def changelist(self, model: str, **params):
+        return self.client.get(f"/admin/credit_charge/{model}/", params)
+
+    @unittest.mock.patch.object(credit_charge.admin.ChargeAdmin, "list_per_page", 4)
+    def test_keyset_pages_cover_every_row(self):
+        seen, params, queries = [], {}, set()
+        while True:
+            with CaptureQueriesContext(connection) as captured:
+                response = self.changelist("charge", **params)
+            self.assertEqual(response.status_code, 200)
+            queries.add(len(captured))
+            cl = response.context["cl"]
+            seen += [charge.pk for charge in cl.result_list]
+            if cl.next_page_url is None:
+                break
+            params = dict(parse.parse_qsl(cl.next_page_url[1:]))
+
+        expected = credit_charge.models.Charge.objects.order_by("-created_at", "-id").values_list("pk", flat=True)
+        self.assertEqual(seen, list(expected))
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(self.changelist("charge", cursor="nonsense").url, "/admin/credit_charge/charge/?e=1")
+
+    def test_search_uses_phone_number_and_transaction_id(self):
+        cases = (
+            (self.receiver.phone_number, self.transactions[:2]),
+            (str(self.transactions[2].transaction_id), self.transactions[2:]),
+            ("+980000000000", []),
+            ("seller", []),
+        )
+        for term, expected in cases:
+            with self.subTest(term=term):
+                cl = self.changelist("usertransaction", q=term).context["cl"]
+                self.assertEqual({row.pk for row in cl.result_list}, {row.pk for row in expected})
+
+        cl = self.changelist("usertransaction", q=self.seller.phone_number).context["cl"]
+        self.assertEqual(len(cl.result_list), 3)
+        self.assertEqual(cl.result_count, 3)
+
+    @test.override_settings(ADMIN_COUNT_LIMIT=2)
+    def test_counts_are_capped(self):
+        response = self.changelist("usertransaction", status__exact=credit_charge.consts.TransactionStatus.CONFIRMED)
+        cl = response.context["cl"]
+        self.assertEqual((cl.result_count, cl.result_count_limited), (2, True))
+        self.assertContains(response, "2+")
+        year = timezone.localtime(self.transactions[0].created_at).year
+        self.assertContains(response, f"created_at__year={year}")
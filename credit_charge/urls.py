@@ -1,5 +1,7 @@
 import rest_framework.routers
+from django.conf import settings
 
+import credit_charge.async_views
 import credit_charge.views
 
 router = rest_framework.routers.DefaultRouter()
@@ -8,3 +10,5 @@ router.register(r"transactions", credit_charge.views.UserTransactionViewSet, bas
 router.register(r"users", credit_charge.views.UserViewSet, basename="user")
 
 urlpatterns = router.urls
+if settings.API_ASYNC_READS:
+    urlpatterns = credit_charge.async_views.async_read_urls(urlpatterns)
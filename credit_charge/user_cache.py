@@ -0,0 +1,258 @@
+import collections
+import functools
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+import credit_charge.models
+import credit_charge.phone_numbers
+import credit_charge.representations
+
+# Rendered users (the UserSerializer output) are cached per user id together with the
+# user's version at the time they were read. Versions live in the shared Django cache and
+# are bumped whenever a balance or profile changes, so an entry is only served while no
+# write has happened since it was read. The version is read before the database, which
+# makes a fill that raced with a write carry the old version and never match again.
+
+
+class LRUBackend:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_many(self, keys) -> dict:
+        now = time.monotonic()
+        found = {}
+        with self.lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is None:
+                    continue
+                expires_at, value = entry
+                if expires_at < now:
+                    del self.entries[key]
+                    continue
+                self.entries.move_to_end(key)
+                found[key] = value
+        return found
+
+    def set_many(self, values: dict, timeout: int):
+        expires_at = time.monotonic() + timeout
+        with self.lock:
+            for key, value in values.items():
+                self.entries[key] = (expires_at, value)
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class DjangoCacheBackend:
+    def __init__(self, alias: str):
+        self.cache = caches[alias]
+
+    def get_many(self, keys) -> dict:
+        return self.cache.get_many(list(keys))
+
+    def set_many(self, values: dict, timeout: int):
+        self.cache.set_many(values, timeout)
+
+
+@functools.cache
+def _get_backend(name: str, alias: str, max_entries: int) -> LRUBackend | DjangoCacheBackend | None:
+    if name == "lru":
+        return LRUBackend(max_entries=max_entries)
+    if name == "django":
+        return DjangoCacheBackend(alias=alias)
+    return None
+
+
+def get_backend() -> LRUBackend | DjangoCacheBackend | None:
+    return _get_backend(settings.USER_CACHE_BACKEND, settings.USER_CACHE_ALIAS, settings.USER_CACHE_MAX_ENTRIES)
+
+
+def _version_key(user_id: int) -> str:
+    return f"user-version:{user_id}"
+
+
+def _entry_key(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+def _phone_key_key(phone_key: int) -> str:
+    return f"user-phone-key:{phone_key}"
+
+
+def _get_versions(user_ids) -> dict[int, int]:
+    versions_cache = caches[settings.USER_CACHE_ALIAS]
+    keys = {_version_key(user_id): user_id for user_id in user_ids}
+    versions = versions_cache.get_many(list(keys))
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        # Versions start from the clock so that an evicted counter never restarts below
+        # the version of an entry that is still cached.
+        for key in missing:
+            versions_cache.add(key, time.time_ns(), timeout=None)
+        versions.update(versions_cache.get_many(missing))
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def _bump_versions(user_ids):
+    versions_cache = caches[settings.USER_CACHE_ALIAS]
+    for user_id in user_ids:
+        key = _version_key(user_id)
+        try:
+            versions_cache.incr(key)
+        except ValueError:
+            versions_cache.add(key, time.time_ns(), timeout=None)
+
+
+def invalidate(user_ids):
+    if get_backend() is None:
+        return
+    user_ids = list(user_ids)
+    # Bumping now hides cached entries from the rest of this transaction, bumping again on
+    # commit drops entries that other requests filled with the pre-commit balance meanwhile.
+    _bump_versions(user_ids)
+    transaction.on_commit(lambda: _bump_versions(user_ids))
+
+
+def _load_users(using: str | None = None, **filters) -> dict[int, dict]:
+    rows = credit_charge.representations.USER.values(
+        credit_charge.models.User.objects.db_manager(using).with_shard_balance().filter(**filters),
+    )
+    return {row["id"]: credit_charge.representations.USER.render(row) for row in rows}
+
+
+async def _aload_users(using: str | None = None, **filters) -> dict[int, dict]:
+    rows = credit_charge.representations.USER.values(
+        credit_charge.models.User.objects.db_manager(using).with_shard_balance().filter(**filters),
+    )
+    return {row["id"]: credit_charge.representations.USER.render(row) async for row in rows}
+
+
+def _get_cached_users(backend, user_ids: set[int]) -> tuple[dict[int, int], dict[int, dict]]:
+    versions = _get_versions(user_ids)
+    entries = backend.get_many(_entry_key(user_id) for user_id in user_ids)
+    users = {}
+    for user_id in user_ids:
+        entry = entries.get(_entry_key(user_id))
+        if entry is not None and entry[0] == versions[user_id]:
+            users[user_id] = entry[1]
+    return versions, users
+
+
+def _set_cached_users(backend, versions: dict[int, int], users: dict[int, dict]):
+    backend.set_many(
+        {_entry_key(user_id): (versions[user_id], user) for user_id, user in users.items()},
+        settings.USER_CACHE_TIMEOUT,
+    )
+
+
+def get_users(user_ids) -> dict[int, dict]:
+    user_ids = set(user_ids)
+    if not user_ids:
+        return {}
+    backend = get_backend()
+    if backend is None:
+        return _load_users(pk__in=user_ids)
+
+    versions, users = _get_cached_users(backend, user_ids)
+    missing = user_ids - users.keys()
+    if missing:
+        # Fills read the primary, a lagging replica would store an old row under the current version.
+        loaded = _load_users(using="default", pk__in=missing)
+        _set_cached_users(backend, versions, loaded)
+        users.update(loaded)
+    return users
+
+
+async def aget_users(user_ids) -> dict[int, dict]:
+    user_ids = set(user_ids)
+    if not user_ids:
+        return {}
+    backend = get_backend()
+    if backend is None:
+        return await _aload_users(pk__in=user_ids)
+
+    # Cache calls may block on the network; they touch no database connection, so any
+    # thread will do.
+    versions, users = await sync_to_async(_get_cached_users, thread_sensitive=False)(backend, user_ids)
+    missing = user_ids - users.keys()
+    if missing:
+        loaded = await _aload_users(using="default", pk__in=missing)
+        await sync_to_async(_set_cached_users, thread_sensitive=False)(backend, versions, loaded)
+        users.update(loaded)
+    return users
+
+
+def _get_cached_user_id(backend, phone_key: int) -> int | None:
+    key = _phone_key_key(phone_key)
+    return backend.get_many([key]).get(key)
+
+
+def _set_cached_user_id(backend, phone_key: int, user_id: int):
+    backend.set_many({_phone_key_key(phone_key): user_id}, settings.USER_CACHE_TIMEOUT)
+
+
+def _has_phone_key(user: dict | None, phone_key: int) -> bool:
+    # Phone numbers can be changed, so the mapping is only trusted while it still matches.
+    return user is not None and credit_charge.phone_numbers.to_phone_key(user["phone_number"]) == phone_key
+
+
+def get_user_by_phone_number(phone_number: str) -> dict | None:
+    phone_key = credit_charge.phone_numbers.to_phone_key(phone_number)
+    if phone_key is None:
+        return None
+    backend = get_backend()
+    if backend is None:
+        users = _load_users(phone_key=phone_key)
+        return next(iter(users.values()), None)
+
+    user_id = _get_cached_user_id(backend, phone_key)
+    if user_id is not None:
+        user = get_users([user_id]).get(user_id)
+        if _has_phone_key(user, phone_key):
+            return user
+
+    user_id = credit_charge.models.User.objects.filter(phone_key=phone_key).values_list("pk", flat=True).first()
+    if user_id is None:
+        return None
+    _set_cached_user_id(backend, phone_key, user_id)
+    return get_users([user_id]).get(user_id)
+
+
+async def aget_user_by_phone_number(phone_number: str) -> dict | None:
+    phone_key = credit_charge.phone_numbers.to_phone_key(phone_number)
+    if phone_key is None:
+        return None
+    backend = get_backend()
+    if backend is None:
+        users = await _aload_users(phone_key=phone_key)
+        return next(iter(users.values()), None)
+
+    user_id = await sync_to_async(_get_cached_user_id, thread_sensitive=False)(backend, phone_key)
+    if user_id is not None:
+        user = (await aget_users([user_id])).get(user_id)
+        if _has_phone_key(user, phone_key):
+            return user
+
+    user_id = await credit_charge.models.User.objects.filter(phone_key=phone_key).values_list("pk", flat=True).afirst()
+    if user_id is None:
+        return None
+    await sync_to_async(_set_cached_user_id, thread_sensitive=False)(backend, phone_key, user_id)
+    return (await aget_users([user_id])).get(user_id)
+
+
+def clear():
+    backend = get_backend()
+    if isinstance(backend, LRUBackend):
+        backend.clear()
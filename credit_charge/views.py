@@ -1,46 +1,242 @@
 import logging
 
+import rest_framework.exceptions
 import rest_framework.response
-from rest_framework import mixins, permissions, status, viewsets
+from asgiref.sync import sync_to_async
+from django import http
+from django.conf import settings
+from django.core import exceptions as django_exceptions
+from django.core.handlers import asgi
+from django.db import models
+from drf_spectacular import utils as drf_spectacular_utils
+from rest_framework import decorators, generics, mixins, permissions, status, viewsets
 
+import credit_charge.exceptions
+import credit_charge.exports
+import credit_charge.idempotency
 import credit_charge.models
+import credit_charge.partitions
+import credit_charge.phone_numbers
+import credit_charge.representations
+import credit_charge.rollups
 import credit_charge.serializers
 import credit_charge.services
+import credit_charge.user_cache
+import utils.db_retry
+import utils.replicas
 
 logger = logging.getLogger(__name__)
 
 
+def _database_busy_response() -> rest_framework.response.Response:
+    # Deadlocks and lock timeouts that outlasted the retries; unlike a 500 the client may just retry.
+    return rest_framework.response.Response(
+        {"message": "Too many concurrent transactions, try again"},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": "1"},
+    )
+
+
+def _export_response(
+    request,
+    export: credit_charge.exports.Export,
+    filters: credit_charge.serializers.ChargeFilterSerializer,
+) -> http.StreamingHttpResponse:
+    filters.is_valid(raise_exception=True)
+    queryset = filters.filter_queryset(export.model.objects.all(), request.user.pk)
+    # Rows are fetched while the response streams, after `replica_read` has returned.
+    queryset = queryset.using(queryset.db)
+    output = filters.validated_data["output"]
+    content = export.stream(queryset, output)
+    if isinstance(request._request, asgi.ASGIRequest):
+        # Django consumes a sync iterator under ASGI by reading it into a list first.
+        content = credit_charge.exports.aiterate(content)
+    response = http.StreamingHttpResponse(content, content_type=credit_charge.exports.FORMATS[output])
+    response["Content-Disposition"] = f'attachment; filename="{export.name}.{output}"'
+    return response
+
+
 class IsSellerOrAuthenticated(permissions.BasePermission):
+    seller_actions = ("create", "batch")
+
     def has_permission(self, request, view):
         user = request.user
-        if view.action != "create":
+        if view.action not in self.seller_actions:
             return user.is_authenticated
         return user.is_seller and user.is_authenticated
 
 
-class UserViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
-    queryset = credit_charge.models.User.objects.all()
+class FastReadMixin:
+    # Serves list and retrieve from `values()` rows through a precompiled representation,
+    # producing the same JSON as `serializer_class`.
+    representation: credit_charge.representations.Representation
+    # Rows missing from the table are looked up in the archive of this table, if set.
+    partitioned_table: credit_charge.partitions.PartitionedTable | None = None
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        # Writers read from the primary for a while, so that they see their own writes.
+        if status.is_success(response.status_code) and request.method not in permissions.SAFE_METHODS:
+            utils.replicas.pin_to_primary(request.user.pk)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    @utils.replicas.replica_read
+    def list(self, request, *args, **kwargs):
+        if not settings.API_FAST_READS:
+            return super().list(request, *args, **kwargs)
+        rows = self.representation.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(self.representation.render_many(page))
+        return rest_framework.response.Response(self.representation.render_many(rows))
+
+    @utils.replicas.replica_read
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            if not settings.API_FAST_READS:
+                return super().retrieve(request, *args, **kwargs)
+            rows = self.representation.values(self.filter_queryset(self.get_queryset()))
+            lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+            row = generics.get_object_or_404(rows, **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except http.Http404:
+            row = self.get_archived_row()
+            if row is None:
+                raise
+        self.check_object_permissions(request, row)
+        return rest_framework.response.Response(self.representation.render_one(row))
+
+    def get_archived_row(self) -> dict | None:
+        if self.partitioned_table is None:
+            return None
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        row = credit_charge.partitions.archived_row(self.partitioned_table, self.kwargs[lookup_url_kwarg])
+        if row is None:
+            return None
+        # Token users may carry the id as a string claim.
+        if str(self.request.user.pk) not in {str(row[field]) for field in self.partitioned_table.owner_fields}:
+            return None
+        return row
+
+    # Async counterparts used by credit_charge.async_views, on top of the same querysets,
+    # filters and pagination as the sync actions above.
+
+    @utils.replicas.replica_read
+    async def alist(self, request, *args, **kwargs):
+        rows = self.representation.values(self.filter_queryset(self.get_queryset()))
+        if self.paginator is not None:
+            page = await self.paginator.apaginate_queryset(rows, request, view=self)
+            return self.get_paginated_response(await self.representation.arender_many(page))
+        return rest_framework.response.Response(await self.representation.arender_many([row async for row in rows]))
+
+    @utils.replicas.replica_read
+    async def aretrieve(self, request, *args, **kwargs):
+        rows = self.representation.values(self.filter_queryset(self.get_queryset()))
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            row = await rows.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]}).afirst()
+        except (TypeError, ValueError, django_exceptions.ValidationError):
+            raise http.Http404 from None
+        if row is None:
+            row = await sync_to_async(self.get_archived_row)()
+        if row is None:
+            raise http.Http404(f"No {rows.model._meta.object_name} matches the given query.")
+        self.check_object_permissions(request, row)
+        return rest_framework.response.Response(await self.representation.arender_one(row))
+
+
+class UserViewSet(FastReadMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    representation = credit_charge.representations.USER
+    queryset = credit_charge.models.User.objects.with_shard_balance()
     serializer_class = credit_charge.serializers.UserSerializer
     lookup_field = "phone_number"
 
+    def get_object(self):
+        # Any form of the phone number in the URL finds the user, through the numeric key.
+        phone_key = credit_charge.phone_numbers.to_phone_key(self.kwargs[self.lookup_field])
+        if phone_key is None:
+            raise http.Http404
+        user = generics.get_object_or_404(self.filter_queryset(self.get_queryset()), phone_key=phone_key)
+        self.check_object_permissions(self.request, user)
+        return user
+
+    @utils.replicas.replica_read
+    def retrieve(self, request, *args, **kwargs):
+        if not settings.API_FAST_READS:
+            return super().retrieve(request, *args, **kwargs)
+        user = credit_charge.user_cache.get_user_by_phone_number(self.kwargs[self.lookup_field])
+        if user is None:
+            raise rest_framework.exceptions.NotFound()
+        return rest_framework.response.Response(user)
+
+    @utils.replicas.replica_read
+    async def aretrieve(self, request, *args, **kwargs):
+        user = await credit_charge.user_cache.aget_user_by_phone_number(self.kwargs[self.lookup_field])
+        if user is None:
+            raise rest_framework.exceptions.NotFound()
+        return rest_framework.response.Response(user)
+
+    @drf_spectacular_utils.extend_schema(
+        parameters=[credit_charge.serializers.UserSummaryFilterSerializer],
+        responses=credit_charge.serializers.UserSummarySerializer,
+    )
+    @decorators.action(detail=True, methods=["get"])
+    @utils.replicas.replica_read
+    def summary(self, request, *args, **kwargs):
+        # Answered from the daily rollups, so the cost depends on the range, not the history.
+        phone_key = credit_charge.phone_numbers.to_phone_key(self.kwargs[self.lookup_field])
+        if phone_key is None:
+            raise http.Http404
+        user_id = credit_charge.models.User.objects.filter(phone_key=phone_key).values_list("pk", flat=True).first()
+        # Users only see their own summary, staff see everyone's. Token users may carry the id as a string claim.
+        if user_id is None or (str(user_id) != str(request.user.pk) and not request.user.is_staff):
+            raise http.Http404
+        filters = credit_charge.serializers.UserSummaryFilterSerializer(data=request.query_params)
+        filters.is_valid(raise_exception=True)
+        summary = credit_charge.rollups.summarize(user_id=user_id, **filters.validated_data)
+        return rest_framework.response.Response(credit_charge.serializers.UserSummarySerializer(summary).data)
+
 
 class ChargeViewSet(
+    FastReadMixin,
     mixins.ListModelMixin,
     mixins.RetrieveModelMixin,
     mixins.CreateModelMixin,
     viewsets.GenericViewSet,
 ):
     serializer_class = credit_charge.serializers.ChargeSerializer
+    representation = credit_charge.representations.CHARGE
+    partitioned_table = credit_charge.partitions.CHARGES
     queryset = credit_charge.models.Charge.objects.select_related("user").all()
     lookup_field = "transaction_id"
     permission_classes = [IsSellerOrAuthenticated]
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action != "list":
+            return queryset.filter(user_id=self.request.user.pk)
+        filters = credit_charge.serializers.ChargeFilterSerializer(data=self.request.query_params)
+        filters.is_valid(raise_exception=True)
+        return filters.filter_queryset(queryset, self.request.user.pk)
+
+    @drf_spectacular_utils.extend_schema(parameters=[credit_charge.serializers.ChargeFilterSerializer])
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @drf_spectacular_utils.extend_schema(parameters=[credit_charge.serializers.ChargeExportFilterSerializer])
+    @decorators.action(detail=False, methods=["get"])
+    @utils.replicas.replica_read
+    def export(self, request, *args, **kwargs):
+        filters = credit_charge.serializers.ChargeExportFilterSerializer(data=request.query_params)
+        return _export_response(request, credit_charge.exports.CHARGES, filters)
+
+    @credit_charge.idempotency.idempotent
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         amount = serializer.validated_data["amount"]
         try:
-            charge = credit_charge.models.Charge.create_charge(user=request.user, amount=amount)
+            # The authenticated user may be built from token claims, the response needs the row.
+            user = credit_charge.models.User.objects.with_shard_balance().get(pk=request.user.pk)
+            charge = credit_charge.models.Charge.create_charge(user=user, amount=amount)
         except Exception as e:
             logger.error(f"Unexpected error: {str(e)}")
             return rest_framework.response.Response(
@@ -53,6 +249,7 @@ class ChargeViewSet(
 
 
 class UserTransactionViewSet(
+    FastReadMixin,
     mixins.ListModelMixin,
     mixins.RetrieveModelMixin,
     mixins.CreateModelMixin,
@@ -62,7 +259,32 @@ class UserTransactionViewSet(
     lookup_field = "transaction_id"
     permission_classes = [IsSellerOrAuthenticated]
     serializer_class = credit_charge.serializers.UserTransactionSerializer
+    representation = credit_charge.representations.USER_TRANSACTION
+    partitioned_table = credit_charge.partitions.TRANSACTIONS
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        user_id = self.request.user.pk
+        if self.action != "list":
+            return queryset.filter(models.Q(seller_id=user_id) | models.Q(receiver_user_id=user_id))
+        filters = credit_charge.serializers.UserTransactionFilterSerializer(data=self.request.query_params)
+        filters.is_valid(raise_exception=True)
+        return filters.filter_queryset(queryset, user_id)
+
+    @drf_spectacular_utils.extend_schema(parameters=[credit_charge.serializers.UserTransactionFilterSerializer])
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
 
+    @drf_spectacular_utils.extend_schema(
+        parameters=[credit_charge.serializers.UserTransactionExportFilterSerializer],
+    )
+    @decorators.action(detail=False, methods=["get"])
+    @utils.replicas.replica_read
+    def export(self, request, *args, **kwargs):
+        filters = credit_charge.serializers.UserTransactionExportFilterSerializer(data=request.query_params)
+        return _export_response(request, credit_charge.exports.TRANSACTIONS, filters)
+
+    @credit_charge.idempotency.idempotent
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -77,6 +299,11 @@ class UserTransactionViewSet(
                 amount=amount,
             )
         except Exception as e:
+            if (
+                isinstance(e, credit_charge.exceptions.TransferTimeoutError)
+                or utils.db_retry.transient_reason(e) is not None
+            ):
+                return _database_busy_response()
             logger.error(f"Unexpected error: {str(e)}")
             return rest_framework.response.Response(
                 {"message": "Unexpected error"},
@@ -85,3 +312,41 @@ class UserTransactionViewSet(
 
         response_serializer = self.get_serializer(transaction)
         return rest_framework.response.Response(response_serializer.data, status=status.HTTP_201_CREATED)
+
+    @decorators.action(
+        detail=False,
+        methods=["post"],
+        serializer_class=credit_charge.serializers.BatchUserTransactionSerializer,
+    )
+    @credit_charge.idempotency.idempotent
+    def batch(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        items = [(item["receiver_phone_number"], item["amount"]) for item in serializer.validated_data["items"]]
+        try:
+            seller, results = credit_charge.services.create_batch_transaction(
+                seller_phone_number=request.user.phone_number,
+                items=items,
+            )
+        except rest_framework.exceptions.ValidationError:
+            raise
+        except Exception as e:
+            if utils.db_retry.transient_reason(e) is not None:
+                return _database_busy_response()
+            logger.error(f"Unexpected error: {str(e)}")
+            return rest_framework.response.Response(
+                {"message": "Unexpected error"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+        if seller.is_balance_sharded:
+            # The shards' committed total is read back rather than tracked by the batch.
+            seller = credit_charge.models.User.objects.with_shard_balance().get(pk=seller.pk)
+
+        return rest_framework.response.Response(
+            {
+                "seller": credit_charge.serializers.UserSerializer(seller).data,
+                "results": credit_charge.serializers.BatchUserTransactionResultSerializer(results, many=True).data,
+            },
+            status=status.HTTP_201_CREATED,
+        )
@@ -19,5 +19,25 @@ if [ "$ENVIRONMENT" = "development" ]; then
     python insert_init_data.py
 fi
 
+# Both servers listen on the same address with the same number of workers.
+BIND_HOST="${BIND_HOST:-0.0.0.0}"
+PORT="${PORT:-8000}"
+WORKERS="${WEB_CONCURRENCY:-5}"
+
+# SERVER=asgi serves the list and retrieve endpoints through the async ORM under uvicorn,
+# anything else keeps the sync gunicorn workers.
+if [ "$SERVER" = "asgi" ]; then
+    echo "Starting Uvicorn..."
+    export API_ASYNC_READS=True
+    exec uvicorn core.asgi:application --host "$BIND_HOST" --port "$PORT" --workers "$WORKERS"
+fi
+
+# Group commit coalesces the transfers in flight in one worker process, a sync worker only
+# ever has one of them, so workers get threads when it is enabled.
+THREADS=1
+if [ "$TRANSFER_GROUP_COMMIT" = "True" ]; then
+    THREADS="${GUNICORN_THREADS:-8}"
+fi
+
 echo "Starting Gunicorn..."
-gunicorn core.wsgi --bind 0.0.0.0:8000 --timeout 1000 -w 5 --reload
+gunicorn core.wsgi --bind "$BIND_HOST:$PORT" --timeout 1000 -w "$WORKERS" --threads "$THREADS" --reload
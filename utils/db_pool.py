@@ -0,0 +1,62 @@
+from django.db import connections
+from rest_framework import authentication, permissions, response, views
+from rest_framework.settings import api_settings
+
+import utils.metrics
+
+
+def get_pool_stats() -> dict[str, dict]:
+    # Statistics of the connection pools opened by this process, keyed by database alias.
+    # psycopg_pool only reports counters that are not zero.
+    stats = {}
+    for alias in connections:
+        pool = getattr(connections[alias], "pool", None)
+        # Pools are opened by the first connection of the process.
+        if pool is None or pool.closed:
+            continue
+        pool_stats = pool.get_stats()
+        checkouts = pool_stats.get("requests_num", 0)
+        in_use = pool_stats.get("pool_size", 0) - pool_stats.get("pool_available", 0)
+        stats[alias] = {
+            "checkouts": checkouts,
+            "waiting": pool_stats.get("requests_waiting", 0),
+            "queued": pool_stats.get("requests_queued", 0),
+            "wait_ms": pool_stats.get("requests_wait_ms", 0),
+            "avg_wait_ms": pool_stats.get("requests_wait_ms", 0) / checkouts if checkouts else 0,
+            "timeouts": pool_stats.get("requests_errors", 0),
+            "size": pool_stats.get("pool_size", 0),
+            "in_use": in_use,
+            "max_size": pool_stats.get("pool_max", 0),
+            "saturation": in_use / pool_stats["pool_max"] if pool_stats.get("pool_max") else 0,
+            "connections_opened": pool_stats.get("connections_num", 0),
+            "connections_lost": pool_stats.get("connections_lost", 0),
+        }
+    return stats
+
+
+@utils.metrics.register_collector
+def pool_metrics() -> list[str]:
+    stats = get_pool_stats()
+    metrics = (
+        ("db_pool_checkouts_total", "counter", "Connections handed out by the pool.", "checkouts", 1),
+        ("db_pool_wait_seconds_total", "counter", "Time spent waiting for a pooled connection.", "wait_ms", 0.001),
+        ("db_pool_timeouts_total", "counter", "Checkouts that timed out waiting for a connection.", "timeouts", 1),
+        ("db_pool_waiting", "gauge", "Requests waiting for a pooled connection.", "waiting", 1),
+        ("db_pool_connections_in_use", "gauge", "Pooled connections checked out.", "in_use", 1),
+        ("db_pool_saturation", "gauge", "Share of the pool's maximum size checked out.", "saturation", 1),
+    )
+    lines = []
+    for name, metric_type, documentation, key, scale in metrics:
+        lines.extend((f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}"))
+        lines.extend(f'{name}{{alias="{alias}"}} {alias_stats[key] * scale}' for alias, alias_stats in stats.items())
+    return lines
+
+
+class PoolStatsView(views.APIView):
+    # Pools are per worker process; each request reports the pool of the worker serving it.
+    # Access tokens carry no staff claim, so staff read it with their admin session.
+    authentication_classes = [authentication.SessionAuthentication, *api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return response.Response(get_pool_stats())
@@ -0,0 +1,78 @@
+import functools
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+import utils.metrics
+
+logger = logging.getLogger(__name__)
+
+# SQLSTATEs of errors that go away when the transaction is run again.
+TRANSIENT_SQLSTATES = {
+    "40001": "serialization_failure",
+    "40P01": "deadlock",
+    "55P03": "lock_timeout",
+}
+
+RETRIES = utils.metrics.Counter(
+    "db_transaction_retries_total",
+    "Transactions run again after a transient database error.",
+    labels=("operation", "reason"),
+)
+GIVE_UPS = utils.metrics.Counter(
+    "db_transaction_give_ups_total",
+    "Transactions that still failed with a transient database error after the last attempt.",
+    labels=("operation", "reason"),
+)
+
+
+def transient_reason(error: Exception) -> str | None:
+    if not isinstance(error, DatabaseError):
+        return None
+    cause = error.__cause__
+    sqlstate = getattr(cause, "sqlstate", None) or getattr(cause, "pgcode", None)
+    if sqlstate is not None:
+        return TRANSIENT_SQLSTATES.get(sqlstate)
+    # SQLite reports lock contention by message only.
+    if "database is locked" in str(error) or "database table is locked" in str(error):
+        return "database_locked"
+    return None
+
+
+def get_backoff(attempt: int) -> float:
+    # Full jitter: a random delay up to an exponentially growing cap, so that transactions
+    # that collided once do not collide again on their retry.
+    cap = min(settings.DB_RETRY_MAX_DELAY_MS, settings.DB_RETRY_BASE_DELAY_MS * 2 ** (attempt - 1))
+    return random.uniform(0, cap) / 1000  # noqa: S311
+
+
+def retry_transient_errors(operation: str):
+    # Runs the decorated transaction again on deadlocks, serialization failures and lock
+    # timeouts. Only the outermost transaction can be retried, inside a caller's atomic
+    # block the error is raised as is.
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            attempt = 1
+            while True:
+                try:
+                    return func(*args, **kwargs)
+                except DatabaseError as e:
+                    reason = transient_reason(e)
+                    if reason is None or transaction.get_connection().in_atomic_block:
+                        raise
+                    if attempt >= settings.DB_RETRY_ATTEMPTS:
+                        GIVE_UPS.inc(operation=operation, reason=reason)
+                        logger.error(f"Giving up {operation} after {attempt} attempts: {e}")
+                        raise
+                    RETRIES.inc(operation=operation, reason=reason)
+                    logger.warning(f"Retrying {operation} after {reason} (attempt {attempt}): {e}")
+                    time.sleep(get_backoff(attempt))
+                    attempt += 1
+
+        return wrapper
+
+    return decorator
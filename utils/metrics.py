@@ -0,0 +1,277 @@
+import bisect
+import contextlib
+import contextvars
+import hmac
+import http.server
+import math
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseForbidden
+
+# A small in-process Prometheus registry. Metrics are kept per worker process, so scrape each
+# worker (or run a single process per container) to see all of them.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_metrics = []
+_collectors = []
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+        _metrics.append(self)
+
+    def key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, "", value) for key, value in self.values.items()]
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for name, key, extra, value in self.samples():
+            lines.append(f"{name}{_format_labels(self.labels, key, extra)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            value = self.values.get(key, 0) + amount
+            # Series of per-entity gauges are dropped at zero to keep their number bounded.
+            if value:
+                self.values[key] = value
+            else:
+                self.values.pop(key, None)
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    @contextlib.contextmanager
+    def track(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # Per bucket counts, then the sum and the total count.
+                counts = self.values[key] = [0] * (len(self.buckets) + 3)
+            counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self.lock:
+            values = {key: list(counts) for key, counts in self.values.items()}
+        samples = []
+        for key, counts in values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", key, f'le="{_format_value(bound)}"', cumulative))
+            samples.append((f"{self.name}_sum", key, "", counts[-2]))
+            samples.append((f"{self.name}_count", key, "", counts[-1]))
+        return samples
+
+
+def register_collector(collector):
+    # `collector()` returns exposition lines computed at scrape time.
+    _collectors.append(collector)
+    return collector
+
+
+def render() -> str:
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for collector in _collectors:
+        lines.extend(collector())
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    for metric in _metrics:
+        with metric.lock:
+            metric.values.clear()
+
+
+def is_authorized(authorization: str | None) -> bool:
+    token = settings.METRICS_TOKEN
+    return not token or hmac.compare_digest((authorization or "").encode(), f"Bearer {token}".encode())
+
+
+def metrics_view(request):
+    if not is_authorized(request.headers.get("Authorization")):
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+class _MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if not is_authorized(self.headers.get("Authorization")):
+            self.send_error(403)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port: int, address: str = "127.0.0.1") -> http.server.ThreadingHTTPServer:
+    # Serves the metrics of a process that has no HTTP server of its own, like a worker command.
+    server = http.server.ThreadingHTTPServer((address, port), _MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Time spent serving HTTP requests.",
+    labels=("method", "route", "status"),
+)
+HTTP_REQUEST_QUERIES = Histogram(
+    "http_request_queries",
+    "Database queries executed per HTTP request.",
+    labels=("method", "route"),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89),
+)
+
+_query_count = contextvars.ContextVar("query_count", default=None)
+
+
+def _count_query(execute, sql, params, many, context):
+    count = _query_count.get()
+    if count is not None:
+        count[0] += 1
+    return execute(sql, params, many, context)
+
+
+@receiver(connection_created)
+def _install_query_counter(sender, connection, **kwargs):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+class MetricsMiddleware:
+    # Records the duration and the number of queries of every request. The query counter is a
+    # context variable, so queries run by sync_to_async threads of async views are counted.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Connections opened before the middleware was loaded missed connection_created.
+        for connection in connections.all(initialized_only=True):
+            _install_query_counter(sender=None, connection=connection)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started, token = time.perf_counter(), _query_count.set([0])
+        try:
+            response = self.get_response(request)
+        finally:
+            queries = _query_count.get()[0]
+            _query_count.reset(token)
+        self.observe(request, response, started, queries)
+        return response
+
+    async def __acall__(self, request):
+        started, token = time.perf_counter(), _query_count.set([0])
+        try:
+            response = await self.get_response(request)
+        finally:
+            queries = _query_count.get()[0]
+            _query_count.reset(token)
+        self.observe(request, response, started, queries)
+        return response
+
+    def observe(self, request, response, started: float, queries: int):
+        match = request.resolver_match
+        route = match.route if match is not None else "unmatched"
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            route=route,
+            status=response.status_code,
+        )
+        HTTP_REQUEST_QUERIES.observe(queries, method=request.method, route=route)
@@ -0,0 +1,191 @@
+import base64
+import datetime
+import hashlib
+from urllib import parse
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, models
+from rest_framework import exceptions, pagination, response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def estimated_count(queryset: models.QuerySet) -> int | None:
+    # Unfiltered querysets use the planner's row estimate instead of scanning the table; for a
+    # partitioned table, the sum of its partitions' estimates. None when the queryset is
+    # filtered, the database is not PostgreSQL or the table was never analyzed.
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql" or queryset.query.where:
+        return None
+    table = queryset.model._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT SUM(reltuples)::bigint FROM pg_class "
+            "WHERE reltuples >= 0 AND relkind <> 'p' AND (oid = %s::regclass "
+            "OR oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = %s::regclass))",
+            [table, table],
+        )
+        return cursor.fetchone()[0]
+
+
+class KeysetPagination(pagination.BasePagination):
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    count_query_param = "count"
+    position_field = "created_at"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = self.get_count(queryset) if self.count_requested(request) else None
+        page_queryset = self.get_page_queryset(queryset, request)
+        return self.get_page(list(page_queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.count = await sync_to_async(self.get_count)(queryset) if self.count_requested(request) else None
+        page_queryset = self.get_page_queryset(queryset, request)
+        return self.get_page([row async for row in page_queryset])
+
+    def get_page_queryset(self, queryset, request) -> models.QuerySet:
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.cursor = self.decode_cursor(request)
+        self.reverse = self.cursor is not None and self.cursor[2]
+        if self.reverse:
+            queryset = queryset.order_by(self.position_field, "id")
+        else:
+            queryset = queryset.order_by(f"-{self.position_field}", "-id")
+
+        if self.cursor is not None:
+            # The `created_at <= position` range keeps the scan on the created_at index,
+            # the OR only breaks ties between rows created in the same microsecond.
+            position, pk, _ = self.cursor
+            lookup = "gt" if self.reverse else "lt"
+            queryset = queryset.filter(**{f"{self.position_field}__{lookup}e": position}).filter(
+                models.Q(**{f"{self.position_field}__{lookup}": position})
+                | models.Q(**{self.position_field: position, f"id__{lookup}": pk}),
+            )
+        return queryset[: self.page_size + 1]
+
+    def get_page(self, results: list) -> list:
+        has_more = len(results) > self.page_size
+        results = results[: self.page_size]
+        if self.reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+
+        self.first, self.last = (results[0], results[-1]) if results else (None, None)
+        return results
+
+    def get_page_size(self, request) -> int:
+        page_size = settings.REST_FRAMEWORK["PAGE_SIZE"]
+        try:
+            requested = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return page_size
+        if requested <= 0:
+            return page_size
+        return min(requested, settings.PAGINATION_MAX_PAGE_SIZE)
+
+    def count_requested(self, request) -> bool:
+        return request.query_params.get(self.count_query_param, "").lower() in ("1", "true")
+
+    def get_count(self, queryset: models.QuerySet) -> int:
+        estimate = estimated_count(queryset)
+        if estimate is not None:
+            return estimate
+
+        key = f"pagination-count:{hashlib.sha256(str(queryset.query).encode()).hexdigest()}"
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, settings.PAGINATION_COUNT_CACHE_SECONDS)
+        return count
+
+    def decode_cursor(self, request) -> tuple[datetime.datetime, int, bool] | None:
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            tokens = parse.parse_qs(base64.urlsafe_b64decode(encoded.encode("ascii")).decode("ascii"))
+            position = datetime.datetime.fromisoformat(tokens["p"][0])
+            pk = int(tokens["i"][0])
+            reverse = tokens.get("r", ["0"])[0] == "1"
+        except (KeyError, TypeError, ValueError, UnicodeError):
+            raise exceptions.NotFound(self.invalid_cursor_message) from None
+        return position, pk, reverse
+
+    def encode_cursor(self, row, reverse: bool) -> str:
+        if isinstance(row, dict):
+            position, pk = row[self.position_field], row["id"]
+        else:
+            position, pk = getattr(row, self.position_field), row.pk
+        tokens = {"p": position.isoformat(), "i": pk}
+        if reverse:
+            tokens["r"] = 1
+        encoded = base64.urlsafe_b64encode(parse.urlencode(tokens).encode("ascii")).decode("ascii")
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self) -> str | None:
+        if not self.has_next:
+            return None
+        if self.last is None:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.last, reverse=False)
+
+    def get_previous_link(self) -> str | None:
+        if not self.has_previous:
+            return None
+        if self.first is None:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.first, reverse=True)
+
+    def get_paginated_response(self, data):
+        return response.Response(
+            {
+                "count": self.count,
+                "next": self.get_next_link(),
+                "previous": self.get_previous_link(),
+                "results": data,
+            },
+        )
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "count": {"type": "integer", "nullable": True, "example": 123},
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "The pagination cursor value.",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": self.page_size_query_param,
+                "required": False,
+                "in": "query",
+                "description": f"Number of results to return per page, at most {settings.PAGINATION_MAX_PAGE_SIZE}.",
+                "schema": {"type": "integer"},
+            },
+            {
+                "name": self.count_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Include an estimated or cached total count.",
+                "schema": {"type": "boolean"},
+            },
+        ]
@@ -0,0 +1,156 @@
+import contextlib
+import contextvars
+import functools
+import inspect
+import itertools
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, InterfaceError, OperationalError, connections
+
+logger = logging.getLogger(__name__)
+
+# Reads wrapped with `replica_read` go to one of settings.DB_READ_REPLICAS, unless the user
+# wrote recently or no replica is healthy, in which case they stay on the primary. A replica
+# is skipped for DB_REPLICA_RETRY_SECONDS after it fails a query or its lag check.
+
+LAG_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+END
+"""
+
+_read_alias = contextvars.ContextVar("read_alias", default=None)
+_unavailable_until: dict[str, float] = {}
+_checked_at: dict[str, float] = {}
+_next_replica = itertools.count()
+
+
+def _pin_key(user_id) -> str:
+    return f"primary-pin:{user_id}"
+
+
+def pin_to_primary(user_id):
+    if settings.DB_READ_REPLICAS and user_id is not None:
+        cache.set(_pin_key(user_id), True, settings.DB_REPLICA_PIN_SECONDS)
+
+
+def is_pinned(user_id) -> bool:
+    return user_id is not None and cache.get(_pin_key(user_id)) is not None
+
+
+def mark_unavailable(alias: str, reason):
+    logger.warning(f"Reading from the primary instead of {alias}: {reason}")
+    _unavailable_until[alias] = time.monotonic() + settings.DB_REPLICA_RETRY_SECONDS
+
+
+def get_lag(alias: str) -> float:
+    connection = connections[alias]
+    if connection.vendor != "postgresql":
+        return 0.0
+    with connection.cursor() as cursor:
+        cursor.execute(LAG_SQL)
+        (lag,) = cursor.fetchone()
+    return float(lag or 0)
+
+
+def is_available(alias: str) -> bool:
+    now = time.monotonic()
+    if _unavailable_until.get(alias, 0) > now:
+        return False
+    if _checked_at.get(alias, 0) + settings.DB_REPLICA_CHECK_SECONDS > now:
+        return True
+    _checked_at[alias] = now
+    try:
+        lag = get_lag(alias)
+    except DatabaseError as e:
+        mark_unavailable(alias, e)
+        return False
+    if lag > settings.DB_REPLICA_MAX_LAG_SECONDS:
+        mark_unavailable(alias, f"{lag:.1f}s behind the primary")
+        return False
+    return True
+
+
+def choose_database(user_id) -> str:
+    if is_pinned(user_id):
+        return "default"
+    replicas = [alias for alias in settings.DB_READ_REPLICAS if is_available(alias)]
+    if not replicas:
+        return "default"
+    return replicas[next(_next_replica) % len(replicas)]
+
+
+@contextlib.contextmanager
+def reading_from(alias: str):
+    token = _read_alias.set(alias)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def reset():
+    _unavailable_until.clear()
+    _checked_at.clear()
+
+
+def replica_read(view_method):
+    # Runs a read-only view action against a replica chosen for `request.user`. Reads are
+    # retried on the primary when the replica fails mid-request.
+    failures = (OperationalError, InterfaceError)
+
+    if inspect.iscoroutinefunction(view_method):
+
+        @functools.wraps(view_method)
+        async def async_wrapper(view, request, *args, **kwargs):
+            if not settings.DB_READ_REPLICAS or _read_alias.get() is not None:
+                return await view_method(view, request, *args, **kwargs)
+            alias = await sync_to_async(choose_database)(request.user.pk)
+            try:
+                with reading_from(alias):
+                    return await view_method(view, request, *args, **kwargs)
+            except failures as e:
+                if alias == "default":
+                    raise
+                mark_unavailable(alias, e)
+            with reading_from("default"):
+                return await view_method(view, request, *args, **kwargs)
+
+        return async_wrapper
+
+    @functools.wraps(view_method)
+    def wrapper(view, request, *args, **kwargs):
+        if not settings.DB_READ_REPLICAS or _read_alias.get() is not None:
+            return view_method(view, request, *args, **kwargs)
+        alias = choose_database(request.user.pk)
+        try:
+            with reading_from(alias):
+                return view_method(view, request, *args, **kwargs)
+        except failures as e:
+            if alias == "default":
+                raise
+            mark_unavailable(alias, e)
+        with reading_from("default"):
+            return view_method(view, request, *args, **kwargs)
+
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive the schema through replication.
+        return db == "default"
@@ -0,0 +1,77 @@
+import json
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+logger = logging.getLogger(__name__)
+
+# Request bodies larger than this are not recorded, the replayed request is sent without one.
+MAX_BODY_BYTES = 64 * 1024
+# Bodies of the token endpoints are credentials and never recorded; replay_requests signs its
+# own tokens. Keys holding secrets are redacted from every other body.
+UNRECORDED_BODY_PATHS = ("/api/v1/token/",)
+REDACTED_KEYS = frozenset({"password", "refresh", "access", "token"})
+
+
+def redact(body):
+    if isinstance(body, dict):
+        return {key: "[REDACTED]" if key in REDACTED_KEYS else redact(value) for key, value in body.items()}
+    if isinstance(body, list):
+        return [redact(item) for item in body]
+    return body
+
+
+class RequestLogMiddleware:
+    # Writes one JSON line per API request, in the format `manage.py replay_requests` reads:
+    # {"ts": ..., "method": ..., "path": ..., "user": ..., "body": ..., "status": ...}.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not request.path.startswith("/api/"):
+            return self.get_response(request)
+        started, body = time.time(), self.read_body(request)
+        response = self.get_response(request)
+        self.record(request, response, started, body)
+        return response
+
+    async def __acall__(self, request):
+        if not request.path.startswith("/api/"):
+            return await self.get_response(request)
+        started, body = time.time(), self.read_body(request)
+        response = await self.get_response(request)
+        self.record(request, response, started, body)
+        return response
+
+    def read_body(self, request):
+        # Read before the view, which consumes the stream; Django keeps the bytes for it.
+        if request.path.startswith(UNRECORDED_BODY_PATHS):
+            return None
+        if request.content_type != "application/json" or int(request.META.get("CONTENT_LENGTH") or 0) > MAX_BODY_BYTES:
+            return None
+        try:
+            return redact(json.loads(request.body)) if request.body else None
+        except ValueError:
+            return None
+
+    def record(self, request, response, started: float, body):
+        # DRF authenticates inside the view and sets the user on the Django request too.
+        user = getattr(request, "user", None)
+        entry = {
+            "ts": round(started, 6),
+            "method": request.method,
+            "path": request.get_full_path(),
+            "user": getattr(user, "phone_number", None) if user is not None and user.is_authenticated else None,
+            "body": body,
+            "status": response.status_code,
+        }
+        logger.info(json.dumps(entry, ensure_ascii=False))